@@ -38,6 +38,11 @@ def create_app(test_config=None):
             cursor.execute("PRAGMA foreign_keys=ON;")
             cursor.close()
 
+    # count and time the statements of each request and background job
+    from app.utils import query_utils
+
+    query_utils.init_app(app)
+
     # ==============================================================================
     # Login Manager
     # ==============================================================================
@@ -51,6 +56,46 @@ def create_app(test_config=None):
     # ==============================================================================
     executor.init_app(app)
 
+    # ==============================================================================
+    # Market Data Provider
+    # ==============================================================================
+    from app import market_data
+
+    market_data.init_app(app)
+
+    # ==============================================================================
+    # Search Index
+    # ==============================================================================
+    from app.utils import search_utils
+
+    search_utils.init_app(app)
+
+    # ==============================================================================
+    # Stock Page Cache
+    # ==============================================================================
+    from app.utils import cache_utils
+
+    cache_utils.init_app(app)
+
+    # ==============================================================================
+    # Price Alert Book
+    # ==============================================================================
+    from app.utils import alert_utils
+
+    alert_utils.init_app(app)
+
+    # ==============================================================================
+    # Prediction Models
+    # ==============================================================================
+    from predict.ml_utils import ml_predict
+
+    ml_predict.init_inference()
+
+    if app.config["PREDICT_WARMUP"]:
+        from predict.ml_utils.registry import registry
+
+        registry.warmup(app.config["TOP_COMPANIES"])
+
     # ==============================================================================
     # Initialise backend APIs
     # ==============================================================================
@@ -70,4 +115,8 @@ def create_app(test_config=None):
 
     portfolio_challenge.init_app(app)
 
+    from app.commands import market_data as market_data_cli
+
+    market_data_cli.init_app(app)
+
     return app
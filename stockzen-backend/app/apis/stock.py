@@ -1,5 +1,6 @@
 import app.utils.crud_utils as util
 from app import executor
+from app.utils import api_utils
 from app.utils.calc_utils import propagate_portfolio_updates
 from app.utils.enums import Status
 from flask import request
@@ -140,7 +141,7 @@ class StockCRUD(Resource):
         stock_page_id = json["stockPageId"]
 
         # concurrent request for latest stock data, finishes after response
-        executor.submit(util.update_stock_page, stock_page_id)
+        executor.submit(api_utils.api_stock_request, stock_page_id)
 
         if util.add_stock(portfolioId, stock_page_id) == Status.SUCCESS:
             return {"message": "Stock successfully added"}, 200
@@ -1,4 +1,5 @@
 import app.utils.crud_utils as crud
+import app.utils.refresh_utils as refresh
 import app.utils.utils as utils
 from app.config import TOP_COMPANIES
 from app.utils.enums import Status
@@ -110,8 +111,9 @@ class StockPageCRUD(Resource):
         """Fetch stock page data"""
 
         # Get latest data from yfinance, if fail don't abort, just return latest (cached) data
+        # usable cache is returned straight away and refreshed in the background
         try:
-            if crud.update_stock_page(stockPageId) == Status.FAIL:
+            if refresh.revalidate_stock_page(stockPageId) == Status.FAIL:
                 raise ConnectionError(
                     f"Could not fetch latest data for stockPageId: {stockPageId}, attempting to return from cache."
                 )
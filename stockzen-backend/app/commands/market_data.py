@@ -0,0 +1,42 @@
+import json
+import os
+
+import click
+from app.market_data import YFinanceProvider
+from flask import current_app
+from flask.cli import AppGroup
+
+user_cli = AppGroup("market-data")
+
+
+# Record yfinance data as fixtures for the replay provider
+@user_cli.command("record")
+@click.argument("symbols", nargs=-1, required=True)
+@click.option("--period", default="max", help="History period to record")
+@click.option("--interval", default="1d", help="Bar interval to record")
+def do_record(symbols, period, interval):
+    data_dir = current_app.config["REPLAY_DATA_DIR"]
+    os.makedirs(data_dir, exist_ok=True)
+    provider = YFinanceProvider()
+
+    for sym in symbols:
+        try:
+            history = provider.history(sym, period=period, interval=interval)
+            if len(history) == 0:
+                raise RuntimeError(f"No history found for {sym}")
+
+            name = sym if interval == "1d" else f"{sym}_{interval}"
+            history[["Open", "High", "Low", "Close", "Volume"]].to_csv(
+                os.path.join(data_dir, f"{name}.csv")
+            )
+            if interval == "1d":
+                with open(os.path.join(data_dir, f"{sym}.json"), "w") as f:
+                    json.dump(provider.info(sym), f, default=str)
+
+            print(f"Recorded {len(history)} bars for {sym}")
+        except Exception as ex:
+            print(ex)
+
+
+def init_app(app):
+    app.cli.add_command(user_cli)
@@ -4,7 +4,7 @@ from datetime import datetime
 import click
 from app.config import CHALLENGE_PERIOD, CHALLENGE_START, SLEEP_INTERVAL
 from app.models.schema import Challenge
-from app.utils import db_utils, utils
+from app.utils import crud_utils, db_utils, utils
 from app.utils.enums import Status
 from flask.cli import AppGroup
 
@@ -54,6 +54,9 @@ def start_challenge(env):
 
         stop_challenge()
 
+        # leaderboard is final once all challenge stocks are updated
+        crud_utils.save_leaderboard_snapshot(challenge_id)
+
         db_utils.update_item_columns(
             Challenge,
             challenge_id,
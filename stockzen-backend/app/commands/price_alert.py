@@ -1,268 +1,195 @@
-import datetime
+import multiprocessing
 import time
-
-from app import db, mail
-from app.config import MAIL_SENDER
-from app.models.schema import Portfolio, PriceAlert, Stock, StockPage, User
+from typing import List
+
+import click
+from app import db
+from app.config import ALERT_RATE_LIMIT, ALERT_SHARDS
+from app.models.schema import MailOutbox, PriceAlert
+from app.utils import alert_utils, mail_utils, query_utils
+from flask import current_app
 from flask.cli import AppGroup
-from flask_mail import Message
-from sqlalchemy import func, not_, or_, select, update
-from yfinance import Ticker
+from pandas.core.frame import DataFrame
+from sqlalchemy import update
+from sqlalchemy.dialects.sqlite import insert
 
 user_cli = AppGroup("price-alert")
 
 
 # A command to run in the server
 @user_cli.command("run")
-def do_price_alert():
+@click.option("--workers", default=1, help="Number of worker processes")
+@click.option("--shards", default=ALERT_SHARDS, help="Partitions of the alerted stocks")
+def do_price_alert(workers, shards):
     print("Running the price alert script. Use Ctrl+C to abort the script")
 
-    while True:
-        try:
-            # Query the stock that we need to get the history
-            stock_alerts = query_active_price_alert_info()
-
-            # For each if them
-            for stock_alert in stock_alerts:
-                print("Checking alert", stock_alert.code)
-
-                # Limit the start of the history to be 60 days.
-                start_date = max(
-                    [
-                        stock_alert.min_date,
-                        datetime.datetime.now() - datetime.timedelta(days=60),
-                    ]
-                )
-
-                # Query the history from yfinance
-                history = Ticker(stock_alert.code).history(
-                    start=start_date, interval="30m"
-                )
-
-                # Check if there any alert matched.
-                has_high = (history["High"] >= stock_alert.min_high).any()
-                has_low = (history["Low"] <= stock_alert.max_low).any()
-
-                if has_high:
-                    notify_high_threshold(history, stock_alert)
-
-                if has_low:
-                    notify_low_threshold(history, stock_alert)
-
-                update_price_alert_check_time(stock_alert.id)
-
-                time.sleep(1)
-        except KeyboardInterrupt:
-            break
-        except Exception as ex:
-            print(ex)
-
-        print("Sleeping")
-        time.sleep(30 * 60)
-
-
-def query_active_price_alert_info():
-    """Query for stock_pages that users have set a threshold for it"""
-
-    stmt = (
-        # Select the relavence data
-        select(
-            StockPage.id,
-            StockPage.code,
-            func.min(
-                func.coalesce(PriceAlert.last_check_time, PriceAlert.user_save_time)
-            ).label("min_date"),
-            func.min(PriceAlert.high_threshold).label("min_high"),
-            func.max(PriceAlert.low_threshold).label("max_low"),
-        )
-        .select_from(StockPage)
-        .join(Stock)
-        .join(PriceAlert)
-        # Where the alert is active
-        .where(
-            or_(
-                not_(PriceAlert.is_high_threshold_alerted),
-                not_(PriceAlert.is_low_threshold_alerted),
-            )
-        )
-        # Select only the stock_page
-        .group_by(StockPage.id, StockPage.code)
-    )
-
-    return db.session.execute(stmt)
-
-
-def update_price_alert_check_time(stock_page_id):
-    """Update the last_check_time to be now"""
-
-    update_stmt = (
-        update(PriceAlert)
-        .where(
-            PriceAlert.id.in_(
-                select(PriceAlert.id)
-                .join(Stock)
-                .where(Stock.stock_page_id == stock_page_id)
-            )
-        )
-        .values(last_check_time=datetime.datetime.now())
-        .execution_options(synchronize_session=False)
-    )
-
-    db.session.execute(update_stmt)
-
-    db.session.commit()
-
-
-def query_high_price_alerts(stock_page_id, threshold):
-    """Get the PriceAlert that pass the threshold"""
-
-    stmt = (
-        # Select the relavence data
-        select(
-            PriceAlert.id,
-            PriceAlert.user_save_time,
-            PriceAlert.high_threshold,
-            StockPage.code,
-            Portfolio.portfolio_name,
-            User.email,
-        )
-        .select_from(PriceAlert)
-        .join(Stock)
-        .join(StockPage)
-        .join(Portfolio)
-        .join(User)
-        # Where the high_threshold is lower then threshold
-        .where(
-            Stock.stock_page_id == stock_page_id,
-            not_(PriceAlert.is_high_threshold_alerted),
-            PriceAlert.high_threshold != None,
-            PriceAlert.high_threshold <= threshold,
-        )
+    if workers == 1:
+        run_worker(current_app._get_current_object(), shards)
+        return
+
+    # Each process leases its share of the shards, see alert_utils.ShardLease,
+    # and of the market data rate limit
+    rate = ALERT_RATE_LIMIT / workers
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_worker_process, args=(shards, rate))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Ctrl+C also interrupts the workers, wait for them to clean up
+        for process in processes:
+            process.join()
+
+
+def run_worker_process(shards, rate):
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        run_worker(app, shards, rate)
+
+
+def run_worker(app, shards, rate=ALERT_RATE_LIMIT):
+    """Check the alerts of the shards leased by this worker until interrupted,
+    requesting market data at most rate times per second
+    """
+    # Mails are sent in the background so that slow SMTP does not hold up checks
+    dispatcher = mail_utils.MailDispatcher(app)
+    dispatcher.start()
+
+    # Each stock is checked when due, instead of sweeping all stocks at once
+    lease = alert_utils.ShardLease(shards)
+    scheduler = alert_utils.AlertScheduler(
+        app, check_price_alerts, rate=rate, lease=lease
     )
 
-    return db.session.execute(stmt)
-
-
-def notify_high_threshold(history, stock_alert):
-    price_alerts = query_high_price_alerts(stock_alert.id, history["High"].max())
-
-    # For each price_alert
-    for price_alert in price_alerts:
-        # Reader the save time of the price_alert and check if there any history
-        # such that the High is more than the threshold
-        user_save_date = price_alert.user_save_time.strftime("%Y-%m-%d %H:%M:%S")
-        alert_row = history[
-            (history.index >= user_save_date)
-            & (history["High"] >= price_alert.high_threshold)
-        ]
-
-        if alert_row.empty:
-            continue
-
-        alert_row = alert_row.iloc[0]
-
-        # Construct and send the mail
-        alert_date = alert_row.name.strftime("%d %B %H:%M")
-        msg = f"""The high price alert for {price_alert.code} in portfolio {price_alert.portfolio_name} has been reached on {alert_date} with the price of {alert_row['High']:.2f}."""
-
-        message = Message(
-            f"[Stockzen] High price alert for stock {price_alert.code}",
-            sender=MAIL_SENDER,
-            recipients=[price_alert.email],
-            body=msg,
-        )
-
-        mail.send(message)
-
-        # Log the message
-        print(
-            f"High price alert for {price_alert.code} has been sent to {price_alert.email}"
-        )
-
-        # Update the price_alert so that it's marked as alerted
-        stmt = (
-            update(PriceAlert)
-            .where(PriceAlert.id == price_alert.id)
-            .values(is_high_threshold_alerted=1)
-        )
-
-        db.session.execute(stmt)
-
-        db.session.commit()
-
-
-def query_low_price_alerts(stock_page_id, threshold):
-    stmt = (
-        select(
-            PriceAlert.id,
-            PriceAlert.user_save_time,
-            PriceAlert.low_threshold,
-            StockPage.code,
-            Portfolio.portfolio_name,
-            User.email,
-        )
-        .select_from(PriceAlert)
-        .join(Stock)
-        .join(StockPage)
-        .join(Portfolio)
-        .join(User)
-        .where(
-            Stock.stock_page_id == stock_page_id,
-            not_(PriceAlert.is_low_threshold_alerted),
-            PriceAlert.low_threshold != None,
-            PriceAlert.low_threshold >= threshold,
-        )
+    try:
+        while True:
+            try:
+                if scheduler.run_due():
+                    dispatcher.enqueue_pending()
+                    print_metrics(scheduler.metrics, lease)
+            except KeyboardInterrupt:
+                break
+            except Exception as ex:
+                print(ex)
+
+            time.sleep(scheduler.next_wait())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Queued mails are sent before exiting, unqueued ones by other workers
+        scheduler.shutdown()
+        dispatcher.stop()
+
+
+def print_metrics(metrics, lease):
+    print(
+        f"[{len(lease.shards)}/{lease.n_shards} shards] Checked {metrics['checks']} stocks ({metrics['scheduled']} scheduled), "
+        f"sent {metrics['alerts']} alerts, "
+        f"last sweep {metrics['sweep_duration']:.1f}s with {metrics['lag']:.1f}s lag "
+        f"(max {metrics['max_lag']:.1f}s)"
     )
 
-    return db.session.execute(stmt)
-
-
-def notify_low_threshold(history, stock_alert):
-    price_alerts = query_low_price_alerts(stock_alert.id, history["Low"].min())
-
-    # For each price_alert
-    for price_alert in price_alerts:
-        # Reader the save time of the price_alert and check if there any history
-        # such that the Low is less than the threshold
-        user_save_date = price_alert.user_save_time.strftime("%Y-%m-%d %H:%M:%S")
-        alert_row = history[
-            (history.index >= user_save_date)
-            & (history["Low"] <= price_alert.low_threshold)
-        ]
-
-        if alert_row.empty:
-            continue
-
-        alert_row = alert_row.iloc[0]
 
-        # Construct and send the mail
-        alert_date = alert_row.name.strftime("%d %B %H:%M")
-        msg = f"""The low price alert for {price_alert.code} in portfolio {price_alert.portfolio_name} has been reached on {alert_date} with the price of {alert_row['Low']:.2f}."""
+@query_utils.track_job
+def check_price_alerts(codes: List[str] = None):
+    """Evaluate the active price alerts of all stocks (or of codes) in one pass and
+    notify the crossed ones, returns the number of alerts sent
+    """
+    book = alert_utils.get_alert_book()
+    if codes is None:
+        # Pick up the alerts saved since the last check, the scheduler syncs
+        # the book itself when checking a subset
+        book.sync()
+
+    starts = alert_utils.query_check_starts(codes)
+    if starts.empty:
+        return 0
+
+    # Query the history of all alerted stocks in grouped requests
+    histories = alert_utils.fetch_alert_histories(starts)
+
+    # Only the alerts within the bars' range can have been crossed
+    alert_ids = alert_utils.triggered_alerts(book, histories)
+    alerts = alert_utils.query_active_alerts(alert_ids) if alert_ids else None
+
+    crossings = []
+    if alerts is not None:
+        # Alerts deleted or alerted by another process are dropped from the book
+        for alert_id in set(alert_ids).difference(alerts["id"]):
+            book.discard(alert_id)
+
+        # Find the first bar crossing each threshold after the alert was saved
+        crossings = alert_utils.evaluate_alerts(alerts, histories)
+
+        notify_thresholds(crossings, alerts.set_index("id"))
+        for crossing in crossings:
+            book.discard(
+                crossing.alert_id, high=crossing.is_high, low=not crossing.is_high
+            )
 
-        message = Message(
-            f"[Stockzen] Low price alert for stock {price_alert.code}",
-            sender=MAIL_SENDER,
-            recipients=[price_alert.email],
+    # Only the stocks with history have been checked
+    alert_utils.update_check_time(list(histories.keys()))
+
+    return len(crossings)
+
+
+def notify_thresholds(crossings: List[alert_utils.Crossing], alert_info: DataFrame):
+    """Queue the alert mails of crossed thresholds in the outbox and mark the
+    thresholds as alerted, in one transaction
+    """
+    if not crossings:
+        return
+
+    mails = []
+    for crossing in crossings:
+        price_alert = alert_info.loc[crossing.alert_id]
+        kind = "high" if crossing.is_high else "low"
+
+        # Construct the mail
+        alert_date = crossing.time.strftime("%d %B %H:%M")
+        msg = f"""The {kind} price alert for {price_alert.code} in portfolio {price_alert.portfolio_name} has been reached on {alert_date} with the price of {crossing.price:.2f}."""
+
+        mails.append(
+            {
+                "price_alert_id": crossing.alert_id,
+                "kind": kind,
+                "save_time": price_alert.user_save_time.to_pydatetime(),
+                "recipient": price_alert.email,
+                "subject": f"[Stockzen] {kind.title()} price alert for stock {price_alert.code}",
+                "body": msg,
+            }
         )
-        message.body = msg
-
-        mail.send(message)
 
         # Log the message
         print(
-            f"Low price alert for {price_alert.code} has been sent to {price_alert.email}"
-        )
-
-        # Update the price_alert so that it's marked as alerted
-        stmt = (
-            update(PriceAlert)
-            .where(PriceAlert.id == price_alert.id)
-            .values(is_low_threshold_alerted=1)
+            f"{kind.title()} price alert for {price_alert.code} has been queued for {price_alert.email}"
         )
 
-        db.session.execute(stmt)
+    # A threshold already mailed since it was saved is not mailed again
+    db.session.execute(insert(MailOutbox).on_conflict_do_nothing(), mails)
+
+    # Update the price_alerts so that they're marked as alerted
+    for is_high, column in [
+        (True, "is_high_threshold_alerted"),
+        (False, "is_low_threshold_alerted"),
+    ]:
+        alert_ids = [c.alert_id for c in crossings if c.is_high == is_high]
+        if alert_ids:
+            db.session.execute(
+                update(PriceAlert)
+                .where(PriceAlert.id.in_(alert_ids))
+                .values({column: True})
+                .execution_options(synchronize_session=False)
+            )
 
-        db.session.commit()
+    db.session.commit()
 
 
 def init_app(app):
@@ -16,16 +16,42 @@ EXECUTOR_TYPE = "thread"  # flask-executor thread or processes
 EXECUTOR_MAX_WORKERS = 8  # max concurrents
 EXECUTOR_PROPAGATE_EXCEPTIONS = True  # don't swallow exceptions
 
+QUERY_COUNT_BUDGET = 30  # max SQL statements per request before it is logged
+QUERY_TIME_BUDGET = 0.2  # max seconds of SQL per request before it is logged
+
 SEARCH_LIMIT = 30
+SEARCH_BACKEND = "index"  # "index" (in-memory), "fts" (SQLite FTS5) or "sql"
+
+# ------------------------------------------------------------------------------
+# Market Data
+# ------------------------------------------------------------------------------
+MARKET_DATA_PROVIDER = os.environ.get(
+    "MARKET_DATA_PROVIDER", "yfinance"
+)  # "yfinance" for live data or "replay" for recorded fixtures
+REPLAY_DATA_DIR = os.path.join(
+    os.path.dirname(__file__), "database", "replay"
+)  # <SYM>.csv/.parquet fixtures used by the replay provider
+REPLAY_LATENCY = 0  # seconds of simulated latency per replayed request
+REPLAY_FAILURE_RATE = 0  # probability (0 to 1) that a replayed request fails
+REPLAY_SEED = 0  # seed for simulated failures
 
 # ------------------------------------------------------------------------------
 # Top Stocks
 # ------------------------------------------------------------------------------
 STALENESS_INTERVAL = 90  # min seconds before a stock page is considered stale
+STOCK_PAGE_MAX_AGE = (
+    15 * 60
+)  # max seconds a stale stock page is served while it refreshes in the background
+STOCK_PAGE_CACHE_SIZE = 512  # stock pages cached per process, each for STALENESS_INTERVAL
+FAILED_FETCH_CACHE_SIZE = 10000  # failed stock page fetches skipped for STALENESS_INTERVAL
 TOP_STOCKS_INTERVAL = (
     3600  # min seconds before a top performance stock is considered stale
 )
 N_TOP_PERFORMERS = 5  # number of top performing stocks to return
+QUOTE_BATCH_SIZE = 50  # max symbols per grouped quote request
+REFRESH_LOCK_TTL = 60  # seconds before an abandoned refresh lock can be taken over
+REFRESH_LOCK_TIMEOUT = 30  # max seconds to wait for another worker's refresh
+REFRESH_LOCK_POLL = 0.2  # seconds between refresh lock attempts
 TOP_COMPANIES = [
     "AAPL",
     "MSFT",
@@ -49,6 +75,11 @@ TOP_COMPANIES = [
     "PYPL",
 ]  # ref: https://www.investopedia.com/ask/answers/08/find-stocks-in-sp500.asp
 
+# ------------------------------------------------------------------------------
+# Predictions
+# ------------------------------------------------------------------------------
+PREDICT_WARMUP = False  # load all TOP_COMPANIES models at startup instead of lazily
+
 # ------------------------------------------------------------------------------
 # Price Alerts
 # ------------------------------------------------------------------------------
@@ -60,11 +91,26 @@ MAIL_USE_TLS = True
 MAIL_USE_SSL = False
 MAIL_SENDER = "alert@stockzen.com"
 MAIL_DEBUG = False
+ALERT_CHECK_INTERVAL = 30 * 60  # target seconds between checks of each stock
+ALERT_CHECK_WORKERS = 4  # stocks checked concurrently, one batch per thread
+ALERT_RATE_LIMIT = 2  # max market data requests per second, split between workers
+ALERT_SYNC_INTERVAL = 60  # seconds between picking up newly saved alerts
+ALERT_SYNC_MARGIN = 60  # seconds of saves re-read by each sync, for late commits
+ALERT_SHARDS = 16  # stock_page_id % ALERT_SHARDS partitions split between workers
+ALERT_LEASE_TTL = 3 * ALERT_SYNC_INTERVAL  # seconds a shard lease lasts unrenewed
+ALERT_INTERVAL = "30m"  # bar interval the price alerts are checked against
+ALERT_HISTORY_DAYS = 60  # max days of bars fetched for an alert (30m bar limit)
+ALERT_MAIL_WORKERS = 4  # threads sending alert mails, each with one SMTP connection
+ALERT_MAIL_QUEUE_SIZE = 1000  # max mails queued for the workers
+ALERT_MAIL_ACK_BATCH = 50  # sent mails marked as sent per UPDATE
+ALERT_MAIL_MAX_ATTEMPTS = 5  # failed sends before a mail is given up
+ALERT_MAIL_CLAIM_TTL = 10 * 60  # seconds before a dispatcher's unsent mail is retried
 
 # ------------------------------------------------------------------------------
 # Portfolio Challenge
 # ------------------------------------------------------------------------------
 SLEEP_INTERVAL = 15 * 60  # while loop sleep interval for challenge script
+LEADERBOARD_SIZE = 10  # number of top ranked users on the challenge leaderboard
 CHALLENGE_PERIOD = timedelta(
     weeks=1
 )  # length of each challenge round (after submission phase) in seconds
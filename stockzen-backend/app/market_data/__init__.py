@@ -0,0 +1,48 @@
+# ==============================================================================
+# Market data providers
+#   All price/history/company info requests go through the provider configured
+#   by MARKET_DATA_PROVIDER, so the backend can run against yfinance or against
+#   recorded fixtures (e.g. for offline load testing and benchmarks).
+# ==============================================================================
+from typing import Mapping
+
+from flask import current_app, has_app_context
+
+from .base import MarketDataProvider
+from .replay import ReplayProvider
+from .yahoo import YFinanceProvider
+
+_default_provider = None
+
+
+def create_provider(config: Mapping) -> MarketDataProvider:
+    """Build a provider from MARKET_DATA_PROVIDER and its REPLAY_* settings"""
+    name = config.get("MARKET_DATA_PROVIDER", "yfinance")
+    if name == "yfinance":
+        return YFinanceProvider()
+    if name == "replay":
+        return ReplayProvider(
+            config["REPLAY_DATA_DIR"],
+            latency=config.get("REPLAY_LATENCY", 0),
+            failure_rate=config.get("REPLAY_FAILURE_RATE", 0),
+            seed=config.get("REPLAY_SEED", 0),
+        )
+    raise ValueError(f"Unknown market data provider: {name}")
+
+
+def get_provider() -> MarketDataProvider:
+    """Return the app's provider, or one built from config.py outside the app context"""
+    global _default_provider
+
+    if has_app_context() and "market_data" in current_app.extensions:
+        return current_app.extensions["market_data"]
+
+    if _default_provider is None:
+        from app import config
+
+        _default_provider = create_provider(vars(config))
+    return _default_provider
+
+
+def init_app(app):
+    app.extensions["market_data"] = create_provider(app.config)
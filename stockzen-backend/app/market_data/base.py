@@ -0,0 +1,62 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Sequence
+
+import pandas as pd
+from pandas.core.frame import DataFrame
+
+# period strings accepted by yfinance, as offsets from the last bar
+PERIOD_OFFSETS = {
+    "1d": pd.DateOffset(days=1),
+    "5d": pd.DateOffset(days=5),
+    "1mo": pd.DateOffset(months=1),
+    "3mo": pd.DateOffset(months=3),
+    "6mo": pd.DateOffset(months=6),
+    "1y": pd.DateOffset(years=1),
+    "2y": pd.DateOffset(years=2),
+    "5y": pd.DateOffset(years=5),
+    "10y": pd.DateOffset(years=10),
+}
+OHLCV_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+
+class MarketDataProvider(ABC):
+    """Interface for a source of quotes, price history and company info
+
+    History DataFrames follow the yfinance layout: a DatetimeIndex and
+    Open, High, Low, Close, Volume columns.
+    """
+
+    @abstractmethod
+    def history(
+        self,
+        sym: str,
+        period: str = "max",
+        interval: str = "1d",
+        start: datetime = None,
+        end: datetime = None,
+        actions: bool = False,
+    ) -> DataFrame:
+        """Price history for one symbol, empty DataFrame if none is found"""
+
+    @abstractmethod
+    def info(self, sym: str) -> dict:
+        """Company info and latest quote for one symbol"""
+
+    def download(
+        self,
+        sym_list: Sequence[str],
+        period: str = "max",
+        interval: str = "1d",
+        start: datetime = None,
+        end: datetime = None,
+    ) -> Dict[str, DataFrame]:
+        """Price history for many symbols in one grouped request,
+        returns dict of sym: DataFrame, symbols without data are omitted
+        """
+        frames = {}
+        for sym in sym_list:
+            df = self.history(sym, period=period, interval=interval, start=start, end=end)
+            if len(df) > 0:
+                frames[sym] = df
+        return frames
@@ -0,0 +1,116 @@
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+from pandas.core.frame import DataFrame
+
+from .base import OHLCV_COLUMNS, PERIOD_OFFSETS, MarketDataProvider
+
+
+class ReplayProvider(MarketDataProvider):
+    """Market data replayed from recorded fixtures, no network access
+
+    Fixtures live in data_dir as <SYM>.csv or <SYM>.parquet (daily bars) and
+    optionally <SYM>_<interval>.csv/.parquet for other intervals, with a date
+    index and OHLCV columns. <SYM>.json holds the info dict; when missing it is
+    built from the last two closes. Symbols without fixtures return no data.
+
+    :param latency: seconds slept before every request
+    :param failure_rate: probability (0 to 1) that a request raises ConnectionError
+    :param seed: seed for the failure draws so that runs are repeatable
+    """
+
+    def __init__(
+        self, data_dir: str, latency: float = 0, failure_rate: float = 0, seed=0
+    ):
+        self.data_dir = data_dir
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._frames = {}  # (sym, interval): DataFrame, fixtures are read once
+
+    # --------------------------------------------------------------------------
+    # Provider interface
+    # --------------------------------------------------------------------------
+
+    def history(
+        self,
+        sym: str,
+        period: str = "max",
+        interval: str = "1d",
+        start: datetime = None,
+        end: datetime = None,
+        actions: bool = False,
+    ) -> DataFrame:
+        self._simulate_request(sym)
+        df = self._load(sym, interval)
+        if len(df) == 0:
+            return df
+
+        if start is not None or end is not None:
+            if start is not None:
+                df = df[df.index >= pd.Timestamp(start)]
+            if end is not None:
+                df = df[df.index < pd.Timestamp(end)]
+        elif period == "ytd":
+            df = df[df.index.year == df.index[-1].year]
+        elif period in PERIOD_OFFSETS:
+            df = df[df.index > df.index[-1] - PERIOD_OFFSETS[period]]
+        return df.copy()
+
+    def info(self, sym: str) -> dict:
+        self._simulate_request(sym)
+        path = os.path.join(self.data_dir, f"{sym}.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+
+        closes = self._load(sym, "1d")["Close"]
+        price = float(closes.iloc[-1]) if len(closes) > 0 else None
+        prev_close = float(closes.iloc[-2]) if len(closes) > 1 else None
+        return {
+            "symbol": sym,
+            "regularMarketPrice": price,
+            "previousClose": prev_close,
+        }
+
+    # --------------------------------------------------------------------------
+    # Helpers
+    # --------------------------------------------------------------------------
+
+    def _simulate_request(self, sym: str):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate:
+            with self._lock:
+                failed = self._random.random() < self.failure_rate
+            if failed:
+                raise ConnectionError(f"Simulated market data failure for {sym}")
+
+    def _load(self, sym: str, interval: str) -> DataFrame:
+        key = (sym, interval)
+        if key not in self._frames:
+            self._frames[key] = self._read_fixture(sym, interval)
+        return self._frames[key]
+
+    def _read_fixture(self, sym: str, interval: str) -> DataFrame:
+        names = [f"{sym}_{interval}", sym] if interval != "1d" else [sym]
+        for name in names:
+            path = os.path.join(self.data_dir, name)
+            if os.path.exists(f"{path}.parquet"):
+                df = pd.read_parquet(f"{path}.parquet")
+            elif os.path.exists(f"{path}.csv"):
+                df = pd.read_csv(f"{path}.csv", index_col=0)
+            else:
+                continue
+
+            df.index = pd.to_datetime(df.index)
+            df.index.name = "Date"
+            return df[OHLCV_COLUMNS].sort_index()
+
+        return DataFrame(columns=OHLCV_COLUMNS, index=pd.DatetimeIndex([], name="Date"))
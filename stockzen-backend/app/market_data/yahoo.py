@@ -0,0 +1,58 @@
+from datetime import datetime
+from typing import Dict, Sequence
+
+import yfinance as yf
+from pandas.core.frame import DataFrame
+
+from .base import MarketDataProvider
+
+
+class YFinanceProvider(MarketDataProvider):
+    """Live market data from Yahoo Finance"""
+
+    def history(
+        self,
+        sym: str,
+        period: str = "max",
+        interval: str = "1d",
+        start: datetime = None,
+        end: datetime = None,
+        actions: bool = False,
+    ) -> DataFrame:
+        return yf.Ticker(sym).history(
+            period=period, interval=interval, start=start, end=end, actions=actions
+        )
+
+    def info(self, sym: str) -> dict:
+        return yf.Ticker(sym).info
+
+    def download(
+        self,
+        sym_list: Sequence[str],
+        period: str = "max",
+        interval: str = "1d",
+        start: datetime = None,
+        end: datetime = None,
+    ) -> Dict[str, DataFrame]:
+        sym_list = list(sym_list)
+        if not sym_list:
+            return {}
+
+        df = yf.download(
+            sym_list,
+            period=period,
+            interval=interval,
+            start=start,
+            end=end,
+            group_by="ticker",
+            actions=False,
+            progress=False,
+        )
+
+        frames = {}
+        for sym in sym_list:
+            # single symbol downloads are not grouped by ticker
+            sym_df = (df[sym] if len(sym_list) > 1 else df).dropna(how="all")
+            if len(sym_df) > 0:
+                frames[sym] = sym_df
+        return frames
@@ -2,9 +2,9 @@ from datetime import datetime
 
 from app import db
 from flask_login import UserMixin
-from sqlalchemy import Column, ForeignKey, Integer, String, UniqueConstraint
+from sqlalchemy import Column, ForeignKey, Index, Integer, String, UniqueConstraint
 from sqlalchemy.orm import backref, relationship
-from sqlalchemy.sql.sqltypes import Boolean, DateTime, Float
+from sqlalchemy.sql.sqltypes import Boolean, DateTime, Float, LargeBinary
 from werkzeug.security import check_password_hash, generate_password_hash
 
 # https://docs.sqlalchemy.org/en/14/orm/basic_relationships.html
@@ -77,6 +77,7 @@ class Portfolio(db.Model):
     gain = Column(Float)  # sum(stocks.gain)
     perc_gain = Column(Float)  # portfolios.gain / portfolios.value
     order = Column(Integer, nullable=False, default=0)  # track row order, default to top
+    is_dirty = Column(Boolean, default=True)  # calculations need refreshing
     last_updated = Column(DateTime, default=datetime.now())
 
     # Relationships
@@ -104,7 +105,9 @@ class Stock(db.Model):
     __tablename__ = "stocks"
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    portfolio_id = Column(Integer, ForeignKey("portfolios.id"), nullable=False)
+    portfolio_id = Column(
+        Integer, ForeignKey("portfolios.id"), nullable=False, index=True
+    )  # indexed for portfolio recalculation subqueries
     stock_page_id = Column(
         Integer, ForeignKey("stock_pages.id"), nullable=False
     )  # to get current price, change, percent_change, prediction, confidence
@@ -113,6 +116,7 @@ class Stock(db.Model):
     perc_gain = Column(Float)  # stocks.gain / (stocks.units_held * bought.avg_price)
     value = Column(Float)  # stocks.units_held * stocks.current_price
     order = Column(Integer, nullable=False, default=0)  # track row order, default to top
+    is_dirty = Column(Boolean, default=True)  # calculations need refreshing
     last_updated = Column(DateTime, default=datetime.now())
 
     # Relationships
@@ -144,7 +148,9 @@ class LotBought(db.Model):
     __tablename__ = "lots_bought"
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    stock_id = Column(Integer, ForeignKey("stocks.id"), nullable=False)
+    stock_id = Column(
+        Integer, ForeignKey("stocks.id"), nullable=False, index=True
+    )  # indexed for stock recalculation subqueries
     trade_date = Column(DateTime, nullable=False)  # <user>
     units = Column(Integer, nullable=False, default=0)  # <user>
     unit_price = Column(Float, nullable=False)  # <user>
@@ -157,7 +163,9 @@ class LotSold(db.Model):
     __tablename__ = "lots_sold"
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    stock_id = Column(Integer, ForeignKey("stocks.id"), nullable=False)
+    stock_id = Column(
+        Integer, ForeignKey("stocks.id"), nullable=False, index=True
+    )  # indexed for stock recalculation subqueries
     trade_date = Column(DateTime, nullable=False)  # <user>
     units = Column(Integer, nullable=False, default=0)  # <user>
     unit_price = Column(Float, nullable=False)  # <user>
@@ -199,11 +207,29 @@ class StockPage(db.Model):
 
 
 class History(db.Model):
-    # 1-yr historical data for each stock
+    # OHLCV history for each stock, one row per stock page,
+    # each column is a packed numpy array (see history_utils)
     __tablename__ = "history"
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
-    stock_page_id = Column(Integer, ForeignKey("stock_pages.id"), nullable=False)
-    history = Column(String, nullable=False)
+    stock_page_id = Column(
+        Integer, ForeignKey("stock_pages.id"), unique=True, nullable=False
+    )
+    n_bars = Column(Integer, nullable=False, default=0)
+    dates = Column(LargeBinary, nullable=False)  # datetime64[s]
+    open = Column(LargeBinary, nullable=False)  # float64
+    high = Column(LargeBinary, nullable=False)  # float64
+    low = Column(LargeBinary, nullable=False)  # float64
+    close = Column(LargeBinary, nullable=False)  # float64
+    volume = Column(LargeBinary, nullable=False)  # int64
+    last_updated = Column(DateTime, default=datetime.now)
+
+
+# Cross-process lock held while a worker refreshes data for a key (e.g. a stock page)
+class RefreshLock(db.Model):
+    __tablename__ = "refresh_locks"
+    key = Column(String, primary_key=True)  # e.g. "stock_page:1"
+    owner = Column(String, nullable=False)  # random token of the lock holder
+    expires = Column(DateTime, nullable=False)  # lock can be taken over after expiry
 
 
 # ------------------------------------------------------------------------------
@@ -222,6 +248,51 @@ class PriceAlert(db.Model):
     is_low_threshold_alerted = Column(Boolean)
     last_check_time = Column(DateTime)
 
+    __table_args__ = (
+        Index("ix_price_alerts_high", stock_id, high_threshold),
+        Index("ix_price_alerts_low", stock_id, low_threshold),
+        Index("ix_price_alerts_save_time", user_save_time),  # alert book sync
+    )
+
+
+# Price alert mails waiting to be sent, written with the alerted flag so that
+# every alert is mailed at least once; sent_at is set once the mail was sent
+class MailOutbox(db.Model):
+    __tablename__ = "mail_outbox"
+    id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
+    price_alert_id = Column(Integer, ForeignKey("price_alerts.id", ondelete="SET NULL"))
+    kind = Column(String(10))  # "high" or "low"
+    save_time = Column(DateTime)  # user_save_time of the alert that was crossed
+    recipient = Column(String(40), nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(String, nullable=False)
+    created = Column(DateTime, nullable=False, default=datetime.now)
+    sent_at = Column(DateTime)
+    attempts = Column(Integer, nullable=False, default=0)
+    claimed_by = Column(String(32))  # dispatcher sending the mail
+    claimed_until = Column(DateTime)  # other dispatchers may send it after this
+
+    __table_args__ = (
+        # a threshold is mailed once each time it is saved
+        UniqueConstraint(price_alert_id, kind, save_time),
+        Index("ix_mail_outbox_pending", sent_at, id),
+    )
+
+
+# Price alert worker processes, kept alive by a heartbeat
+class AlertWorker(db.Model):
+    __tablename__ = "alert_workers"
+    owner = Column(String(32), primary_key=True)  # random token of the worker
+    expires = Column(DateTime, nullable=False)  # worker is presumed dead after this
+
+
+# Leases of the stock_page_id % n shards of price alerts, each checked by one worker
+class AlertShardLease(db.Model):
+    __tablename__ = "alert_shard_leases"
+    shard = Column(Integer, primary_key=True)
+    owner = Column(String(32))  # NULL when released
+    expires = Column(DateTime, nullable=False)  # shard can be taken over after expiry
+
 
 # ------------------------------------------------------------------------------
 # Portfolio Challenge tables
@@ -265,3 +336,20 @@ class ChallengeEntry(db.Model):
     UniqueConstraint(challenge_id, user_id, stock_page_id)
     # NOTE: challenge_id and user_id unique constraint is enforced in the CRUD function
     # to allow for a more informative error message to the frontend
+
+
+# Ranked leaderboard of a finished challenge, written once when the challenge ends
+class LeaderboardEntry(db.Model):
+    __tablename__ = "leaderboard_entries"
+    id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
+    challenge_id = Column(Integer, ForeignKey("challenges.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    rank = Column(Integer, nullable=False)
+    user_name = Column(String)
+    perc_change = Column(Float)  # avg perc_change of the user's entries
+    stock_codes = Column(String)  # comma separated, in desc order of perc_change
+
+    __table_args__ = (
+        Index("ix_leaderboard_entries_rank", challenge_id, rank),
+        Index("ix_leaderboard_entries_user", challenge_id, user_id, unique=True),
+    )
@@ -0,0 +1,280 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import numpy as np
+from app import create_app, db
+from app.models.schema import LotBought, Stock, StockPage
+from app.scripts.db_populator import populate_symbols
+from app.scripts.load_generator import (
+    DATASETS,
+    GENERIC_PASSWORD,
+    generate_dataset,
+    write_replay_fixtures,
+)
+from sqlalchemy import event, func
+
+# ==============================================================================
+# API Benchmarks
+# ==============================================================================
+"""
+Times the hot API paths with the Flask test client against generated datasets,
+market data is replayed from generated fixtures. Every endpoint reports its
+latency percentiles, plus the SQL statements and peak memory of one request.
+Exits with 1 when a tracked metric regressed from the baseline.
+
+Run with: python3 -m app.scripts.benchmark --datasets tiny small
+Save a new baseline with: python3 -m app.scripts.benchmark --save
+"""
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")
+REGRESSION_THRESHOLD = 0.2  # max relative increase of a tracked metric
+TRACKED_METRICS = {
+    "p50_ms": 2.0,
+    "queries": 0,
+    "peak_kib": 64,
+}  # metric: absolute increase allowed on top of the threshold, to absorb noise
+# (the tail percentiles are reported but too noisy to track)
+
+
+class QueryCounter:
+    """Count the SQL statements executed by the current thread on the engine"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.thread = threading.get_ident()
+        self.count = 0
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        if threading.get_ident() == self.thread:  # skip background refreshes
+            self.count += 1
+
+
+def run_benchmarks(dataset: str, repeat: int, seed: int = 0) -> Dict[str, Dict]:
+    """Benchmark every endpoint against a new database holding the dataset,
+    returns the metrics of each endpoint
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app = create_app(
+            {
+                "TESTING": True,
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_dir}/benchmark.sqlite",
+                "MARKET_DATA_PROVIDER": "replay",
+                "REPLAY_DATA_DIR": tmp_dir,
+            }
+        )
+        app.secret_key = "benchmark"
+
+        with app.app_context():
+            db.create_all()
+            populate_symbols(db.engine)
+            generate_dataset(**DATASETS[dataset], seed=seed)
+            target = _benchmark_target(n_lots=repeat + 2)
+            write_replay_fixtures(target["codes"], tmp_dir, seed=seed)
+            engine = db.engine
+
+        with app.test_client() as client:
+            results = {}
+            for name, request in benchmark_cases(target):
+                results[name] = measure(client, engine, request, repeat)
+                print(f"{dataset:>8} {_format_row(name, results[name])}")
+            return results
+
+
+def _benchmark_target(n_lots: int) -> Dict:
+    """Ids used by the requests: the user holding the largest portfolio, one of its
+    stocks, and n_lots lots of that stock for the lot deletes
+    """
+    portfolio_id, user_id = (
+        db.session.query(Stock.portfolio_id, Stock.user_id)
+        .group_by(Stock.portfolio_id)
+        .order_by(func.count().desc(), Stock.portfolio_id)
+        .first()
+    )
+    stock = Stock.query.filter_by(portfolio_id=portfolio_id).order_by(Stock.id).first()
+    codes = [
+        code
+        for code, in db.session.query(StockPage.code)
+        .join(Stock, Stock.stock_page_id == StockPage.id)
+        .filter(Stock.user_id == user_id)
+    ]
+
+    lots = [
+        LotBought(
+            user_id=user_id,
+            stock_id=stock.id,
+            trade_date=datetime.now(),
+            units=1,
+            unit_price=1.0,
+        )
+        for _ in range(n_lots)
+    ]
+    db.session.add_all(lots)
+    db.session.commit()
+
+    return {
+        "email": f"user{user_id}@example.com",
+        "portfolio_id": portfolio_id,
+        "stock_id": stock.id,
+        "stock_page_id": stock.stock_page_id,
+        "codes": codes,
+        "lot_ids": [lot.id for lot in lots],
+    }
+
+
+def benchmark_cases(target: Dict) -> List:
+    """(name, request) of each benchmarked endpoint, in the order they are run,
+    the first one logs the user in
+    """
+    login = {"email": target["email"], "password": GENERIC_PASSWORD}
+    queries = itertools.cycle(code[:2] for code in target["codes"])
+    lot = {"tradeDate": "2021-10-27", "units": 10, "unitPrice": 100.0}
+    lot_ids = list(target["lot_ids"])
+
+    return [
+        ("POST /user/login", lambda client: client.post("user/login", json=login)),
+        ("GET /portfolio/list", lambda client: client.get("portfolio/list")),
+        (
+            "GET /stock/list/<id>?refresh=0",
+            lambda client: client.get(f"stock/list/{target['portfolio_id']}?refresh=0"),
+        ),
+        (
+            "GET /stock/list/<id>?refresh=1",
+            lambda client: client.get(f"stock/list/{target['portfolio_id']}?refresh=1"),
+        ),
+        (
+            "GET /stock-page/<id>",
+            lambda client: client.get(f"stock-page/{target['stock_page_id']}"),
+        ),
+        (
+            "GET /stock-page/<id>/history",
+            lambda client: client.get(f"stock-page/{target['stock_page_id']}/history"),
+        ),
+        (
+            "GET /search?query=",
+            lambda client: client.get(f"search?query={next(queries)}"),
+        ),
+        (
+            "GET /challenge/leaderboard",
+            lambda client: client.get("challenge/leaderboard"),
+        ),
+        (
+            "POST /lot/buy/<id>",
+            lambda client: client.post(f"lot/buy/{target['stock_id']}", json=lot),
+        ),
+        (
+            "DELETE /lot/buy/<id>",
+            lambda client: client.delete(f"lot/buy/{lot_ids.pop()}"),
+        ),
+    ]
+
+
+def measure(client, engine, request: Callable, repeat: int) -> Dict[str, float]:
+    """Time repeat requests after a warm up, then count the SQL statements and the
+    peak memory of one more request (traced separately, tracing slows it down)
+    """
+    _check(request(client))
+
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = request(client)
+        latencies.append((time.perf_counter() - start) * 1000)
+        _check(response)
+
+    tracemalloc.start()
+    try:
+        with QueryCounter(engine) as counter:
+            _check(request(client))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "p50_ms": round(p50, 3),
+        "p95_ms": round(p95, 3),
+        "p99_ms": round(p99, 3),
+        "queries": counter.count,
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def _check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.path} returned {response.status}")
+
+
+def find_regressions(
+    results: Dict, baseline: Dict, threshold: float = REGRESSION_THRESHOLD
+) -> List[str]:
+    """Tracked metrics of results that increased by more than the threshold
+    (and the metric's noise allowance) from the baseline
+    """
+    regressions = []
+    for dataset, cases in results.items():
+        for name, metrics in cases.items():
+            base = baseline.get(dataset, {}).get(name)
+            if base is None:
+                continue  # new endpoint or dataset
+            for metric, allowance in TRACKED_METRICS.items():
+                if metrics[metric] > base[metric] * (1 + threshold) + allowance:
+                    regressions.append(
+                        f"{dataset} {name}: {metric} {base[metric]} -> {metrics[metric]}"
+                    )
+    return regressions
+
+
+def _format_row(name: str, metrics: Dict[str, float]) -> str:
+    return (
+        f"{name:<32} p50 {metrics['p50_ms']:>8.2f}ms  p95 {metrics['p95_ms']:>8.2f}ms"
+        f"  p99 {metrics['p99_ms']:>8.2f}ms  {metrics['queries']:>4} queries"
+        f"  {metrics['peak_kib']:>9.1f}KiB peak"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the hot API paths")
+    parser.add_argument("--datasets", nargs="+", choices=DATASETS, default=["tiny"])
+    parser.add_argument("--repeat", type=int, default=30, help="timed requests")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument("--save", action="store_true", help="save as the baseline")
+    args = parser.parse_args()
+
+    results = {
+        dataset: run_benchmarks(dataset, args.repeat, args.seed)
+        for dataset in args.datasets
+    }
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, save one with --save")
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        regressions = find_regressions(results, json.load(f), args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    sys.exit(1 if regressions else 0)
@@ -1,6 +1,6 @@
 import os
 from datetime import datetime, timedelta
-from random import randrange, sample, uniform
+from random import sample
 
 import app.utils.crud_utils as crud
 import pandas as pd
@@ -14,12 +14,13 @@ from app.models.schema import (
     Portfolio,
     Stock,
     StockPage,
+    User,
 )
-from app.utils import db_utils
+from app.scripts.load_generator import GENERIC_PASSWORD, generate_dataset
+from app.utils import db_utils, search_utils
 from app.utils.enums import Status
 from app.utils.utils import bulk_challenge_fetch, debug_exception, id_to_code
-from dateutil.parser import parse
-from faker import Faker
+from sqlalchemy import func
 
 # ==============================================================================
 # Dummy User Populator
@@ -27,132 +28,6 @@ from faker import Faker
 """
 Run with: python3 -m app.scripts.db_populator
 """
-faker = Faker()
-
-
-def generate_dummy_users(n_users: int):
-    """
-    Generates n random users with the same password
-    """
-    generic_password = "Password1!"
-
-    for _ in range(n_users - 1):
-        email = faker.ascii_safe_email()
-        first_name = faker.first_name()
-        last_name = faker.last_name()
-        if crud.add_user(email, first_name, last_name, generic_password) == Status.FAIL:
-            print(f"Could not add dummy user: {email}, {first_name}, {last_name}")
-        else:
-            print("Dummy user added")
-    # Add last one with demo credentials
-    email = "demo@demo.com"
-    first_name = "Demo"
-    last_name = "User"
-    if crud.add_user(email, first_name, last_name, generic_password) == Status.FAIL:
-        print(f"Could not add demo user: {email}, {first_name}, {last_name}")
-    else:
-        print("Demo user added")
-
-    return email, generic_password
-
-
-def generate_dummy_portfolios(n_portfolios: int, user_id: int):
-    """
-    Generates n random portfolios per user
-    """
-    for portfolio_id in range(1, n_portfolios + 1):
-        portfolio_name = faker.bs()
-        stock_count = randrange(0, 20)
-        value = round(uniform(-100000, 100000), 4)
-        change = round(uniform(-1000, 1000), 4)
-        perc_change = round(uniform(-50, 50), 4)
-        gain = round(uniform(-10000, 10000), 4)
-        perc_gain = round(uniform(-150, 150), 4)
-
-        new_portfolio = Portfolio(
-            user_id=user_id,
-            portfolio_name=portfolio_name,
-            stock_count=stock_count,
-            value=value,
-            change=change,
-            perc_change=perc_change,
-            gain=gain,
-            perc_gain=perc_gain,
-            order=portfolio_id,
-        )
-        try:
-            db_utils.insert_item(new_portfolio)
-            print("Dummy portfolio added")
-        except:
-            print(
-                f"Could not add dummy portfolio: {portfolio_name} for user_id: {user_id}"
-            )
-
-
-def generate_dummy_stocks(n_stocks: int, n_portfolios: int, user_id: int):
-    STOCK_PAGE_RANGE = 5760
-
-    for stock_id in range(1, n_stocks + 1):
-        new_stock = Stock(
-            user_id=user_id,
-            portfolio_id=randrange(
-                (user_id - 1) * n_portfolios + 1, user_id * n_portfolios + 1
-            ),
-            stock_page_id=randrange(1, STOCK_PAGE_RANGE + 1),
-            avg_price=round(uniform(-10000, 10000), 4),
-            gain=round(uniform(-10000, 10000), 4),
-            perc_gain=round(uniform(-150, 150), 4),
-            value=round(uniform(-100000, 100000), 4),
-            order=stock_id,
-        )
-        try:
-            db_utils.insert_item(new_stock)
-            print("Dummy stock added")
-        except:
-            print(f"Could not add dummy stock for user_id: {id}")
-
-
-def generate_dummy_lots(n_lots: int, n_stocks: int, user_id: int):
-    range_low = (user_id - 1) * n_stocks + 1
-    range_high = user_id * n_stocks + 1
-    for stock_id in range(range_low, range_high):
-        for i_lot in range(1, n_lots + 1):
-            new_lot_bought = LotBought(
-                user_id=user_id,
-                stock_id=stock_id,
-                trade_date=parse(
-                    f"20{randrange(00,22):02}-{randrange(1,13):02}-{randrange(1,29):02}"
-                ),
-                units=randrange(0, 1000),
-                unit_price=round(uniform(0.1000, 1000), 4),
-                value=None,
-                change=None,
-            )
-            try:
-                db_utils.insert_item(new_lot_bought)
-                print("Dummy buy lot added")
-            except:
-                print(f"Could not add dummy buy lot for user_id: {user_id}")
-
-            if i_lot % 2 == 0:  # only do half as many Sold Lots
-                units_sold = randrange(0, 1000)
-                unit_price = round(uniform(0.1000, 1000), 4)
-                new_lot_sold = LotSold(
-                    user_id=user_id,
-                    stock_id=stock_id,
-                    trade_date=parse(
-                        f"20{randrange(00,22):02}-{randrange(1,13):02}-{randrange(1,29):02}"
-                    ),
-                    units=units_sold,
-                    unit_price=unit_price,
-                    amount=units_sold * unit_price,
-                    realised=None,
-                )
-                try:
-                    db_utils.insert_item(new_lot_sold)
-                    print("Dummy sell lot added")
-                except:
-                    print(f"Could not add dummy sell lot for user_id: {user_id}")
 
 
 def generate_dummy_challenges(n_users):
@@ -210,62 +85,72 @@ def generate_dummy_challenges(n_users):
 # For DEMO
 def populate_demo_user(user_id, portfolio_id, stock_id):
     try:
-        db_utils.insert_item(Portfolio(user_id=user_id, portfolio_name="My Portfolio 1"))
-        db_utils.insert_item(
-            Stock(user_id=user_id, portfolio_id=portfolio_id, stock_page_id=13)
-        )
-        db_utils.insert_item(
-            LotBought(
-                user_id=user_id,
-                stock_id=stock_id,
-                trade_date=datetime.now(),
-                units=100,
-                unit_price=150.00,
+        with db_utils.batch():
+            db_utils.insert_item(
+                Portfolio(user_id=user_id, portfolio_name="My Portfolio 1")
             )
-        )
-        db_utils.insert_item(
-            LotSold(
-                user_id=user_id,
-                stock_id=stock_id,
-                trade_date=datetime.now(),
-                units=50,
-                unit_price=155.00,
+            db_utils.insert_item(
+                Stock(user_id=user_id, portfolio_id=portfolio_id, stock_page_id=13)
+            )
+            db_utils.insert_item(
+                LotBought(
+                    user_id=user_id,
+                    stock_id=stock_id,
+                    trade_date=datetime.now(),
+                    units=100,
+                    unit_price=150.00,
+                )
+            )
+            db_utils.insert_item(
+                LotSold(
+                    user_id=user_id,
+                    stock_id=stock_id,
+                    trade_date=datetime.now(),
+                    units=50,
+                    unit_price=155.00,
+                )
             )
-        )
 
-        db_utils.insert_item(
-            Stock(user_id=user_id, portfolio_id=portfolio_id, stock_page_id=3644)
-        )
-        db_utils.insert_item(
-            LotBought(
-                user_id=user_id,
-                stock_id=stock_id + 1,
-                trade_date=datetime.now(),
-                units=40,
-                unit_price=700.00,
+            db_utils.insert_item(
+                Stock(user_id=user_id, portfolio_id=portfolio_id, stock_page_id=3644)
+            )
+            db_utils.insert_item(
+                LotBought(
+                    user_id=user_id,
+                    stock_id=stock_id + 1,
+                    trade_date=datetime.now(),
+                    units=40,
+                    unit_price=700.00,
+                )
             )
-        )
     except Exception as e:
         debug_exception(e, suppress=True)
 
 
-def generate_dummy_data(n_users=4, n_portfolios=2, n_stocks=4, n_lots=5):
+def generate_dummy_data(n_users=4, n_portfolios=2, n_stocks=4, n_lots=5, seed=0):
     """
-    Generates dummy user data
+    Generates dummy user data, with n_portfolios and n_stocks per user and
+    n_lots per stock, the last user being the demo user
     """
-    # USERS
-    email, generic_password = generate_dummy_users(n_users)
-
-    # PORTFOLIOS
+    n_dummies = n_users - 1  # skip demo user
+    generate_dataset(
+        users=n_dummies,
+        portfolios=n_dummies * n_portfolios,
+        stocks=n_dummies * n_stocks,
+        lots=n_dummies * n_stocks * n_lots,
+        seed=seed,
+    )
 
-    for user_id in range(1, n_users):  # skip demo user
-        generate_dummy_portfolios(n_portfolios, user_id)
-        generate_dummy_stocks(n_stocks, n_portfolios, user_id)
-        generate_dummy_lots(n_lots, n_stocks, user_id)
     # Demo user special case
-    demo_id = n_users
+    email = "demo@demo.com"
+    if crud.add_user(email, "Demo", "User", GENERIC_PASSWORD) == Status.FAIL:
+        print(f"Could not add demo user: {email}")
+        return
+    demo_id = User.query.filter_by(email=email).first().id
     populate_demo_user(
-        demo_id, (demo_id - 1) * n_portfolios + 1, (demo_id - 1) * n_stocks + 1
+        demo_id,
+        (db.session.query(func.max(Portfolio.id)).scalar() or 0) + 1,
+        (db.session.query(func.max(Stock.id)).scalar() or 0) + 1,
     )
 
     generate_dummy_challenges(n_users)
@@ -274,7 +159,7 @@ def generate_dummy_data(n_users=4, n_portfolios=2, n_stocks=4, n_lots=5):
         f"\n\t****************************************\n\
         The following dummy account may be used for testing:\n\n\
         username: {email}\n\
-        password: {generic_password}\n\n\
+        password: {GENERIC_PASSWORD}\n\n\
         ****************************************\n"
     )
 
@@ -289,6 +174,7 @@ def populate_symbols(engine):
         df_symbols["info"] = "{}"  # fill with empty json string
 
         df_symbols.to_sql("stock_pages", engine, if_exists="append", index=False)
+        search_utils.invalidate_search_index()  # bulk insert bypasses ORM events
 
         print("Stock symbols loaded")
     except Exception as e:
@@ -0,0 +1,332 @@
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable
+
+import numpy as np
+import pandas as pd
+from app import db
+from app.models.schema import (
+    Challenge,
+    ChallengeEntry,
+    LotBought,
+    LotSold,
+    Portfolio,
+    PriceAlert,
+    Stock,
+    StockPage,
+    User,
+)
+from faker import Faker
+from sqlalchemy import func
+from werkzeug.security import generate_password_hash
+
+# ==============================================================================
+# Synthetic Load Generator
+# ==============================================================================
+"""
+Bulk inserts a random dataset of the given size, reproducible from the seed.
+Stock pages must be loaded first (see db_populator.populate_symbols).
+
+Run with: python3 -m app.scripts.load_generator --dataset medium --seed 0
+"""
+
+GENERIC_PASSWORD = "Password1!"
+INSERT_CHUNK_SIZE = 50000  # rows per executemany
+NAME_POOL_SIZE = 500  # distinct first and last names to draw from
+CHALLENGE_SIZE = 5  # stocks per challenge entry, as enforced by the challenge API
+
+# row counts of each table, lots sold are half the lots bought
+DATASETS = {
+    "tiny": dict(users=10, portfolios=20, stocks=100, lots=500, alerts=20, entries=25),
+    "small": dict(
+        users=1000, portfolios=3000, stocks=15000, lots=100000, alerts=1000, entries=5000
+    ),
+    "medium": dict(
+        users=10000,
+        portfolios=30000,
+        stocks=150000,
+        lots=300000,
+        alerts=5000,
+        entries=25000,
+    ),
+    "large": dict(
+        users=100000,
+        portfolios=300000,
+        stocks=500000,
+        lots=1000000,
+        alerts=10000,
+        entries=50000,
+    ),
+}
+
+
+def generate_dataset(
+    users: int,
+    portfolios: int,
+    stocks: int,
+    lots: int,
+    alerts: int = 0,
+    entries: int = 0,
+    seed: int = 0,
+) -> Dict[str, int]:
+    """Insert a random dataset after the existing rows, returns the rows inserted
+    per table. Parents are drawn uniformly, so children counts per parent vary.
+    """
+    rng = np.random.default_rng(seed)
+    faker = Faker()
+    faker.seed_instance(seed)
+    now = datetime.now().replace(microsecond=0)
+
+    page_ids = np.array([id for id, in db.session.query(StockPage.id)], dtype=np.int64)
+    if page_ids.size == 0:
+        raise ValueError("No stock pages, populate the stock symbols first")
+
+    # --------------------------------------------------------------------------
+    # Users, all with the same password (hashing is the slow part of add_user)
+    # --------------------------------------------------------------------------
+    user_ids = _next_ids(User, users)
+    first_names = np.array([faker.first_name() for _ in range(NAME_POOL_SIZE)])
+    last_names = np.array([faker.last_name() for _ in range(NAME_POOL_SIZE)])
+    df_users = pd.DataFrame(
+        {
+            "id": user_ids,
+            "email": [f"user{id}@example.com" for id in user_ids],
+            "first_name": first_names[rng.integers(0, NAME_POOL_SIZE, users)],
+            "last_name": last_names[rng.integers(0, NAME_POOL_SIZE, users)],
+            "password_hash": generate_password_hash(GENERIC_PASSWORD),
+            "validated": True,
+        }
+    )
+
+    # --------------------------------------------------------------------------
+    # Portfolios and stocks, numbered in order within their parent
+    # --------------------------------------------------------------------------
+    portfolio_ids = _next_ids(Portfolio, portfolios)
+    portfolio_users = np.sort(rng.choice(user_ids, portfolios))
+    df_portfolios = pd.DataFrame(
+        {
+            "id": portfolio_ids,
+            "user_id": portfolio_users,
+            "portfolio_name": [f"Portfolio {id}" for id in portfolio_ids],
+            "order": _rank_within(portfolio_users),
+            "is_dirty": True,
+            "last_updated": now,
+        }
+    )
+
+    # stock pages are distinct within a portfolio (unless it holds every page)
+    stock_ids = _next_ids(Stock, stocks)
+    stock_portfolios = np.sort(rng.integers(0, portfolios, stocks))
+    stock_order = _rank_within(stock_portfolios)
+    page_offsets = rng.integers(0, page_ids.size, portfolios)
+    df_stocks = pd.DataFrame(
+        {
+            "id": stock_ids,
+            "user_id": portfolio_users[stock_portfolios],
+            "portfolio_id": portfolio_ids[stock_portfolios],
+            "stock_page_id": page_ids[
+                (page_offsets[stock_portfolios] + stock_order) % page_ids.size
+            ],
+            "order": stock_order,
+            "is_dirty": True,
+            "last_updated": now,
+        }
+    )
+
+    # --------------------------------------------------------------------------
+    # Lots
+    # --------------------------------------------------------------------------
+    def random_lots(model, n_lots):
+        lot_stocks = rng.integers(0, stocks, n_lots)
+        units = rng.integers(1, 1000, n_lots)
+        unit_price = np.round(rng.uniform(0.1, 1000, n_lots), 4)
+        trade_date = now - pd.to_timedelta(rng.integers(0, 5 * 365 * 86400, n_lots), "s")
+        return pd.DataFrame(
+            {
+                "id": _next_ids(model, n_lots),
+                "user_id": df_stocks["user_id"].values[lot_stocks],
+                "stock_id": stock_ids[lot_stocks],
+                "trade_date": trade_date,
+                "units": units,
+                "unit_price": unit_price,
+                "last_updated": now,
+            }
+        )
+
+    df_bought = random_lots(LotBought, lots)
+    df_sold = random_lots(LotSold, lots // 2)
+    df_sold["amount"] = df_sold["units"] * df_sold["unit_price"]
+
+    # --------------------------------------------------------------------------
+    # Price alerts, at most one per stock
+    # --------------------------------------------------------------------------
+    alerts = min(alerts, stocks)
+    high = np.round(rng.uniform(1, 1000, alerts), 2)
+    df_alerts = pd.DataFrame(
+        {
+            "id": _next_ids(PriceAlert, alerts),
+            "stock_id": stock_ids[rng.choice(stocks, alerts, replace=False)],
+            "high_threshold": high,
+            "low_threshold": np.round(high * rng.uniform(0.5, 1, alerts), 2),
+            "user_save_time": now - pd.to_timedelta(rng.integers(0, 86400, alerts), "s"),
+            "is_high_threshold_alerted": False,
+            "is_low_threshold_alerted": False,
+        }
+    )
+
+    # --------------------------------------------------------------------------
+    # A finished challenge, each entrant holding CHALLENGE_SIZE distinct stocks
+    # --------------------------------------------------------------------------
+    entrants = rng.choice(user_ids, min(entries // CHALLENGE_SIZE, users), replace=False)
+    entry_users = np.repeat(entrants, CHALLENGE_SIZE)
+    entry_pages = page_ids[
+        (
+            np.repeat(rng.integers(0, page_ids.size, entrants.size), CHALLENGE_SIZE)
+            + np.tile(np.arange(CHALLENGE_SIZE), entrants.size)
+        )
+        % page_ids.size
+    ]
+    start_price = np.round(rng.uniform(1, 1000, entry_users.size), 4)
+    end_price = np.round(start_price * rng.lognormal(0, 0.05, entry_users.size), 4)
+    challenge_ids = _next_ids(Challenge, 1 if entrants.size else 0)
+    df_challenges = pd.DataFrame(
+        {
+            "id": challenge_ids,
+            "start_date": now - timedelta(weeks=2),
+            "is_active": False,
+            "is_open": False,
+        }
+    )
+    df_entries = pd.DataFrame(
+        {
+            "id": _next_ids(ChallengeEntry, entry_users.size),
+            "challenge_id": challenge_ids.repeat(entry_users.size),
+            "user_id": entry_users,
+            "stock_page_id": entry_pages,
+            "start_price": start_price,
+            "end_price": end_price,
+            "perc_change": (end_price - start_price) / start_price * 100,
+        }
+    )
+    codes = dict(db.session.query(StockPage.id, StockPage.code))
+    df_entries["code"] = df_entries["stock_page_id"].map(codes)
+
+    # --------------------------------------------------------------------------
+    # Insert parents first, in one transaction
+    # --------------------------------------------------------------------------
+    tables = [
+        (User, df_users),
+        (Portfolio, df_portfolios),
+        (Stock, df_stocks),
+        (LotBought, df_bought),
+        (LotSold, df_sold),
+        (PriceAlert, df_alerts),
+        (Challenge, df_challenges),
+        (ChallengeEntry, df_entries),
+    ]
+    try:
+        for model, df in tables:
+            _bulk_insert(model, df)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return {model.__tablename__: len(df) for model, df in tables}
+
+
+def write_replay_fixtures(
+    codes: Iterable[str], data_dir: str, bars: int = 500, seed: int = 0
+) -> int:
+    """Write a random walk of daily bars ending today for each code, as fixtures of
+    the replay market data provider, returns the number of fixtures written
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end=datetime.now().date(), periods=bars, name="Date")
+    n_codes = 0
+    for code in sorted(set(codes)):
+        closes = rng.uniform(10, 500) * np.exp(np.cumsum(rng.normal(0, 0.02, bars)))
+        spread = closes * rng.uniform(0, 0.02, bars)
+        df = pd.DataFrame(
+            {
+                "Open": np.round(closes + rng.uniform(-1, 1, bars) * spread, 4),
+                "High": np.round(closes + spread, 4),
+                "Low": np.round(closes - spread, 4),
+                "Close": np.round(closes, 4),
+                "Volume": rng.integers(1000, 1000000, bars),
+            },
+            index=dates,
+        )
+        df.to_csv(os.path.join(data_dir, f"{code}.csv"))
+        n_codes += 1
+    return n_codes
+
+
+def _next_ids(model, n: int) -> np.ndarray:
+    """Ids following the table's current max id"""
+    start = (db.session.query(func.max(model.id)).scalar() or 0) + 1
+    return np.arange(start, start + n, dtype=np.int64)
+
+
+def _rank_within(groups: np.ndarray) -> np.ndarray:
+    """0-based position of each element within its run of equal sorted values"""
+    if groups.size == 0:
+        return groups
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    return np.arange(groups.size) - np.repeat(starts, np.diff(np.r_[starts, groups.size]))
+
+
+def _bulk_insert(model, df: pd.DataFrame):
+    """Insert the rows with one executemany per chunk, bypassing the ORM and the
+    per-value type processing of SQLAlchemy (datetimes are formatted as stored)
+    """
+    quote = db.engine.dialect.identifier_preparer.quote
+    statement = "INSERT INTO {} ({}) VALUES ({})".format(
+        quote(model.__tablename__),
+        ", ".join(quote(column) for column in df.columns),
+        ", ".join("?" * len(df.columns)),
+    )
+    rows = list(zip(*(_sql_values(df[column]) for column in df.columns)))
+
+    connection = db.session.connection()
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        connection.exec_driver_sql(statement, rows[start : start + INSERT_CHUNK_SIZE])
+
+
+def _sql_values(column: pd.Series) -> list:
+    """Python values of a column, datetimes as SQLite DateTime strings"""
+    if pd.api.types.is_datetime64_dtype(column):
+        dates = np.datetime_as_string(column.values.astype("datetime64[us]"))
+        return np.char.replace(dates, "T", " ").tolist()
+    return column.tolist()
+
+
+if __name__ == "__main__":
+    from app import create_app
+    from app.scripts.db_populator import populate_symbols
+
+    parser = argparse.ArgumentParser(description="Bulk insert a synthetic dataset")
+    parser.add_argument("--dataset", choices=DATASETS, default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    for table in DATASETS["small"]:
+        parser.add_argument(f"--{table}", type=int, help=f"override the {table} count")
+    args = parser.parse_args()
+
+    sizes = {
+        table: getattr(args, table) if getattr(args, table) is not None else count
+        for table, count in DATASETS[args.dataset].items()
+    }
+
+    app = create_app()
+    with app.app_context():
+        if StockPage.query.count() == 0:
+            populate_symbols(db.engine)
+
+        start = time.perf_counter()
+        counts = generate_dataset(**sizes, seed=args.seed)
+        for table, count in counts.items():
+            print(f"{table}: {count} rows")
+        print(f"Generated in {time.perf_counter() - start:.1f}s")
+        print(f"Every user's password is {GENERIC_PASSWORD}")
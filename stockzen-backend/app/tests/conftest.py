@@ -1,4 +1,5 @@
 import app.tests.mocks as mock
+import pandas as pd
 import pytest
 from app import create_app, db
 from app.scripts import db_populator
@@ -38,3 +39,54 @@ def auth_client(client_db):
     client_db.post("user/register", json=mock.user_register)
     client_db.post("user/login", json=mock.user_login)
     yield client_db
+
+
+# replay fixture of 30 daily bars for symbol TEST, closing at 100.0 to 129.0
+@pytest.fixture
+def replay_dir(tmp_path):
+    dates = pd.date_range("2021-10-01", periods=30, freq="D", name="Date")
+    closes = [100.0 + i for i in range(30)]
+    df = pd.DataFrame(
+        {
+            "Open": closes,
+            "High": [c + 1 for c in closes],
+            "Low": [c - 1 for c in closes],
+            "Close": closes,
+            "Volume": [1000] * 30,
+        },
+        index=dates,
+    )
+    df.to_csv(tmp_path / "TEST.csv")
+    return tmp_path
+
+
+def make_replay_client(replay_dir, database_uri):
+    app = create_app(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": database_uri,
+            "MARKET_DATA_PROVIDER": "replay",
+            "REPLAY_DATA_DIR": str(replay_dir),
+        }
+    )
+
+    with app.test_client() as client:
+        with app.app_context():
+            app.secret_key = "test_secret"
+            db.create_all()
+        client.post("user/register", json=mock.user_register)
+        client.post("user/login", json=mock.user_login)
+        yield client
+
+
+# authenticated client serving market data from the replay fixture
+@pytest.fixture
+def replay_client(replay_dir):
+    yield from make_replay_client(replay_dir, "sqlite://")
+
+
+# replay_client on a file db, for tests running sessions in several threads
+# (the in-memory db is one connection shared by every thread)
+@pytest.fixture
+def replay_file_client(replay_dir):
+    yield from make_replay_client(replay_dir, f"sqlite:///{replay_dir / 'app.sqlite'}")
@@ -123,6 +123,9 @@ uncached_stock_page = {
 units = 10
 unit_price = 123.45
 new_lot_1 = {"tradeDate": "2021-01-10", "units": units, "unitPrice": unit_price}
+units_2 = 30
+unit_price_2 = 2.5
+new_lot_2 = {"tradeDate": "2021-02-10", "units": units_2, "unitPrice": unit_price_2}
 
 
 def lot_details(type, id, lot):
@@ -152,3 +155,14 @@ overall = (simulated_gain / holdings) * 100
 new_summary_1 = {"holdings": holdings, "today": today, "overall": overall}
 
 sold_summary_1 = {"holdings": 0, "today": None, "overall": None}
+
+# ------------------------------------------------------------------------------
+# Calculation Cascade (new_lot_1 + new_lot_2 bought, new_lot_1 sold)
+# ------------------------------------------------------------------------------
+calc_avg_price = (units * unit_price + units_2 * unit_price_2) / (units + units_2)
+calc_units_held = units_2
+calc_value = calc_units_held * simulated_price
+calc_gain = (simulated_price - calc_avg_price) * calc_units_held
+calc_perc_gain = calc_gain / (calc_units_held * calc_avg_price) * 100
+calc_realised = units * (unit_price - calc_avg_price)
+calc_change = (units + units_2) * simulated_change
@@ -0,0 +1,21 @@
+from app.scripts.benchmark import find_regressions, run_benchmarks
+
+
+def test_benchmark():
+    results = run_benchmarks("tiny", repeat=2)
+
+    assert len(results) == 10  # every endpoint answered without an error
+    for metrics in results.values():
+        assert metrics["p50_ms"] <= metrics["p95_ms"] <= metrics["p99_ms"]
+        assert metrics["queries"] > 0 and metrics["peak_kib"] > 0
+
+    # unchanged metrics pass, an extra query per request is a regression
+    baseline = {"tiny": results}
+    assert find_regressions({"tiny": results}, baseline) == []
+    regressed = {name: dict(metrics) for name, metrics in results.items()}
+    regressed["GET /portfolio/list"]["queries"] += 1
+    assert find_regressions({"tiny": regressed}, baseline) == [
+        "tiny GET /portfolio/list: queries "
+        f"{results['GET /portfolio/list']['queries']} -> "
+        f"{regressed['GET /portfolio/list']['queries']}"
+    ]
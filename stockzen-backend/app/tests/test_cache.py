@@ -0,0 +1,71 @@
+import json
+import time
+
+from app import db
+from app.models.schema import StockPage
+from app.tests.conftest import replay_client
+from app.utils import cache_utils
+from app.utils import crud_utils as crud
+from app.utils.enums import Status
+
+
+def test_lru_cache():
+    cache = cache_utils.LRUCache(maxsize=2, ttl=0.1)
+    cache.set(1, "one")
+    cache.set(2, "two")
+    assert cache.get(1) == "one"
+
+    # least recently used entry is evicted
+    cache.set(3, "three")
+    assert cache.get(2) is None
+    assert cache.get(1) == "one" and cache.get(3) == "three"
+
+    cache.invalidate(1)
+    assert cache.get(1) is None
+
+    # a value read before an invalidation is not cached
+    version = cache.version(1)
+    cache.invalidate(1)
+    cache.set(1, "stale", version)
+    assert cache.get(1) is None
+    cache.set(1, "one", cache.version(1))
+    assert cache.get(1) == "one"
+
+    # entries expire after ttl
+    time.sleep(0.1)
+    assert cache.get(1) is None and cache.get(3) is None
+    assert cache.stats() == {"size": 0, "hits": 4, "misses": 5}
+
+
+def test_stock_page_cache(replay_client, monkeypatch):
+    with replay_client.application.app_context():
+        cache = cache_utils.get_stock_page_cache()
+        db.session.add(
+            StockPage(code="TEST", price=1.0, info=json.dumps({"longName": "Test Inc."}))
+        )
+        db.session.commit()
+
+        # second read is served from the cache without the database
+        stock_page = crud.fetch_stock_page(1)
+        assert stock_page["price"] == 1.0 and stock_page["longName"] == "Test Inc."
+        StockPage.query.get(1).price = 2.0
+        db.session.commit()
+        assert crud.fetch_stock_page(1)["price"] == 1.0
+        assert cache.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+        # updating the stock page invalidates it
+        assert crud.update_stock_page(1) == Status.SUCCESS
+        assert crud.fetch_stock_page(1)["price"] == 129.0  # last replayed close
+
+        # a page read before a concurrent refresh invalidates it is not cached
+        cache.invalidate(1)
+        query_item = crud.db_utils.query_item
+
+        def refreshed_during_read(model, id):
+            stock_page = query_item(model, id)
+            cache_utils.invalidate_stock_pages(id)
+            return stock_page
+
+        monkeypatch.setattr(crud.db_utils, "query_item", refreshed_during_read)
+        crud.fetch_stock_page(1)
+        assert cache.get(1) is None
@@ -0,0 +1,135 @@
+import app.tests.mocks as mock
+from app import db
+from app.models.schema import Stock, StockPage
+from app.tests.conftest import auth_client
+from sqlalchemy import event
+
+
+def test_cascade_calculations(auth_client):
+    client = auth_client
+    # Pre-test setup
+    # Add a portfolio, ID should be 1
+    response = client.post("/portfolio", json=mock.portfolio_name)
+    assert response.status_code == 200
+    # Add two stocks directly so no background stock page fetch overlaps the test,
+    # IDs should be 1 and 2
+    with client.application.app_context():
+        for new_stock in [mock.new_stock_1, mock.new_stock_2]:
+            db.session.add(
+                Stock(user_id=1, portfolio_id=1, stock_page_id=new_stock["stockPageId"])
+            )
+        db.session.commit()
+    # Stock 1: two buy lots and one sell lot, stock 2: no lots
+    response = client.post("lot/buy/1", json=mock.new_lot_1)
+    assert response.status_code == 200
+    response = client.post("lot/buy/1", json=mock.new_lot_2)
+    assert response.status_code == 200
+    response = client.post("lot/sell/1", json=mock.new_lot_1)
+    assert response.status_code == 200
+
+    # Add predetermined stock_page data
+    stock_1 = StockPage.query.filter_by(id=mock.new_stock_1["stockPageId"]).one()
+    stock_1.price = mock.simulated_price
+    stock_1.change = mock.simulated_change
+    db.session.commit()
+
+    # --------------------------------------------------------------------------
+    # Stock calculations
+    # --------------------------------------------------------------------------
+    # Trigger calculation cascade, then read the updated rows
+    client.get("/portfolio/list")
+    response = client.get("/stock/list/1")
+    stock_list = response.json
+    assert response.status_code == 200
+    assert len(stock_list) == 2
+
+    stock = stock_list[0]
+    assert stock["avgPrice"] == mock.calc_avg_price
+    assert stock["value"] == mock.calc_value
+    assert stock["gain"] == mock.calc_gain
+    assert stock["percGain"] == mock.calc_perc_gain
+    # stock without lots is left uncalculated
+    assert stock_list[1] == mock.stock_details(id=2, stock=mock.new_stock_2)
+
+    # --------------------------------------------------------------------------
+    # Lot calculations
+    # --------------------------------------------------------------------------
+    response = client.get("lot/buy/list/1")
+    lot_list = response.json
+    assert lot_list[0]["value"] == mock.units * mock.simulated_price
+    assert lot_list[0]["change"] == mock.units * mock.simulated_change
+    assert lot_list[1]["value"] == mock.units_2 * mock.simulated_price
+
+    response = client.get("lot/sell/list/1")
+    lot_list = response.json
+    assert lot_list[0]["realised"] == mock.calc_realised
+
+    # --------------------------------------------------------------------------
+    # Portfolio calculations
+    # --------------------------------------------------------------------------
+    response = client.get("/portfolio/1")
+    portfolio = response.json
+    assert portfolio["stockCount"] == 2
+    assert portfolio["value"] == mock.calc_value
+    assert portfolio["change"] == mock.calc_change
+    assert portfolio["gain"] == mock.calc_gain
+    assert portfolio["percChange"] == mock.calc_change / mock.calc_value * 100
+    assert portfolio["percGain"] == mock.calc_gain / mock.calc_value * 100
+
+
+def test_dirty_tracking(auth_client):
+    client = auth_client
+    # Pre-test setup
+    response = client.post("/portfolio", json=mock.portfolio_name)
+    assert response.status_code == 200
+    # Add the stock directly so no background stock page fetch overlaps the test
+    with client.application.app_context():
+        db.session.add(
+            Stock(
+                user_id=1, portfolio_id=1, stock_page_id=mock.new_stock_1["stockPageId"]
+            )
+        )
+        db.session.commit()
+    response = client.post("lot/buy/1", json=mock.new_lot_1)
+    assert response.status_code == 200
+
+    # record every write statement issued by the following requests
+    writes = []
+
+    def record_writes(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith(("UPDATE", "INSERT", "DELETE")):
+            writes.append(statement)
+
+    with client.application.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", record_writes)
+    try:
+        # --------------------------------------------------------------------------
+        # Dirty rows are recalculated once
+        # --------------------------------------------------------------------------
+        client.get("/portfolio/list")
+        assert len(writes) > 0
+
+        # --------------------------------------------------------------------------
+        # Clean reads do not write
+        # --------------------------------------------------------------------------
+        writes.clear()
+        client.get("/portfolio/list")
+        client.get("/stock/list/1")
+        client.get("lot/buy/list/1")
+        assert writes == []
+
+        # --------------------------------------------------------------------------
+        # Adding a lot flags the stock again
+        # --------------------------------------------------------------------------
+        response = client.post("lot/buy/1", json=mock.new_lot_2)
+        assert response.status_code == 200
+        writes.clear()
+        client.get("/portfolio/list")
+        assert len(writes) > 0
+    finally:
+        event.remove(engine, "before_cursor_execute", record_writes)
+
+    response = client.get("/portfolio/1")
+    assert response.json["value"] is None  # no stock page price yet
+    assert response.json["stockCount"] == 1
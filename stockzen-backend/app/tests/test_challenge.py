@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+
+from app import db
+from app.models.schema import Challenge, ChallengeEntry, LeaderboardEntry, User
+from app.tests.conftest import auth_client
+from app.utils import crud_utils as crud
+from app.utils.enums import Status
+
+
+def populate_challenge(n_users: int, codes=("AAPL", "MSFT", "TSLA")):
+    """Add a finished challenge where user i's stocks change by i, i+1, ... percent,
+    returns the challenge start date"""
+    start_date = datetime(2021, 11, 1)
+    db.session.add(Challenge(start_date=start_date, is_active=False, is_open=False))
+    for i in range(2, n_users + 1):  # user 1 is the logged in user
+        db.session.add(
+            User(email=f"user{i}@test.com", first_name="User", last_name=str(i))
+        )
+    db.session.flush()
+
+    for user_id in range(1, n_users + 1):
+        for j, code in enumerate(codes):
+            db.session.add(
+                ChallengeEntry(
+                    challenge_id=1,
+                    user_id=user_id,
+                    stock_page_id=j + 1,
+                    code=code,
+                    perc_change=float(user_id + j),
+                )
+            )
+    db.session.commit()
+    return start_date
+
+
+def test_leaderboard(auth_client):
+    client = auth_client
+    response = client.get("/challenge/leaderboard")
+    assert response.status_code == 404
+
+    # Pre-test setup
+    with client.application.app_context():
+        start_date = populate_challenge(25)
+
+    # --------------------------------------------------------------------------
+    # Top 10 plus the user's own row
+    # --------------------------------------------------------------------------
+    response = client.get("/challenge/leaderboard")
+    assert response.status_code == 200
+    result = response.json
+    assert result["startDate"] == start_date.isoformat()
+    assert result["endDate"] == (start_date + timedelta(weeks=1)).isoformat()
+
+    leaderboard = result["leaderboard"]
+    assert [row["rank"] for row in leaderboard] == list(range(1, 11))
+    assert leaderboard[0] == {
+        "userId": 25,
+        "userName": "User 25",
+        "rank": 1,
+        "percChange": 26.0,
+        "stocks": ["TSLA", "MSFT", "AAPL"],
+    }
+    assert result["userRow"]["userId"] == 1
+    assert result["userRow"]["rank"] == 25
+
+
+def test_leaderboard_snapshot(auth_client):
+    client = auth_client
+    # Pre-test setup
+    with client.application.app_context():
+        populate_challenge(25)
+    live_result = client.get("/challenge/leaderboard").json
+
+    # --------------------------------------------------------------------------
+    # Snapshot holds every ranked user and serves the same leaderboard
+    # --------------------------------------------------------------------------
+    with client.application.app_context():
+        assert crud.save_leaderboard_snapshot(1) == Status.SUCCESS
+        assert LeaderboardEntry.query.filter_by(challenge_id=1).count() == 25
+
+        # later changes to the entries no longer affect the finished leaderboard
+        ChallengeEntry.query.update({"perc_change": 0.0})
+        db.session.commit()
+
+    response = client.get("/challenge/leaderboard")
+    assert response.status_code == 200
+    assert response.json == live_result
+
+    # snapshot can be rewritten
+    with client.application.app_context():
+        assert crud.save_leaderboard_snapshot(1) == Status.SUCCESS
+        assert LeaderboardEntry.query.filter_by(challenge_id=1).count() == 25
+    assert client.get("/challenge/leaderboard").json["userRow"]["percChange"] == 0.0
@@ -0,0 +1,50 @@
+import pytest
+from app import db
+from app.models.schema import Challenge
+from app.tests.conftest import client
+from app.utils import db_utils
+from sqlalchemy import event
+
+
+def test_batch(client):
+    with client.application.app_context():
+        commits = []
+
+        def on_commit(session):
+            commits.append(session)
+
+        event.listen(db.session(), "after_commit", on_commit)
+
+        # writes in a batch are committed once, nested batches join the outer one
+        with db_utils.batch():
+            for _ in range(3):
+                db_utils.insert_item(Challenge())
+            with db_utils.batch():
+                db_utils.update_item_columns(Challenge, 1, {"is_open": False})
+            db_utils.delete_item(Challenge, 2)
+            assert commits == []
+        assert len(commits) == 1
+        assert [c.id for c in Challenge.query.all()] == [1, 3]
+        assert Challenge.query.get(1).is_open == False
+
+        # a failed write rolls back the whole batch
+        with pytest.raises(Exception):
+            with db_utils.batch():
+                db_utils.insert_item(Challenge())
+                db_utils.update_item_columns(Challenge, 99, {"is_open": False})
+        assert Challenge.query.count() == 2
+
+        # a failed write that was handled still rolls back the batch
+        with pytest.raises(RuntimeError):
+            with db_utils.batch():
+                db_utils.insert_item(Challenge())
+                try:
+                    db_utils.update_item_columns(Challenge, 99, {"is_open": False})
+                except Exception:
+                    pass
+        assert Challenge.query.count() == 2
+
+        # outside a batch every write commits
+        db_utils.insert_item(Challenge())
+        assert len(commits) == 2
+        event.remove(db.session(), "after_commit", on_commit)
@@ -0,0 +1,136 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from app import db
+from app.market_data import get_provider
+from app.models.schema import History, StockPage
+from app.tests.conftest import replay_client, replay_dir
+from app.utils import crud_utils as crud
+from app.utils import history_utils
+
+
+def test_stock_history_store(replay_client):
+    client = replay_client
+    # Pre-test setup
+    with client.application.app_context():
+        stock_page = StockPage(code="TEST", stock_name="Test Stock")
+        db.session.add(stock_page)
+        db.session.commit()
+        stock_page_id = stock_page.id
+
+    # --------------------------------------------------------------------------
+    # History is served from a single columnar row
+    # --------------------------------------------------------------------------
+    response = client.get(f"/stock-page/{stock_page_id}/history")
+    assert response.status_code == 200
+    history = response.json
+    assert len(history) == 30
+    assert history[0] == {
+        "stockPageId": stock_page_id,
+        "date": "2021-10-01",
+        "open": 100.0,
+        "high": 101.0,
+        "low": 99.0,
+        "close": 100.0,
+        "volume": 1000,
+    }
+    with client.application.app_context():
+        rows = History.query.filter_by(stock_page_id=stock_page_id).all()
+        assert len(rows) == 1
+        assert rows[0].n_bars == 30
+
+    # --------------------------------------------------------------------------
+    # Cached history is returned when the provider fails
+    # --------------------------------------------------------------------------
+    with client.application.app_context():
+        get_provider().failure_rate = 1
+    response = client.get(f"/stock-page/{stock_page_id}/history")
+    assert response.status_code == 200
+    assert response.json == history
+
+    # --------------------------------------------------------------------------
+    # New bars replace cached bars from the same date onwards
+    # --------------------------------------------------------------------------
+    with client.application.app_context():
+        new_bars = {
+            "dates": np.array(["2021-10-30", "2021-10-31"], dtype="datetime64[s]"),
+            "open": np.array([1.0, 2.0]),
+            "high": np.array([1.0, 2.0]),
+            "low": np.array([1.0, 2.0]),
+            "close": np.array([1.0, 2.0]),
+            "volume": np.array([1, 2]),
+        }
+        history_utils.append_history(stock_page_id, new_bars)
+        columns = history_utils.load_history(stock_page_id)
+        assert len(columns["dates"]) == 31
+        assert list(columns["close"][-3:]) == [128.0, 1.0, 2.0]
+
+        # period is sliced from the last bar
+        columns = history_utils.slice_period(columns, "5d")
+        assert len(columns["dates"]) == 5
+
+
+def test_delta_history_fetch(replay_client):
+    client = replay_client
+    # Pre-test setup
+    with client.application.app_context():
+        stock_page = StockPage(code="TEST", stock_name="Test Stock")
+        db.session.add(stock_page)
+        db.session.commit()
+        stock_page_id = stock_page.id
+
+    with client.application.app_context():
+        # record the arguments of every history request
+        provider = get_provider()
+        requests = []
+        provider_history = provider.history
+
+        def record_history(sym, **kwargs):
+            requests.append(kwargs)
+            return provider_history(sym, **kwargs)
+
+        provider.history = record_history
+        fixture = provider._load("TEST", "1d")
+
+        # ----------------------------------------------------------------------
+        # Cache miss loads the full period
+        # ----------------------------------------------------------------------
+        history = crud.fetch_stock_history(stock_page_id, "1mo")
+        assert len(history) == 30
+        assert requests[-1]["start"] is None
+
+        # ----------------------------------------------------------------------
+        # Later fetches only request bars from the last settled bar
+        # ----------------------------------------------------------------------
+        new_bar = fixture.iloc[[-1]].copy()
+        new_bar.index = new_bar.index + pd.Timedelta(days=1)
+        provider._frames[("TEST", "1d")] = pd.concat([fixture, new_bar])
+        history = crud.fetch_stock_history(stock_page_id, "1mo")
+        assert len(requests) == 2
+        assert requests[-1]["start"] == datetime(2021, 10, 29)
+        assert history[-1]["date"] == "2021-10-31"
+        assert len(history_utils.load_history(stock_page_id)["dates"]) == 31
+
+        # ----------------------------------------------------------------------
+        # A partial last bar that moved is overwritten without a full reload
+        # ----------------------------------------------------------------------
+        moved = provider._frames[("TEST", "1d")].copy()
+        moved.iloc[-1, moved.columns.get_loc("Close")] += 1.5
+        provider._frames[("TEST", "1d")] = moved
+        history = crud.fetch_stock_history(stock_page_id, "1mo")
+        assert len(requests) == 3
+        assert requests[-1]["start"] == datetime(2021, 10, 30)
+        assert history[-1]["close"] == 130.5
+        assert len(history_utils.load_history(stock_page_id)["dates"]) == 31
+
+        # ----------------------------------------------------------------------
+        # Adjusted prices trigger a full reload
+        # ----------------------------------------------------------------------
+        adjusted = provider._frames[("TEST", "1d")].copy()
+        adjusted[["Open", "High", "Low", "Close"]] /= 2
+        provider._frames[("TEST", "1d")] = adjusted
+        history = crud.fetch_stock_history(stock_page_id, "1mo")
+        assert len(requests) == 5
+        assert requests[-1]["start"] is None
+        assert history[-1]["close"] == 65.25
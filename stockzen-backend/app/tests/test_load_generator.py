@@ -0,0 +1,81 @@
+from app import db
+from app.models.schema import (
+    ChallengeEntry,
+    LotBought,
+    LotSold,
+    Portfolio,
+    PriceAlert,
+    Stock,
+    User,
+)
+from app.scripts import db_populator
+from app.scripts.load_generator import DATASETS, GENERIC_PASSWORD, generate_dataset
+from app.tests.conftest import client_db
+from sqlalchemy import DateTime, select
+
+
+def dump_tables():
+    """Rows of the generated tables, without the timestamps relative to now and
+    the randomly salted password hashes
+    """
+    tables = [User, Portfolio, Stock, LotBought, LotSold, PriceAlert, ChallengeEntry]
+    dump = {}
+    for model in tables:
+        columns = [
+            column
+            for column in model.__table__.columns
+            if not isinstance(column.type, DateTime) and column.key != "password_hash"
+        ]
+        dump[model.__tablename__] = db.session.execute(
+            select(*columns).order_by(model.id)
+        ).all()
+    return dump
+
+
+def test_generate_dataset(client_db):
+    app = client_db.application
+    with app.app_context():
+        counts = generate_dataset(**DATASETS["tiny"], seed=1)
+        assert counts == {
+            "users": 10,
+            "portfolios": 20,
+            "stocks": 100,
+            "lots_bought": 500,
+            "lots_sold": 250,
+            "price_alerts": 20,
+            "challenges": 1,
+            "challenge_entries": 25,
+        }
+        assert LotBought.query.count() == 500
+        dataset = dump_tables()
+
+        # children belong to the user of their parent
+        mismatched = (
+            db.session.query(Stock)
+            .join(Portfolio, Stock.portfolio_id == Portfolio.id)
+            .filter(Stock.user_id != Portfolio.user_id)
+            .count()
+        )
+        assert mismatched == 0
+        mismatched = (
+            db.session.query(LotBought)
+            .join(Stock, LotBought.stock_id == Stock.id)
+            .filter(LotBought.user_id != Stock.user_id)
+            .count()
+        )
+        assert mismatched == 0
+        assert ChallengeEntry.query.filter(ChallengeEntry.code == None).count() == 0
+
+    # generated users can log in
+    response = client_db.post(
+        "user/login", json={"email": "user1@example.com", "password": GENERIC_PASSWORD}
+    )
+    assert response.status_code == 200
+
+    # the same seed generates the same dataset
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db_populator.populate_symbols(db.engine)
+        generate_dataset(**DATASETS["tiny"], seed=1)
+        assert dump_tables() == dataset
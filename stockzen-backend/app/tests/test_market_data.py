@@ -0,0 +1,63 @@
+import pytest
+from app.market_data import MarketDataProvider, ReplayProvider, get_provider
+from app.tests.conftest import replay_client, replay_dir
+from app.tests.utils import net_blocker
+from app.utils import api_utils
+
+
+def test_replay_provider(replay_dir):
+    provider = ReplayProvider(str(replay_dir))
+
+    # --------------------------------------------------------------------------
+    # History
+    # --------------------------------------------------------------------------
+    assert len(provider.history("TEST")) == 30
+    history = provider.history("TEST", period="5d")
+    assert len(history) == 5
+    assert history["Close"].iloc[-1] == 129.0
+    history = provider.history("TEST", start="2021-10-10", end="2021-10-12")
+    assert list(history["Close"]) == [109.0, 110.0]
+    # symbols without a fixture have no data
+    assert len(provider.history("MISSING")) == 0
+
+    # --------------------------------------------------------------------------
+    # Info and grouped downloads
+    # --------------------------------------------------------------------------
+    info = provider.info("TEST")
+    assert info["regularMarketPrice"] == 129.0
+    assert info["previousClose"] == 128.0
+    assert list(provider.download(["TEST", "MISSING"], period="5d")) == ["TEST"]
+
+    # --------------------------------------------------------------------------
+    # Simulated failures
+    # --------------------------------------------------------------------------
+    provider = ReplayProvider(str(replay_dir), failure_rate=1)
+    with pytest.raises(ConnectionError):
+        provider.history("TEST")
+
+    # --------------------------------------------------------------------------
+    # Providers must implement history and info
+    # --------------------------------------------------------------------------
+    class HistoryOnly(MarketDataProvider):
+        def history(self, sym, **kwargs):
+            return provider.history(sym)
+
+    with pytest.raises(TypeError):
+        HistoryOnly()
+
+
+def test_replay_config(replay_client):
+    # data is served from fixtures with no network access
+    net_blocker(True)
+    try:
+        with replay_client.application.app_context():
+            assert isinstance(get_provider(), ReplayProvider)
+            price, change, perc_change, prev_close, _ = api_utils.fetch_stock_data("TEST")
+            assert (price, change, prev_close) == (129.0, 1.0, 128.0)
+            assert api_utils.fetch_bulk_quotes(["TEST", "MISSING"]) == {
+                "TEST": (129.0, 1.0, 1.0 / 128.0 * 100, 128.0)
+            }
+            columns = api_utils.fetch_historical_data("TEST", "1mo")
+            assert len(columns["dates"]) == 30
+    finally:
+        net_blocker(False)
@@ -1,6 +1,9 @@
 import app.tests.mocks as mock
 import app.tests.utils as utils
+from app import db
+from app.models.schema import Portfolio, User
 from app.tests.conftest import auth_client_no_db
+from sqlalchemy import event
 
 
 def test_portfolio_endpoints(auth_client_no_db):
@@ -81,3 +84,38 @@ def test_portfolio_endpoints(auth_client_no_db):
     portfolio_list = response.json
     assert len(portfolio_list) == 1
     assert portfolio_list[0] == mock.portfolio_details(id=2, order=1)
+
+
+def test_portfolio_reorder(auth_client_no_db):
+    client = auth_client_no_db
+    for _ in range(3):
+        client.post("/portfolio", json=mock.portfolio_name)
+
+    # another user's portfolio cannot be reordered
+    with client.application.app_context():
+        db.session.add(User(email="other@test.com"))
+        db.session.add(Portfolio(user_id=2, portfolio_name="Other Portfolio"))
+        db.session.commit()
+
+    response = client.put("/portfolio/list", json=utils.ordering((1, 3), (4, 1)))
+    # Fail: nothing is reordered when any row is not the user's
+    assert response.status_code == 500
+    response = client.get("/portfolio/list")
+    assert [p["order"] for p in response.json] == [0, 0, 0]
+
+    # Success: all rows are reordered by a single UPDATE
+    statements = []
+
+    def on_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with client.application.app_context():
+        event.listen(db.engine, "before_cursor_execute", on_execute)
+    response = client.put("/portfolio/list", json=utils.ordering((1, 3), (2, 2), (3, 1)))
+    with client.application.app_context():
+        event.remove(db.engine, "before_cursor_execute", on_execute)
+    assert response.status_code == 200
+    assert len([s for s in statements if s.startswith("UPDATE portfolios")]) == 1
+
+    response = client.get("/portfolio/list")
+    assert {p["id"]: p["order"] for p in response.json} == {1: 3, 2: 2, 3: 1}
@@ -0,0 +1,372 @@
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from app import db, mail
+from app.commands import price_alert
+from app.config import ALERT_MAIL_MAX_ATTEMPTS
+from app.models.schema import (
+    AlertShardLease,
+    AlertWorker,
+    MailOutbox,
+    Portfolio,
+    PriceAlert,
+    Stock,
+    StockPage,
+)
+from app.tests.conftest import (
+    replay_client,
+    replay_dir,
+    replay_file_client,
+)
+from app.utils import alert_utils, mail_utils
+from sqlalchemy import insert
+
+N_BARS = 60
+
+
+def write_alert_bars(replay_dir) -> pd.DatetimeIndex:
+    """30m bars of TEST over the last days, the high rises from 100 to 130 at
+    bar 30 then falls back, the low is 2 below the high"""
+    start = pd.Timestamp(datetime.now() - timedelta(days=3)).floor("30min")
+    times = pd.date_range(start, periods=N_BARS, freq="30min", name="Datetime")
+    highs = np.array([100.0 + min(i, N_BARS - i) for i in range(N_BARS)])
+    df = pd.DataFrame(
+        {
+            "Open": highs - 1,
+            "High": highs,
+            "Low": highs - 2,
+            "Close": highs - 1,
+            "Volume": [1000] * N_BARS,
+        },
+        index=times,
+    )
+    df.to_csv(replay_dir / "TEST_30m.csv")
+    return times
+
+
+def add_alerts(times, alerts):
+    """Add a price alert per (high, low, save bar, is_low_alerted) on the TEST stock"""
+    db.session.add(StockPage(code="TEST", stock_name="Test Inc."))
+    for i, (high, low, save_bar, is_low_alerted) in enumerate(alerts, start=1):
+        db.session.add(Portfolio(user_id=1, portfolio_name=f"Portfolio {i}"))
+        db.session.add(Stock(user_id=1, portfolio_id=i, stock_page_id=1))
+        db.session.add(
+            PriceAlert(
+                stock_id=i,
+                high_threshold=high,
+                low_threshold=low,
+                user_save_time=times[save_bar].to_pydatetime(),
+                is_high_threshold_alerted=high is None,
+                is_low_threshold_alerted=is_low_alerted or low is None,
+            )
+        )
+    db.session.commit()
+
+
+def test_first_crossings():
+    times = np.arange(6).astype("datetime64[h]")
+    values = np.array([1.0, 3.0, 2.0, 5.0, 4.0, 6.0])
+    starts = times[[0, 0, 2, 4, 0]]
+    thresholds = np.array([3.0, 5.5, 2.0, 5.0, 7.0])
+
+    crossings = alert_utils.first_crossings(times, values, starts, thresholds)
+    assert crossings.tolist() == [1, 5, 2, 5, 6]
+
+
+def test_check_price_alerts(replay_client, replay_dir):
+    times = write_alert_bars(replay_dir)
+    app = replay_client.application
+
+    with app.app_context():
+        add_alerts(
+            times,
+            [
+                (110.0, None, 0, False),  # high crossed at bar 10
+                (110.0, None, 40, False),  # saved above the threshold, crossed at bar 40
+                (200.0, None, 0, False),  # never crossed
+                (None, 105.0, 20, False),  # low crossed at bar 53
+                (None, 105.0, 20, True),  # already alerted
+            ],
+        )
+
+        # mails are queued in the outbox with the alerted flags
+        assert price_alert.check_price_alerts() == 3
+        assert MailOutbox.query.filter_by(sent_at=None).count() == 3
+
+        with mail.record_messages() as outbox:
+            send_pending(app)
+
+        assert MailOutbox.query.filter_by(sent_at=None).count() == 0
+        bodies = sorted(message.body for message in outbox)
+        assert bodies == sorted(
+            f"The {kind} price alert for TEST in portfolio Portfolio {i} has been "
+            f"reached on {times[bar].strftime('%d %B %H:%M')} with the price of {price}."
+            for kind, i, bar, price in [
+                ("high", 1, 10, "110.00"),
+                ("high", 2, 40, "120.00"),
+                ("low", 4, 53, "105.00"),
+            ]
+        )
+
+        alerts = PriceAlert.query.order_by(PriceAlert.id).all()
+        assert [a.is_high_threshold_alerted for a in alerts[:3]] == [True, True, False]
+        assert alerts[3].is_low_threshold_alerted
+        assert all(a.last_check_time is not None for a in alerts)
+
+        # crossed alerts are not sent again
+        assert price_alert.check_price_alerts() == 0
+        assert MailOutbox.query.count() == 3
+
+
+def send_pending(app, workers=2) -> int:
+    """Send the pending outbox mails, returns the number of mails queued"""
+    dispatcher = mail_utils.MailDispatcher(app, workers=workers)
+    dispatcher.start()
+    count = dispatcher.enqueue_pending()
+    dispatcher.join()
+    dispatcher.stop()
+    return count
+
+
+def test_mail_dispatcher(replay_file_client):
+    app = replay_file_client.application
+    with app.app_context():
+        for i in range(20):
+            db.session.add(
+                MailOutbox(recipient=f"user{i}@test.com", subject=f"Mail {i}", body="")
+            )
+        # header injection is refused by flask_mail, so this mail fails to send
+        db.session.add(
+            MailOutbox(recipient="bad@test.com", subject="Bad\nSubject", body="")
+        )
+        db.session.commit()
+
+        with mail.record_messages() as outbox:
+            assert send_pending(app) == 21
+        assert sorted(message.subject for message in outbox) == sorted(
+            f"Mail {i}" for i in range(20)
+        )
+
+        # only the failed mail is sent again, until it runs out of attempts
+        for _ in range(ALERT_MAIL_MAX_ATTEMPTS - 1):
+            assert send_pending(app) == 1
+        assert send_pending(app) == 0
+
+        bad = MailOutbox.query.filter_by(recipient="bad@test.com").one()
+        assert bad.sent_at is None and bad.attempts == ALERT_MAIL_MAX_ATTEMPTS
+
+
+def test_mail_connect_failure(replay_file_client, monkeypatch):
+    app = replay_file_client.application
+    with app.app_context():
+        db.session.add(MailOutbox(recipient="user@test.com", subject="Mail", body=""))
+        db.session.commit()
+
+        def connect():
+            raise ConnectionRefusedError("SMTP is down")
+
+        # the mail is counted as a failed attempt and queued again
+        with monkeypatch.context() as m:
+            m.setattr(mail, "connect", connect)
+            assert send_pending(app) == 1
+            assert MailOutbox.query.one().attempts == 1
+            assert send_pending(app) == 1
+            assert MailOutbox.query.one().attempts == 2
+
+        with mail.record_messages() as outbox:
+            assert send_pending(app) == 1
+        assert [message.subject for message in outbox] == ["Mail"]
+        assert MailOutbox.query.one().sent_at is not None
+
+
+def test_alert_book(replay_client, replay_dir):
+    book = alert_utils.AlertBook()
+    book.upsert(1, "AAA", 110.0, 90.0)
+    book.upsert(2, "AAA", 120.0, None)
+    book.upsert(3, "AAA", 105.0, 95.0)
+    book.upsert(4, "BBB", 100.0, None)
+
+    assert book.triggered("AAA", 100.0, 100.0) == []
+    assert sorted(book.triggered("AAA", 110.0, 100.0)) == [1, 3]
+    assert sorted(book.triggered("AAA", 130.0, 90.0)) == [1, 1, 2, 3, 3]
+    assert book.triggered("AAA", 100.0, 95.0) == [3]
+    assert book.triggered("CCC", 1000.0, 0.0) == []
+
+    # upserts replace the thresholds and discards remove one or both sides
+    book.upsert(2, "AAA", None, 99.0)
+    book.discard(3, low=False)
+    book.discard(4)
+    assert sorted(book.triggered("AAA", 110.0, 90.0)) == [1, 1, 2, 3]
+    assert book.triggered("BBB", 1000.0, 0.0) == []
+    assert len(book) == 3
+
+    # ORM writes update a loaded book, other alerts are loaded by sync
+    times = write_alert_bars(replay_dir)
+    with replay_client.application.app_context():
+        add_alerts(times, [(110.0, None, 0, False)])
+        book = alert_utils.get_alert_book()
+        book.sync()
+        assert book.triggered("TEST", 110.0, 0.0) == [1]
+
+        alert = PriceAlert.query.get(1)
+        alert.high_threshold = 120.0
+        db.session.commit()
+        assert book.triggered("TEST", 110.0, 0.0) == []
+
+        db.session.delete(alert)
+        db.session.commit()
+        assert len(book) == 0
+
+        # an alert stamped before the watermark but committed after the last sync
+        # (written by another process, so the book only sees it through sync)
+        result = db.session.execute(
+            insert(PriceAlert).values(
+                stock_id=1,
+                high_threshold=110.0,
+                user_save_time=book.watermark - timedelta(seconds=1),
+                is_high_threshold_alerted=False,
+                is_low_threshold_alerted=True,
+            )
+        )
+        db.session.commit()
+        book.sync()
+        assert book.triggered("TEST", 110.0, 0.0) == [result.inserted_primary_key[0]]
+
+
+def test_rate_limiter():
+    limiter = alert_utils.RateLimiter(rate=50)
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.acquire()
+    # the first token is available immediately, then one every 20ms
+    assert time.monotonic() - start >= 0.09
+
+
+def test_alert_scheduler(replay_client, replay_dir):
+    times = write_alert_bars(replay_dir)
+    app = replay_client.application
+
+    with app.app_context():
+        add_alerts(times, [(110.0, None, 0, False), (None, 105.0, 20, False)])
+        db.session.add(StockPage(code="LATE", stock_name="Late Inc."))
+        db.session.add(Portfolio(user_id=1, portfolio_name="Portfolio 3"))
+        db.session.add(Stock(user_id=1, portfolio_id=3, stock_page_id=2))
+        db.session.add(
+            PriceAlert(
+                stock_id=3,
+                high_threshold=1.0,
+                user_save_time=datetime.now(),  # not due for another interval
+                is_high_threshold_alerted=False,
+                is_low_threshold_alerted=True,
+            )
+        )
+        db.session.commit()
+
+        checked = []
+
+        def check(codes):
+            checked.append(codes)
+            return price_alert.check_price_alerts(codes)
+
+        scheduler = alert_utils.AlertScheduler(app, check, interval=60, workers=2)
+        try:
+            # only the overdue stock is checked, then it is due an interval later
+            assert scheduler.run_due() == 1
+            assert checked == [["TEST"]]
+            assert scheduler.run_due() == 0
+            assert 0 < scheduler.next_wait() <= 60
+        finally:
+            scheduler.shutdown()
+
+        metrics = scheduler.metrics
+        assert metrics["scheduled"] == 2
+        assert metrics["checks"] == 1 and metrics["alerts"] == 2
+        assert metrics["lag"] > 60 * 60  # saved days ago, never checked
+        assert MailOutbox.query.count() == 2
+
+        # batches failing on the pool threads are counted (only LATE is still alerted)
+        def failing_check(codes):
+            raise ConnectionError("Market data is down")
+
+        scheduler = alert_utils.AlertScheduler(app, failing_check, interval=0, workers=2)
+        try:
+            assert scheduler.run_due() == 1
+        finally:
+            scheduler.shutdown()
+        assert scheduler.metrics["failures"] == 1 and scheduler.metrics["alerts"] == 0
+
+
+def test_shard_lease(replay_client):
+    with replay_client.application.app_context():
+        first = alert_utils.ShardLease(n_shards=4)
+        second = alert_utils.ShardLease(n_shards=4)
+
+        # a single worker holds every shard, until another worker joins
+        assert first.renew() == {0, 1, 2, 3}
+        assert second.renew() == set()
+        assert first.renew() == {0, 1}
+        assert second.renew() == {2, 3}
+
+        # a dead worker's shards are taken over once its leases expire
+        expired = datetime.now() - timedelta(seconds=1)
+        AlertWorker.query.filter_by(owner=first.owner).update({"expires": expired})
+        AlertShardLease.query.filter_by(owner=first.owner).update({"expires": expired})
+        db.session.commit()
+        assert second.renew() == {0, 1, 2, 3}
+
+        # released shards are free for the remaining workers
+        first.renew()
+        second.renew()
+        second.release()
+        assert first.renew() == {0, 1, 2, 3}
+
+        # only the stocks of the held shards are checked
+        for i in range(1, 5):
+            db.session.add(StockPage(code=f"S{i}"))
+            db.session.add(Portfolio(user_id=1, portfolio_name=f"Portfolio {i}"))
+            db.session.add(Stock(user_id=1, portfolio_id=i, stock_page_id=i))
+            db.session.add(
+                PriceAlert(
+                    stock_id=i,
+                    high_threshold=1.0,
+                    user_save_time=datetime.now(),
+                    is_high_threshold_alerted=False,
+                    is_low_threshold_alerted=True,
+                )
+            )
+        db.session.commit()
+        starts = alert_utils.query_check_starts(shards={1, 2}, n_shards=4)
+        assert sorted(starts.index) == ["S1", "S2"]
+
+
+def test_no_duplicate_mails(replay_file_client, replay_dir):
+    times = write_alert_bars(replay_dir)
+    app = replay_file_client.application
+    with app.app_context():
+        add_alerts(times, [(110.0, None, 0, False)])
+
+        # a threshold is queued once however many workers notify it
+        crossing = alert_utils.Crossing(1, True, times[10], 110.0)
+        alert_info = alert_utils.query_active_alerts().set_index("id")
+        price_alert.notify_thresholds([crossing], alert_info)
+        price_alert.notify_thresholds([crossing], alert_info)
+        assert MailOutbox.query.count() == 1
+
+        for i in range(1, 40):
+            db.session.add(MailOutbox(recipient=f"user{i}@test.com", subject="", body=""))
+        db.session.commit()
+
+        # concurrent dispatchers each send the mails they claimed
+        dispatchers = [mail_utils.MailDispatcher(app, workers=1) for _ in range(2)]
+        for dispatcher in dispatchers:
+            dispatcher.start()
+        with mail.record_messages() as outbox:
+            assert sum(dispatcher.enqueue_pending() for dispatcher in dispatchers) == 40
+            for dispatcher in dispatchers:
+                dispatcher.join()
+                dispatcher.stop()
+
+        assert len(outbox) == 40
+        assert len({message.recipients[0] for message in outbox}) == 40
@@ -0,0 +1,53 @@
+import logging
+
+from app.models.schema import Portfolio
+from app.tests.conftest import replay_client
+from app.utils import query_utils
+
+
+def test_request_query_stats(replay_client, caplog):
+    app = replay_client.application
+    app.debug = True
+
+    response = replay_client.get("portfolio/list")
+    queries = int(response.headers["X-DB-Queries"])
+    assert queries > 0
+    assert float(response.headers["X-DB-Time"]) >= float(response.headers["X-DB-Slowest"])
+
+    # aggregated per endpoint
+    replay_client.get("portfolio/list")
+    with app.app_context():
+        metrics = query_utils.get_query_metrics().snapshot()["GET /portfolio/list"]
+    assert metrics["calls"] == 2 and metrics["queries"] == 2 * queries
+
+    # requests over budget are logged
+    app.config["QUERY_COUNT_BUDGET"] = queries - 1
+    with caplog.at_level(logging.WARNING):
+        replay_client.get("portfolio/list")
+    assert "GET /portfolio/list over query budget" in caplog.text
+
+    # no headers outside debug mode
+    app.debug = False
+    assert "X-DB-Queries" not in replay_client.get("portfolio/list").headers
+
+
+def test_track_job(replay_client):
+    app = replay_client.application
+
+    @query_utils.track_job
+    def job():
+        assert Portfolio.query.count() == 0
+        # nested tracking joins the outer job
+        with query_utils.track_queries("nested") as stats:
+            Portfolio.query.count()
+        return stats.count
+
+    with app.app_context():
+        assert job() == 2
+        metrics = query_utils.get_query_metrics().snapshot()
+        assert "nested" not in metrics
+        assert metrics[f"job {__name__}.test_track_job.<locals>.job"]["queries"] == 2
+
+        # statements outside requests and jobs are not counted
+        Portfolio.query.count()
+        assert query_utils.current_stats() is None
@@ -0,0 +1,144 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from app import db
+from app.models.schema import RefreshLock, StockPage
+from app.tests.conftest import client_db
+from app.utils import cache_utils, refresh_utils
+from app.utils.enums import Status
+
+
+def test_single_flight():
+    flights = refresh_utils.SingleFlight()
+    calls = []
+    results = []
+
+    def slow_fetch(key):
+        calls.append(key)
+        time.sleep(0.2)
+        return f"result {key}"
+
+    def request(key):
+        results.append(flights.do(key, slow_fetch, key))
+
+    # concurrent calls for the same key share one call, other keys run separately
+    threads = [threading.Thread(target=request, args=(1,)) for _ in range(5)]
+    threads.append(threading.Thread(target=request, args=(2,)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(calls) == [1, 2]
+    assert sorted(results) == ["result 1"] * 5 + ["result 2"]
+
+
+def test_refresh_lock(client_db):
+    with client_db.application.app_context():
+        # ----------------------------------------------------------------------
+        # Lock is exclusive until released
+        # ----------------------------------------------------------------------
+        owner = refresh_utils.acquire_lock("stock_page:1")
+        assert owner is not None
+        assert refresh_utils.acquire_lock("stock_page:1", timeout=0) is None
+        assert refresh_utils.acquire_lock("stock_page:2", timeout=0) is not None
+
+        refresh_utils.release_lock("stock_page:1", owner)
+        owner = refresh_utils.acquire_lock("stock_page:1", timeout=0)
+        assert owner is not None
+
+        # ----------------------------------------------------------------------
+        # Expired locks are taken over
+        # ----------------------------------------------------------------------
+        lock = RefreshLock.query.filter_by(key="stock_page:1").one()
+        lock.expires = datetime.now() - timedelta(seconds=1)
+        db.session.commit()
+        new_owner = refresh_utils.acquire_lock("stock_page:1", timeout=0)
+        assert new_owner not in [None, owner]
+
+        # releasing with the old owner token does not release the new holder
+        refresh_utils.release_lock("stock_page:1", owner)
+        assert RefreshLock.query.filter_by(key="stock_page:1").one().owner == new_owner
+
+
+def test_refresh_stock_page(client_db, monkeypatch):
+    updates = []
+    monkeypatch.setattr(
+        refresh_utils.crud_utils,
+        "update_stock_page",
+        lambda stock_page_id: updates.append(stock_page_id) or Status.SUCCESS,
+    )
+
+    with client_db.application.app_context():
+        # stock page refreshed by another worker within max_age is not fetched again
+        stock_page = StockPage.query.filter_by(id=1).one()
+        stock_page.last_updated = datetime.now()
+        stock_page.info = '{"symbol": "A"}'
+        db.session.commit()
+        assert refresh_utils.refresh_stock_page(1, max_age=90) == Status.SUCCESS
+        assert updates == []
+
+        # stale stock page is fetched and the lock is released afterwards
+        assert refresh_utils.refresh_stock_page(2, max_age=90) == Status.SUCCESS
+        assert updates == [2]
+        assert RefreshLock.query.count() == 0
+
+
+def test_stale_while_revalidate(client_db, monkeypatch):
+    updates = []
+    submits = []
+    monkeypatch.setattr(
+        refresh_utils.crud_utils,
+        "update_stock_page",
+        lambda stock_page_id: updates.append(stock_page_id) or Status.SUCCESS,
+    )
+    monkeypatch.setattr(
+        refresh_utils.executor, "submit", lambda fn, *args: submits.append(args)
+    )
+
+    with client_db.application.app_context():
+        stock_page = StockPage.query.filter_by(id=1).one()
+
+        # ----------------------------------------------------------------------
+        # Fresh cache is served without refreshing
+        # ----------------------------------------------------------------------
+        stock_page.price = 1.0
+        stock_page.info = '{"symbol": "A"}'
+        stock_page.last_updated = datetime.now()
+        db.session.commit()
+        assert refresh_utils.revalidate_stock_page(1) == Status.SUCCESS
+        assert (updates, submits) == ([], [])
+
+        # ----------------------------------------------------------------------
+        # Stale cache is served and refreshed in the background
+        # ----------------------------------------------------------------------
+        stock_page.last_updated = datetime.now() - timedelta(minutes=5)
+        db.session.commit()
+        assert refresh_utils.revalidate_stock_page(1) == Status.SUCCESS
+        assert (updates, submits) == ([], [(1,)])
+
+        # ----------------------------------------------------------------------
+        # Expired or missing cache blocks on the refresh
+        # ----------------------------------------------------------------------
+        stock_page.last_updated = datetime.now() - timedelta(days=1)
+        db.session.commit()
+        assert refresh_utils.revalidate_stock_page(1) == Status.SUCCESS
+        assert updates == [1]
+
+        assert refresh_utils.revalidate_stock_page(2) == Status.SUCCESS
+        assert updates == [1, 2]
+
+        # ----------------------------------------------------------------------
+        # A fresh page without company info (bulk quotes only) blocks on the refresh,
+        # unless its last fetch failed
+        # ----------------------------------------------------------------------
+        stock_page.info = "{}"
+        stock_page.last_updated = datetime.now()
+        db.session.commit()
+        assert refresh_utils.revalidate_stock_page(1) == Status.SUCCESS
+        assert updates == [1, 2, 1]
+
+        cache_utils.mark_failed_fetches(1)
+        assert refresh_utils.revalidate_stock_page(1) == Status.SUCCESS
+        assert updates == [1, 2, 1]
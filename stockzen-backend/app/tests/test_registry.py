@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+
+import torch
+from app import db
+from app.models.schema import StockPage
+from app.tests.conftest import replay_client, replay_dir
+from app.utils import crud_utils as crud
+from app.utils.enums import Status
+from predict.ml_utils import ml_predict
+from predict.ml_utils.registry import ModelRegistry, registry
+from predict.ml_utils.utils import LSTMModel, stacked_lstm_forward
+
+
+def test_model_registry(tmp_path):
+    torch.save(LSTMModel(hidden_layer_size=4), tmp_path / "TEST.pt")
+    with open(tmp_path / "accuracy.json", "w") as f:
+        json.dump({"TEST": 0.5}, f)
+    registry = ModelRegistry(str(tmp_path), str(tmp_path / "accuracy.json"))
+
+    # --------------------------------------------------------------------------
+    # Models and accuracy are loaded once
+    # --------------------------------------------------------------------------
+    model = registry.get_model("TEST")
+    assert not model.training
+    assert registry.get_model("TEST") is model
+    assert registry.get_accuracy("TEST") == 0.5
+    assert registry.get_accuracy("MISSING") is None
+
+    n_bytes = sum(p.numel() * 4 for p in model.parameters())  # float32
+    assert registry.memory_usage() == {"models": 1, "bytes": n_bytes}
+
+    # --------------------------------------------------------------------------
+    # Changed files are reloaded
+    # --------------------------------------------------------------------------
+    torch.save(LSTMModel(hidden_layer_size=4), tmp_path / "TEST.pt")
+    with open(tmp_path / "accuracy.json", "w") as f:
+        json.dump({"TEST": 0.6}, f)
+    for path in ["TEST.pt", "accuracy.json"]:
+        stat = os.stat(tmp_path / path)
+        os.utime(tmp_path / path, (stat.st_atime, stat.st_mtime + 10))
+
+    assert registry.get_model("TEST") is not model
+    assert registry.get_accuracy("TEST") == 0.6
+
+
+def test_stacked_lstm_forward():
+    torch.manual_seed(0)
+    models = [LSTMModel().eval() for _ in range(3)]
+    x = torch.randn(3, 20, 1)
+
+    # one batched pass over different weights matches each model's own forward pass
+    with torch.inference_mode():
+        expected = torch.cat([model(x[i : i + 1]) for i, model in enumerate(models)])
+        assert torch.allclose(stacked_lstm_forward(models, x), expected, atol=1e-5)
+
+
+def test_batch_prediction(replay_client, replay_dir, tmp_path, monkeypatch):
+    shutil.copy(replay_dir / "TEST.csv", replay_dir / "TEST2.csv")
+    model_dir = tmp_path / "models"
+    model_dir.mkdir()
+    torch.manual_seed(0)
+    for sym in ["TEST", "TEST2"]:
+        torch.save(LSTMModel(), model_dir / f"{sym}.pt")
+    monkeypatch.setattr(registry, "model_dir", str(model_dir))
+    monkeypatch.setattr(registry, "_models", {})
+
+    with replay_client.application.app_context():
+        predictions = ml_predict.batch_prediction(["TEST", "TEST2", "MISSING"])
+        assert predictions == {
+            "TEST": ml_predict.prediction("TEST"),
+            "TEST2": ml_predict.prediction("TEST2"),
+        }
+
+
+def test_bulk_update_predictions(replay_client, replay_dir, tmp_path, monkeypatch):
+    shutil.copy(replay_dir / "TEST.csv", replay_dir / "TEST2.csv")
+    model_dir = tmp_path / "models"
+    model_dir.mkdir()
+    torch.save(LSTMModel(), model_dir / "TEST.pt")
+    monkeypatch.setattr(registry, "model_dir", str(model_dir))
+    monkeypatch.setattr(registry, "_models", {})
+    monkeypatch.setattr(crud, "TOP_COMPANIES", ["TEST", "TEST2"])
+
+    with replay_client.application.app_context():
+        for code in ["TEST", "TEST2"]:
+            db.session.add(StockPage(code=code, prediction=1.0, confidence=0.5))
+        db.session.commit()
+
+        assert crud.bulk_update_stock_pages([1, 2]) == Status.SUCCESS
+        test, test2 = StockPage.query.order_by(StockPage.id).all()
+        assert test.price == test2.price == 129.0
+        assert test.prediction == ml_predict.prediction("TEST")
+
+        # the failed prediction (no model for TEST2) keeps the last good one
+        assert test2.prediction == 1.0 and test2.confidence == 0.5
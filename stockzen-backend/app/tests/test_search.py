@@ -0,0 +1,96 @@
+from app import db
+from app.models.schema import StockPage
+from app.tests.conftest import auth_client
+from app.utils import db_utils
+
+
+def search(client, backend, query):
+    client.application.config["SEARCH_BACKEND"] = backend
+    results = db_utils.search_query(query)
+    return [
+        (item.id, item.code) if backend == "sql" else (item["id"], item["code"])
+        for item in results
+    ]
+
+
+def test_search_index(auth_client):
+    client = auth_client
+
+    # --------------------------------------------------------------------------
+    # Index returns the same results and order as the SQL search
+    # --------------------------------------------------------------------------
+    with client.application.app_context():
+        for query in ["", "a", "Ap", "app", "APPLE", "inc", "bank of", "zzzz"]:
+            assert search(client, "index", query) == search(client, "sql", query)
+
+    client.application.config["SEARCH_BACKEND"] = "index"
+    response = client.get("/search?query=apple")
+    assert response.status_code == 200
+    assert response.json[0]["code"] == "AAPL"
+    assert response.json[0]["exchange"] is not None
+
+    # --------------------------------------------------------------------------
+    # Index is rebuilt when stock pages are added
+    # --------------------------------------------------------------------------
+    response = client.get("/search?query=zzzz")
+    assert response.status_code == 404
+    with client.application.app_context():
+        db.session.add(StockPage(code="ZZZZ", stock_name="Test Stock"))
+        db.session.commit()
+    response = client.get("/search?query=zzzz")
+    assert response.status_code == 200
+    assert response.json[0]["code"] == "ZZZZ"
+
+
+def test_fts_search(auth_client):
+    client = auth_client
+    client.application.config["SEARCH_BACKEND"] = "fts"
+
+    def codes(query):
+        response = client.get(f"/search?query={query}")
+        return (
+            [item["code"] for item in response.json]
+            if response.status_code == 200
+            else []
+        )
+
+    # --------------------------------------------------------------------------
+    # Ranked by exact code, code prefix, then word prefix in the name
+    # --------------------------------------------------------------------------
+    assert codes("aapl")[0] == "AAPL"
+    assert codes("brk-b")[:2] == ["BRK-B", "BRK-A"]
+    results = codes("apple")
+    assert set(results) >= {"AAPL", "APLE"}
+    # explicit prefix query, same as an unfinished last term
+    assert codes("appl*") == codes("appl")
+    assert set(codes("appl*")) >= set(results)
+    assert codes("berkshire hath")[:2] == ["BRK-A", "BRK-B"]
+
+    name_prefix = client.get("/search?query=bank").json
+    ranks = [
+        item["code"].lower().startswith("bank")
+        or item["stock_name"].lower().startswith("bank")
+        or " bank" in item["stock_name"].lower()
+        for item in name_prefix
+    ]
+    assert ranks == sorted(ranks, reverse=True)  # word prefix matches first
+
+    # --------------------------------------------------------------------------
+    # FTS table is kept in sync by triggers
+    # --------------------------------------------------------------------------
+    assert codes("zzzz") == []
+    with client.application.app_context():
+        db.session.add(StockPage(code="ZZZZ", stock_name="Test Stock"))
+        db.session.commit()
+    assert codes("zzzz") == ["ZZZZ"]
+
+    with client.application.app_context():
+        StockPage.query.filter_by(code="ZZZZ").one().stock_name = "Renamed Stock"
+        db.session.commit()
+    assert codes("renamed") == ["ZZZZ"]
+    assert codes("test stock") == []
+
+    with client.application.app_context():
+        db.session.delete(StockPage.query.filter_by(code="ZZZZ").one())
+        db.session.commit()
+    assert codes("zzzz") == []
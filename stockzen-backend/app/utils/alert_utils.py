@@ -0,0 +1,697 @@
+import heapq
+import math
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+from uuid import uuid4
+
+import numpy as np
+import pandas as pd
+from app import db
+from app.config import (
+    ALERT_CHECK_INTERVAL,
+    ALERT_CHECK_WORKERS,
+    ALERT_HISTORY_DAYS,
+    ALERT_INTERVAL,
+    ALERT_LEASE_TTL,
+    ALERT_RATE_LIMIT,
+    ALERT_SHARDS,
+    ALERT_SYNC_INTERVAL,
+    ALERT_SYNC_MARGIN,
+    QUOTE_BATCH_SIZE,
+)
+from app.market_data import get_provider
+from app.models.schema import (
+    AlertShardLease,
+    AlertWorker,
+    Portfolio,
+    PriceAlert,
+    Stock,
+    StockPage,
+    User,
+)
+from flask import current_app, has_app_context
+from pandas.core.frame import DataFrame
+from pandas.core.series import Series
+from sqlalchemy import delete, event, func, not_, or_, select, update
+from sqlalchemy.dialects.sqlite import insert
+
+from . import utils
+
+# ==============================================================================
+# Price alert book
+#   Active thresholds of every symbol kept sorted in memory, so the alerts that
+#   a bar's high/low may have crossed are found by bisection without a query.
+#   The book follows the price_alerts table incrementally: ORM writes in this
+#   process update it directly, and sync() pulls alerts saved by other processes
+#   (e.g. the API server) since the last sync.
+# ==============================================================================
+
+Entry = Tuple[float, int]  # (sort key, alert_id)
+
+
+class AlertBook:
+    """Thread-safe per-symbol sorted high and low thresholds of active alerts"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._highs = {}  # code: [(high_threshold, alert_id)], ascending
+        self._lows = {}  # code: [(-low_threshold, alert_id)], ascending
+        self._entries = {}  # alert_id: (code, high_threshold, low_threshold)
+        self.watermark = None  # latest user_save_time synced, None before loading
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def loaded(self) -> bool:
+        return self.watermark is not None
+
+    def upsert(
+        self, alert_id: int, code: str, high: Optional[float], low: Optional[float]
+    ):
+        """Set the active thresholds of an alert, None for an inactive threshold"""
+        with self._lock:
+            self._remove(alert_id)
+            if high is None and low is None:
+                return
+
+            self._entries[alert_id] = (code, high, low)
+            if high is not None:
+                insort(self._highs.setdefault(code, []), (high, alert_id))
+            if low is not None:
+                insort(self._lows.setdefault(code, []), (-low, alert_id))
+
+    def discard(self, alert_id: int, high: bool = True, low: bool = True):
+        """Remove the high and/or low threshold of an alert"""
+        with self._lock:
+            entry = self._remove(alert_id)
+        if entry is not None:
+            code, high_threshold, low_threshold = entry
+            self.upsert(
+                alert_id,
+                code,
+                None if high else high_threshold,
+                None if low else low_threshold,
+            )
+
+    def triggered(self, code: str, high: float, low: float) -> List[int]:
+        """Alerts of a symbol with a high threshold <= high or low threshold >= low,
+        O(log n + k) for k triggered alerts
+        """
+        with self._lock:
+            highs = self._highs.get(code, [])
+            lows = self._lows.get(code, [])
+            # thresholds crossed are a prefix of each sorted list
+            n_high = bisect_right(highs, (high, math.inf)) if not math.isnan(high) else 0
+            n_low = bisect_right(lows, (-low, math.inf)) if not math.isnan(low) else 0
+            return [id for _, id in highs[:n_high]] + [id for _, id in lows[:n_low]]
+
+    def sync(self):
+        """Load the alerts saved since the last sync (every alert on first sync)"""
+        stmt = (
+            select(
+                PriceAlert.id,
+                StockPage.code,
+                PriceAlert.high_threshold,
+                PriceAlert.low_threshold,
+                PriceAlert.is_high_threshold_alerted,
+                PriceAlert.is_low_threshold_alerted,
+                PriceAlert.user_save_time,
+            )
+            .select_from(PriceAlert)
+            .join(Stock)
+            .join(StockPage)
+        )
+        if self.watermark not in (None, datetime.min):  # datetime.min: no alerts yet
+            # save times are stamped before the commit, so an alert stamped before
+            # the watermark may have committed since: recent saves are upserted again
+            stmt = stmt.where(
+                PriceAlert.user_save_time
+                >= self.watermark - timedelta(seconds=ALERT_SYNC_MARGIN)
+            )
+
+        watermark = self.watermark or datetime.min
+        for row in db.session.execute(stmt):
+            self.upsert(
+                row.id,
+                row.code,
+                None if row.is_high_threshold_alerted else row.high_threshold,
+                None if row.is_low_threshold_alerted else row.low_threshold,
+            )
+            if row.user_save_time is not None:
+                watermark = max(watermark, row.user_save_time)
+        self.watermark = watermark
+
+    def _remove(self, alert_id: int):
+        entry = self._entries.pop(alert_id, None)
+        if entry is not None:
+            code, high, low = entry
+            if high is not None:
+                _remove_entry(self._highs, code, (high, alert_id))
+            if low is not None:
+                _remove_entry(self._lows, code, (-low, alert_id))
+        return entry
+
+
+def _remove_entry(book: Dict[str, List[Entry]], code: str, entry: Entry):
+    entries = book[code]
+    del entries[bisect_left(entries, entry)]
+    if not entries:
+        del book[code]
+
+
+def get_alert_book() -> Optional[AlertBook]:
+    """Return the app's alert book, or None outside the app context"""
+    if has_app_context():
+        return current_app.extensions.get("alert_book")
+    return None
+
+
+@event.listens_for(PriceAlert, "after_insert")
+@event.listens_for(PriceAlert, "after_update")
+def _on_price_alert_save(mapper, connection, target):
+    book = get_alert_book()
+    if book is None or not book.loaded:
+        return
+
+    code = connection.execute(
+        select(StockPage.code).join(Stock).where(Stock.id == target.stock_id)
+    ).scalar()
+    book.upsert(
+        target.id,
+        code,
+        None if target.is_high_threshold_alerted else target.high_threshold,
+        None if target.is_low_threshold_alerted else target.low_threshold,
+    )
+
+
+@event.listens_for(PriceAlert, "after_delete")
+def _on_price_alert_delete(mapper, connection, target):
+    book = get_alert_book()
+    if book is not None:
+        book.discard(target.id)
+
+
+def init_app(app):
+    app.extensions["alert_book"] = AlertBook()
+
+
+# ==============================================================================
+# Price alert evaluation
+#   The bars of all alerted symbols are fetched in grouped requests, the book
+#   narrows each symbol's alerts to those its bars may have crossed, and the
+#   first bar crossing each candidate's threshold after the alert was saved is
+#   found with running max/min arrays and searchsorted.
+# ==============================================================================
+
+
+class Crossing(NamedTuple):
+    alert_id: int
+    is_high: bool  # high threshold crossed, otherwise low threshold
+    time: pd.Timestamp  # bar where the threshold was first crossed
+    price: float  # bar high (or low) at the crossing
+
+
+def query_active_alerts(alert_ids: Iterable[int] = None) -> DataFrame:
+    """Price alerts with a threshold not yet alerted (of alert_ids if given),
+    one row per alert
+    """
+    stmt = (
+        select(
+            PriceAlert.id,
+            Stock.stock_page_id,
+            StockPage.code,
+            PriceAlert.user_save_time,
+            func.coalesce(PriceAlert.last_check_time, PriceAlert.user_save_time).label(
+                "check_from"
+            ),
+            # alerted or unset thresholds are not checked
+            func.iif(
+                not_(PriceAlert.is_high_threshold_alerted),
+                PriceAlert.high_threshold,
+                None,
+            ).label("high_threshold"),
+            func.iif(
+                not_(PriceAlert.is_low_threshold_alerted), PriceAlert.low_threshold, None
+            ).label("low_threshold"),
+            Portfolio.portfolio_name,
+            User.email,
+        )
+        .select_from(PriceAlert)
+        .join(Stock)
+        .join(StockPage)
+        .join(Portfolio)
+        .join(User)
+        .where(
+            or_(
+                not_(PriceAlert.is_high_threshold_alerted),
+                not_(PriceAlert.is_low_threshold_alerted),
+            )
+        )
+    )
+    if alert_ids is not None:
+        stmt = stmt.where(PriceAlert.id.in_(list(alert_ids)))
+
+    rows = db.session.execute(stmt).all()
+    alerts = DataFrame(rows, columns=[column.name for column in stmt.selected_columns])
+    alerts[["high_threshold", "low_threshold"]] = alerts[
+        ["high_threshold", "low_threshold"]
+    ].astype(float)
+    return alerts
+
+
+def query_check_starts(
+    codes: Iterable[str] = None,
+    shards: Iterable[int] = None,
+    n_shards: int = ALERT_SHARDS,
+) -> Series:
+    """Earliest unchecked time of the active alerts of each symbol, indexed by code
+    Limited to the given codes and/or the stocks in the given shards
+    (stock_page_id % n_shards) if given
+    """
+    stmt = (
+        select(
+            StockPage.code,
+            func.min(
+                func.coalesce(PriceAlert.last_check_time, PriceAlert.user_save_time)
+            ).label("check_from"),
+        )
+        .select_from(PriceAlert)
+        .join(Stock)
+        .join(StockPage)
+        .where(
+            or_(
+                not_(PriceAlert.is_high_threshold_alerted),
+                not_(PriceAlert.is_low_threshold_alerted),
+            )
+        )
+        .group_by(StockPage.code)
+    )
+    if codes is not None:
+        stmt = stmt.where(StockPage.code.in_(list(codes)))
+    if shards is not None:
+        stmt = stmt.where((StockPage.id % n_shards).in_(list(shards)))
+
+    rows = db.session.execute(stmt).all()
+    return Series(
+        [row.check_from for row in rows], index=[row.code for row in rows], dtype=object
+    )
+
+
+def fetch_alert_histories(starts: Series) -> Dict[str, DataFrame]:
+    """Fetch ALERT_INTERVAL bars of every symbol in grouped requests, from its
+    start time (at most ALERT_HISTORY_DAYS ago)
+    """
+    min_start = datetime.now() - timedelta(days=ALERT_HISTORY_DAYS)
+    starts = pd.to_datetime(starts).clip(lower=min_start)
+
+    # symbols with a similar start share a request
+    histories = {}
+    starts = starts.sort_values()
+    for i in range(0, len(starts), QUOTE_BATCH_SIZE):
+        batch = starts.iloc[i : i + QUOTE_BATCH_SIZE]
+        try:
+            histories.update(
+                get_provider().download(
+                    list(batch.index),
+                    interval=ALERT_INTERVAL,
+                    start=batch.iloc[0].to_pydatetime(),
+                )
+            )
+        except Exception as e:
+            utils.debug_exception(e, suppress=True)
+    return histories
+
+
+def triggered_alerts(book: AlertBook, histories: Dict[str, DataFrame]) -> List[int]:
+    """Alerts whose threshold the fetched bars' extreme high or low may have crossed"""
+    alert_ids = []
+    for code, history in histories.items():
+        if len(history) == 0:
+            continue
+        alert_ids.extend(
+            book.triggered(
+                code, float(np.nanmax(history["High"])), float(np.nanmin(history["Low"]))
+            )
+        )
+    return alert_ids
+
+
+def first_crossings(
+    times: np.ndarray, values: np.ndarray, starts: np.ndarray, thresholds: np.ndarray
+) -> np.ndarray:
+    """Index of the first bar at or after each start whose value reaches the
+    threshold (value >= threshold), len(values) where it is never reached
+    """
+    crossings = np.full(len(thresholds), len(values))
+    start_idx = np.searchsorted(times, starts, side="left")
+
+    # alerts saved at the same bar share one running max
+    for start in np.unique(start_idx):
+        if start == len(values):
+            continue
+        group = start_idx == start
+        running_max = np.maximum.accumulate(values[start:])
+        crossings[group] = start + np.searchsorted(
+            running_max, thresholds[group], side="left"
+        )
+    return crossings
+
+
+def evaluate_alerts(alerts: DataFrame, histories: Dict[str, DataFrame]) -> List[Crossing]:
+    """Find the first crossing bar of every active threshold"""
+    crossings = []
+    for code, symbol_alerts in alerts.groupby("code"):
+        history = histories.get(code)
+        if history is None or len(history) == 0:
+            continue
+
+        index = pd.DatetimeIndex(history.index)
+        if index.tz is not None:
+            index = index.tz_localize(None)  # compare in the exchange's local time
+        times = index.values
+        highs = history["High"].to_numpy(float)
+        lows = history["Low"].to_numpy(float)
+        starts = symbol_alerts["user_save_time"].values.astype(times.dtype)
+
+        for is_high, values, thresholds in [
+            (True, highs, symbol_alerts["high_threshold"].to_numpy()),
+            # low crossings are high crossings of the negated prices
+            (False, -lows, -symbol_alerts["low_threshold"].to_numpy()),
+        ]:
+            active = ~np.isnan(thresholds)
+            if not active.any():
+                continue
+            values = np.nan_to_num(values, nan=-np.inf)  # missing bars never cross
+            idx = first_crossings(times, values, starts[active], thresholds[active])
+
+            crossed = idx < len(values)
+            for alert_id, bar in zip(
+                symbol_alerts["id"].to_numpy()[active][crossed], idx[crossed]
+            ):
+                price = highs[bar] if is_high else lows[bar]
+                crossings.append(
+                    Crossing(int(alert_id), is_high, pd.Timestamp(times[bar]), price)
+                )
+    return crossings
+
+
+def update_check_time(codes: Sequence[str]):
+    """Update the last_check_time of the alerts of all symbols to be now"""
+    db.session.execute(
+        update(PriceAlert)
+        .where(
+            PriceAlert.stock_id.in_(
+                select(Stock.id).join(StockPage).where(StockPage.code.in_(codes))
+            )
+        )
+        .values(last_check_time=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+# ==============================================================================
+# Price alert scheduler
+#   Each alerted stock is due ALERT_CHECK_INTERVAL after its last check. Due
+#   stocks are popped from a heap ordered by due time and checked concurrently
+#   in batches, one market data request per batch under a global rate limit.
+# ==============================================================================
+
+
+class RateLimiter:
+    """Thread-safe token bucket allowing rate acquires per second on average
+    and bursts of up to burst acquires
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for a token"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._last) * self.rate
+                )
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AlertScheduler:
+    """Check every alerted stock once per interval, as soon as it is due
+
+    :param check: checks the alerts of a list of stock codes
+    :param interval: target seconds between the checks of a stock
+    :param workers: number of batches checked concurrently
+    :param rate: max checked batches (market data requests) per second
+    :param lease: shard lease of this worker, only its shards are checked
+    """
+
+    def __init__(
+        self,
+        app,
+        check: Callable[[List[str]], int],
+        interval: float = ALERT_CHECK_INTERVAL,
+        workers: int = ALERT_CHECK_WORKERS,
+        rate: float = ALERT_RATE_LIMIT,
+        batch_size: int = QUOTE_BATCH_SIZE,
+        lease: "ShardLease" = None,
+    ):
+        self.app = app
+        self.lease = lease
+        self.check = check
+        self.interval = timedelta(seconds=interval)
+        self.batch_size = batch_size
+        self.limiter = RateLimiter(rate)
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._heap = []  # (due, code)
+        self._due = {}  # code: due time of its heap entry, stale entries are skipped
+        self._last_refresh = None
+        self.metrics = {
+            "scheduled": 0,  # stocks with active alerts
+            "sweeps": 0,  # number of run_due calls that checked stocks
+            "checks": 0,  # stocks checked
+            "alerts": 0,  # alerts sent
+            "failures": 0,  # batches that raised
+            "sweep_duration": 0.0,  # seconds taken by the last sweep
+            "lag": 0.0,  # seconds the most overdue stock of the last sweep waited
+            "max_lag": 0.0,
+        }
+
+    def refresh(self):
+        """Pick up newly saved alerts and schedule their stocks, a stock is due
+        interval after its alerts were last checked
+        """
+        get_alert_book().sync()
+        if self.lease is None:
+            starts = query_check_starts()
+        else:
+            shards = self.lease.renew()
+            starts = query_check_starts(shards=shards, n_shards=self.lease.n_shards)
+
+        self._due = {code: due for code, due in self._due.items() if code in starts}
+        for code, check_from in starts.items():
+            if code not in self._due:
+                due = pd.Timestamp(check_from).to_pydatetime() + self.interval
+                self._due[code] = due
+                heapq.heappush(self._heap, (due, code))
+
+        self.metrics["scheduled"] = len(self._due)
+        self._last_refresh = time.monotonic()
+
+    def next_wait(self) -> float:
+        """Seconds until the next stock is due or the alerts are refreshed"""
+        wait = ALERT_SYNC_INTERVAL
+        if self._last_refresh is not None:
+            wait -= time.monotonic() - self._last_refresh
+        if self._heap:
+            wait = min(wait, (self._heap[0][0] - datetime.now()).total_seconds())
+        return max(0, wait)
+
+    def run_due(self) -> int:
+        """Check all stocks that are due, returns the number of stocks checked"""
+        if (
+            self._last_refresh is None
+            or time.monotonic() - self._last_refresh >= ALERT_SYNC_INTERVAL
+        ):
+            self.refresh()
+
+        now = datetime.now()
+        codes, lag = [], 0.0
+        while self._heap and self._heap[0][0] <= now:
+            due, code = heapq.heappop(self._heap)
+            if self._due.get(code) != due:
+                continue  # rescheduled or no longer alerted
+            codes.append(code)
+            lag = max(lag, (now - due).total_seconds())
+        if not codes:
+            return 0
+
+        start = time.monotonic()
+        batches = [
+            codes[i : i + self.batch_size] for i in range(0, len(codes), self.batch_size)
+        ]
+        # metrics are only updated on this thread
+        for alerts in self._pool.map(self._check_batch, batches):
+            if alerts is None:
+                self.metrics["failures"] += 1
+            else:
+                self.metrics["alerts"] += alerts
+
+        # the next check is due interval after this one
+        due = datetime.now() + self.interval
+        for code in codes:
+            if code in self._due:
+                self._due[code] = due
+                heapq.heappush(self._heap, (due, code))
+
+        self.metrics["sweeps"] += 1
+        self.metrics["checks"] += len(codes)
+        self.metrics["sweep_duration"] = time.monotonic() - start
+        self.metrics["lag"] = lag
+        self.metrics["max_lag"] = max(self.metrics["max_lag"], lag)
+        return len(codes)
+
+    def shutdown(self):
+        self._pool.shutdown()
+        if self.lease is not None:
+            self.lease.release()
+
+    def _check_batch(self, codes: List[str]) -> Optional[int]:
+        """Check a batch on a pool thread, returns the alerts sent, None if it raised"""
+        self.limiter.acquire()
+        with self.app.app_context():
+            try:
+                return self.check(codes)
+            except Exception as e:
+                utils.debug_exception(e, suppress=True)
+                return None
+
+
+# ==============================================================================
+# Price alert shards
+#   Worker processes split the stocks by stock_page_id % n_shards. Each worker
+#   heartbeats in alert_workers and leases an equal share of the shards in
+#   alert_shard_leases; the shards of a dead worker are taken over once its
+#   leases expire. A mail is queued once per saved threshold (see MailOutbox),
+#   so a shard checked by two workers during a takeover is not mailed twice.
+# ==============================================================================
+
+
+class ShardLease:
+    """Leases of this worker's share of the alert shards"""
+
+    def __init__(self, n_shards: int = ALERT_SHARDS, ttl: float = ALERT_LEASE_TTL):
+        self.n_shards = n_shards
+        self.ttl = timedelta(seconds=ttl)
+        self.owner = uuid4().hex
+        self.shards = set()
+
+    def renew(self) -> Set[int]:
+        """Heartbeat, renew the held leases and balance the shards across the live
+        workers, returns the shards held
+        """
+        now = datetime.now()
+        expires = now + self.ttl
+
+        # heartbeat, and forget workers that stopped
+        db.session.execute(
+            insert(AlertWorker)
+            .values(owner=self.owner, expires=expires)
+            .on_conflict_do_update(index_elements=["owner"], set_={"expires": expires})
+        )
+        db.session.execute(delete(AlertWorker).where(AlertWorker.expires < now))
+        workers = db.session.query(func.count(AlertWorker.owner)).scalar()
+        share = math.ceil(self.n_shards / workers)
+
+        db.session.execute(
+            insert(AlertShardLease).on_conflict_do_nothing(),
+            [{"shard": i, "owner": None, "expires": now} for i in range(self.n_shards)],
+        )
+
+        # renew the held leases
+        db.session.execute(
+            update(AlertShardLease)
+            .where(AlertShardLease.owner == self.owner, AlertShardLease.expires >= now)
+            .values(expires=expires)
+        )
+        held = (
+            db.session.query(AlertShardLease.shard)
+            .filter(AlertShardLease.owner == self.owner, AlertShardLease.expires >= now)
+            .order_by(AlertShardLease.shard)
+            .all()
+        )
+        held = [shard for shard, in held]
+
+        # give up the shards above our share for workers that joined
+        if len(held) > share:
+            db.session.execute(
+                update(AlertShardLease)
+                .where(
+                    AlertShardLease.owner == self.owner,
+                    AlertShardLease.shard.in_(held[share:]),
+                )
+                .values(owner=None, expires=now)
+            )
+            held = held[:share]
+
+        # take released or expired shards up to our share
+        free = (
+            db.session.query(AlertShardLease.shard)
+            .filter(or_(AlertShardLease.owner == None, AlertShardLease.expires < now))
+            .order_by(AlertShardLease.shard)
+            .all()
+        )
+        for (shard,) in free:
+            if len(held) >= share:
+                break
+            result = db.session.execute(
+                update(AlertShardLease)
+                .where(
+                    AlertShardLease.shard == shard,
+                    or_(AlertShardLease.owner == None, AlertShardLease.expires < now),
+                )
+                .values(owner=self.owner, expires=expires)
+            )
+            if result.rowcount == 1:
+                held.append(shard)
+
+        db.session.commit()
+        self.shards = set(held)
+        return self.shards
+
+    def release(self):
+        """Release all shards, e.g. on shutdown, for other workers to take over"""
+        now = datetime.now()
+        db.session.execute(
+            update(AlertShardLease)
+            .where(AlertShardLease.owner == self.owner)
+            .values(owner=None, expires=now)
+        )
+        db.session.execute(delete(AlertWorker).where(AlertWorker.owner == self.owner))
+        db.session.commit()
+        self.shards = set()
@@ -1,16 +1,27 @@
 from datetime import datetime, timedelta
+from typing import Dict, Sequence
 
-import yfinance as yf
 from app import db
-from app.config import CHALLENGE_PERIOD, STALENESS_INTERVAL
+from app.config import CHALLENGE_PERIOD, QUOTE_BATCH_SIZE, STALENESS_INTERVAL
+from app.market_data import get_provider
 from app.models.schema import ChallengeEntry, StockPage
-from app.utils import api_utils, crud_utils, db_utils, utils
+from app.utils import (
+    api_utils,
+    cache_utils,
+    crud_utils,
+    db_utils,
+    history_utils,
+    query_utils,
+    refresh_utils,
+    utils,
+)
 from app.utils.enums import Status
 from flask import current_app
 from pandas.core.frame import DataFrame
+from sqlalchemy import or_
 
 # ==============================================================================
-# Importing Data from yfinance
+# Importing Data from the market data provider (yfinance or replay)
 # ==============================================================================
 
 
@@ -24,9 +35,8 @@ def fetch_time_series(
 ) -> DataFrame:
     """Fetch Time Series for symbol asked"""
     try:
-        stock = yf.Ticker(sym)
-        return stock.history(
-            period=period, interval=interval, start=start, end=end, actions=actions
+        return get_provider().history(
+            sym, period=period, interval=interval, start=start, end=end, actions=actions
         )
     except Exception as e:
         utils.debug_exception(e, suppress=True)
@@ -37,9 +47,8 @@ def fetch_stock_data(sym):
     returns price, change, perc_change, and an info dict
     """
     try:
-        stock = yf.Ticker(sym)
-        info = stock.info
-        if not has_data(stock):
+        info = get_provider().info(sym)
+        if not has_data(info):
             raise RuntimeError(f"Stock details could not be fetched for {sym}")
 
         change, perc_change, price, prev_close = calc_change(sym, info)
@@ -50,21 +59,47 @@ def fetch_stock_data(sym):
         utils.debug_exception(e)
 
 
-def fetch_historical_data(sym, period):
-    """Fetches historical data for Stock Page"""
+def fetch_bulk_quotes(sym_list: Sequence[str]) -> Dict[str, tuple]:
+    """Fetches latest quotes for many symbols using grouped requests,
+    returns dict of sym: (price, change, perc_change, prev_close), failed syms are omitted
+    """
+    quotes = {}
+    for i in range(0, len(sym_list), QUOTE_BATCH_SIZE):
+        batch = list(sym_list[i : i + QUOTE_BATCH_SIZE])
+        try:
+            frames = get_provider().download(batch, period="5d", interval="1d")
+        except Exception as e:
+            utils.debug_exception(e, suppress=True)
+            continue
+
+        for sym in batch:
+            try:
+                if sym not in frames:
+                    raise RuntimeError(f"Quote could not be fetched for {sym}")
+                closes = frames[sym]["Close"].dropna()
+                if len(closes) < 2:
+                    raise RuntimeError(f"Quote could not be fetched for {sym}")
+
+                price = float(closes.iloc[-1])
+                prev_close = float(closes.iloc[-2])
+                change = price - prev_close
+                perc_change = change / prev_close * 100
+                quotes[sym] = (price, change, perc_change, prev_close)
+            except Exception as e:
+                utils.debug_exception(e, suppress=True)
+
+    return quotes
+
+
+def fetch_historical_data(sym, period, start: datetime = None):
+    """Fetches historical data for Stock Page, returns history columns
+    Use :param start to only fetch bars from that date onwards"""
     try:
-        # get df of historical data from yfinance
-        df = fetch_time_series(sym, period=period, actions=False)
+        df = fetch_time_series(sym, period=period, actions=False, start=start)
         if len(df) == 0:
             raise RuntimeError("Stock history could not be fetched")
 
-        df = df.reset_index(level=0)  # turn date index into real column
-        df.columns = df.columns.str.lower()  # column names to lowercase
-        df["date"] = df["date"].astype(str)  # convert timestamp to str for jsonificaiton
-
-        # convert to dict list of daily records
-        history_dicts = df.to_dict(orient="records")
-        return history_dicts
+        return history_utils.from_dataframe(df)
 
     except Exception as e:
         # important to suppress so that cache can be accessed
@@ -113,8 +148,8 @@ def calc_change(
 # ==============================================================================
 
 
-def has_data(stock):
-    return stock.info["regularMarketPrice"] is not None
+def has_data(info: dict):
+    return info.get("regularMarketPrice") is not None
 
 
 # ------------------------------------------------------------------------------
@@ -122,6 +157,7 @@ def has_data(stock):
 # ------------------------------------------------------------------------------
 
 
+@query_utils.track_job
 def api_stock_request(stock_page_id: int, interval: str = STALENESS_INTERVAL):
     """Update Stock Page with data from yfinance, if fail try to use latest (cached) data
     :param: default interval is STALENESS_INTERVAL (90s), can also be TOP_STOCKS_INTERVAL (1hr)"""
@@ -130,22 +166,11 @@ def api_stock_request(stock_page_id: int, interval: str = STALENESS_INTERVAL):
         return
 
     try:
-        # only need to fetch if the data is stale or timestamp is NULL (i.e. never been updated before)
-        last_updated = db_utils.query_item(StockPage, stock_page_id).last_updated
-        try:
-            elapsed = datetime.now() - last_updated
-        except:
-            pass  # let the if statement handle the error
-
-        # Check if timestamp is NULL or data is stale
-        if not last_updated or elapsed.seconds > interval:
-            print(f"Data for stock_page {stock_page_id} is stale: fetching from yfinance")
-            if crud_utils.update_stock_page(stock_page_id) == Status.FAIL:
-                raise ConnectionError(
-                    f"Could not fetch latest data for stockPageId: {stock_page_id}, attempting to return from cache."
-                )
-            else:
-                print(f"Updated yfinance data for stockPageId: {stock_page_id}")
+        # staleness is checked under the refresh lock, concurrent requests share one fetch
+        if refresh_utils.refresh_stock_page(stock_page_id, interval) == Status.FAIL:
+            raise ConnectionError(
+                f"Could not fetch latest data for stockPageId: {stock_page_id}, attempting to return from cache."
+            )
     except Exception as e:
         # Use cached data instead
         utils.debug_exception(e, suppress=True)
@@ -157,6 +182,49 @@ def api_stock_request(stock_page_id: int, interval: str = STALENESS_INTERVAL):
             print(f"API & Cached data for stockPageId: {stock_page_id} were both invalid")
 
 
+@query_utils.track_job
+def api_bulk_stock_request(
+    stock_page_ids: Sequence[int], interval: str = STALENESS_INTERVAL
+):
+    """Update all stale Stock Pages in the list using batched yfinance requests
+    :param: default interval is STALENESS_INTERVAL (90s), can also be TOP_STOCKS_INTERVAL (1hr)"""
+    # Do not send API requests in testing mode
+    if current_app.config["TESTING"]:
+        return
+
+    try:
+        # only need to fetch if the data is stale or timestamp is NULL (i.e. never been updated before)
+        min_timestamp = datetime.now() - timedelta(seconds=interval)
+        stale_ids = (
+            StockPage.query.filter(
+                StockPage.id.in_(stock_page_ids),
+                or_(
+                    StockPage.last_updated == None,
+                    StockPage.last_updated < min_timestamp,
+                ),
+            )
+            .with_entities(StockPage.id)
+            .all()
+        )
+        stale_ids = [
+            tuple[0]  # where tuple[0] -> stock_page_id
+            for tuple in stale_ids
+            if not cache_utils.recently_failed(tuple[0])
+        ]
+        if not stale_ids:
+            return
+
+        print(f"Data for stock_pages {stale_ids} is stale: fetching from yfinance")
+        if crud_utils.bulk_update_stock_pages(stale_ids) == Status.FAIL:
+            raise ConnectionError(
+                f"Could not fetch latest data for stockPageIds: {stale_ids}, using cached data."
+            )
+    except Exception as e:
+        # Use cached data instead
+        utils.debug_exception(e, suppress=True)
+
+
+@query_utils.track_job
 def api_history_request(stock_page_id: int, start_date: datetime):
     """Update challenge entries with this stock_page_id"""
     # Do not send API requests in testing mode
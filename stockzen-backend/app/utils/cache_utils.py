@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from flask import current_app, has_app_context
+
+# ==============================================================================
+# Process-local response caches
+# ==============================================================================
+
+
+class LRUCache:
+    """Thread-safe cache holding up to maxsize entries for at most ttl seconds,
+    the least recently used entry is evicted first. Setting a value read before
+    its key was invalidated is skipped when given the key's version at the read.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key: (expires, value), in order of use
+        self._versions = {}  # key: number of invalidations
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def version(self, key: Hashable) -> int:
+        """Current version of the key, to pass to set after reading its value"""
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def set(self, key: Hashable, value: Any, version: Optional[int] = None):
+        with self._lock:
+            if version is not None and version != self._versions.get(key, 0):
+                return  # invalidated since the value was read
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self), "hits": self.hits, "misses": self.misses}
+
+
+def get_stock_page_cache() -> Optional[LRUCache]:
+    """Return the app's stock page cache, or None outside the app context"""
+    if has_app_context():
+        return current_app.extensions.get("stock_page_cache")
+    return None
+
+
+def invalidate_stock_pages(*stock_page_ids: int):
+    """Drop cached stock pages, call when stock pages are updated"""
+    cache = get_stock_page_cache()
+    if cache is not None:
+        for stock_page_id in stock_page_ids:
+            cache.invalidate(stock_page_id)
+
+
+def mark_failed_fetches(*stock_page_ids: int):
+    """Remember stock pages whose fetch failed, so that they are not fetched again
+    until STALENESS_INTERVAL has passed (their last_updated is left as is)
+    """
+    if has_app_context():
+        failed = current_app.extensions["failed_fetches"]
+        for stock_page_id in stock_page_ids:
+            failed.set(stock_page_id, True)
+
+
+def recently_failed(stock_page_id: int) -> bool:
+    if has_app_context():
+        return current_app.extensions["failed_fetches"].get(stock_page_id) is not None
+    return False
+
+
+def init_app(app):
+    app.extensions["stock_page_cache"] = LRUCache(
+        app.config["STOCK_PAGE_CACHE_SIZE"], app.config["STALENESS_INTERVAL"]
+    )
+    app.extensions["failed_fetches"] = LRUCache(
+        app.config["FAILED_FETCH_CACHE_SIZE"], app.config["STALENESS_INTERVAL"]
+    )
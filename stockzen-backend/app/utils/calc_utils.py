@@ -6,6 +6,7 @@ from app.models.schema import LotBought, LotSold, Portfolio, Stock, StockPage
 from app.utils import api_utils, db_utils, utils
 from app.utils.enums import LotType
 from flask_login import current_user
+from sqlalchemy import case, or_, select, update
 from sqlalchemy.orm import load_only
 from sqlalchemy.sql import func
 
@@ -18,11 +19,18 @@ def cascade_updates(refresh_data=False):
     """Update all of a user's portfolios calculations
     :param: refresh_data determines if the latest data is fetched"""
     try:
-        # Get all portfolios associated with the current user and do updates for all
-        portfolios = db_utils.query_all(Portfolio)
-        for portfolio in portfolios:
-            portfolio_id = portfolio.id
-            propagate_portfolio_updates(portfolio_id, refresh_data)
+        # Collect all yfinance requests and fetch them in batches if flag is set
+        if refresh_data:
+            id_list = (
+                Stock.query.filter(Stock.user_id == current_user.id)
+                .with_entities(Stock.stock_page_id)
+                .distinct()
+                .all()
+            )
+            id_list = [tuple[0] for tuple in id_list]  # where tuple[0] -> stock_page_id
+            executor.submit(api_utils.api_bulk_stock_request, id_list)
+
+        recalc_dirty(current_user.id)
 
     except Exception as e:
         print("Update cascade was unsuccessful")
@@ -31,87 +39,286 @@ def cascade_updates(refresh_data=False):
 
 def propagate_portfolio_updates(portfolio_id, refresh_data=False):
     """Cascade update calculations for all portfolio rows"""
-    print("\n" + "#" * 30)
     print(f"Cascading updates for portfolio: {portfolio_id}")
 
-    # Get all stock rows and stock pages associated with this portfolio_id
-    stock_tuples = (
-        Portfolio.query.join(Stock, Portfolio.id == Stock.portfolio_id)
-        .join(StockPage, Stock.stock_page_id == StockPage.id)
-        .with_entities(Stock, StockPage)
-        .filter(Portfolio.id == portfolio_id)
-        .all()
-    )
-
-    # Collect all yfinance requests and run concurrently if flag is set
+    # Collect all yfinance requests and fetch them in batches if flag is set
     if refresh_data:
-        id_list = []
-        for _, stock_page in stock_tuples:
-            id_list.append(stock_page.id)
-        executor.map(api_utils.api_stock_request, id_list)
-
-    # Perform all calculation updates to database
-    for stock, _ in stock_tuples:
-        print("\n" + "*" * 30)
-        try:
-            stock_id = stock.id
-            propagate_stock_updates(stock_id)
+        id_list = (
+            Stock.query.filter(Stock.portfolio_id == portfolio_id)
+            .with_entities(Stock.stock_page_id)
+            .all()
+        )
+        id_list = [tuple[0] for tuple in id_list]  # where tuple[0] -> stock_page_id
+        executor.submit(api_utils.api_bulk_stock_request, id_list)
 
-        except Exception as e:
-            utils.debug_exception(e, suppress=True)
-    # 4. finally update portfolio calculations
-    update_portfolio(portfolio_id)
+    recalc_dirty(current_user.id, portfolio_id=portfolio_id)
 
 
 def propagate_stock_updates(stock_id):
     """Cascade update calculations from StockPage to Lots, Stock, Portfolio"""
     try:
         print(f"Propagating calculation updates for stockId: {stock_id}")
-        # 1. get all BUY lot_id's that correspond to the stock and update their calcs
-        update_stock_lots(LotType.BUY, stock_id)
-        # 2. get all SELL lot_id's that correspond to the stock and update their calcs
-        update_stock_lots(LotType.SELL, stock_id)
-        # 3. update stock calculations
-        update_stock(stock_id)
+        recalc_dirty(current_user.id, stock_id=stock_id)
 
     except Exception as e:
         utils.debug_exception(e, suppress=True)
 
 
 # ==============================================================================
-# Calculation Operations
+# Dirty Tracking
+#   Writes that change a calculation input flag the affected stocks/portfolios,
+#   reads then only recalculate flagged rows (and skip writing when none are).
+#   Flags are set in the caller's transaction and committed along with it.
 # ==============================================================================
-def update_stock_lots(type: LotType, stock_id: int):
-    """Update all lots associated with a stock row on the database"""
-    if type == LotType.BUY:
-        sqla_tuples = db_utils.query_all_with_join(
-            LotBought, [Stock], [LotBought, Stock], **{"stock": stock_id}
+
+
+def mark_dirty(
+    stock_page_id: int = None, stock_id: int = None, portfolio_id: int = None
+) -> None:
+    """Flag stocks holding a stock page, a single stock and/or a portfolio as dirty"""
+    if stock_page_id is not None:
+        execute_update(
+            update(Stock)
+            .where(Stock.stock_page_id == stock_page_id)
+            .values(is_dirty=True)
+        )
+    if stock_id is not None:
+        execute_update(update(Stock).where(Stock.id == stock_id).values(is_dirty=True))
+    if portfolio_id is not None:
+        execute_update(
+            update(Portfolio).where(Portfolio.id == portfolio_id).values(is_dirty=True)
+        )
+
+
+def recalc_dirty(user_id: int, portfolio_id: int = None, stock_id: int = None) -> None:
+    """Recalculate a user's dirty stocks and the portfolios affected by them
+    :param portfolio_id or stock_id narrow the scope to one portfolio/stock row
+    """
+    stock_filters = [Stock.user_id == user_id, Stock.is_dirty == True]
+    portfolio_filters = [Portfolio.user_id == user_id]
+    if portfolio_id is not None:
+        stock_filters.append(Stock.portfolio_id == portfolio_id)
+        portfolio_filters.append(Portfolio.id == portfolio_id)
+    if stock_id is not None:
+        stock_filters.append(Stock.id == stock_id)
+        portfolio_filters.append(
+            Portfolio.id
+            == select(Stock.portfolio_id).where(Stock.id == stock_id).scalar_subquery()
+        )
+
+    dirty_stock_ids = select(Stock.id).where(*stock_filters)
+    dirty_portfolio_ids = select(Portfolio.id).where(
+        *portfolio_filters,
+        or_(
+            Portfolio.is_dirty == True,
+            Portfolio.id.in_(select(Stock.portfolio_id).where(*stock_filters)),
+        ),
+    )
+
+    # every dirty stock also makes its portfolio dirty, so one check covers both
+    if not db.session.query(dirty_portfolio_ids.exists()).scalar():
+        return
+
+    recalc_rows(dirty_stock_ids, dirty_portfolio_ids)
+
+
+# ==============================================================================
+# Set-based Recalculation
+#   Every step is a single UPDATE with correlated subqueries, so the rows in scope
+#   are recalculated in a fixed number of statements and one commit.
+#   Results match the per-row calc_* functions below.
+# ==============================================================================
+
+
+def recalc_user(user_id: int) -> None:
+    """Recalculate all lots, stocks and portfolios belonging to a user"""
+    recalc_rows(
+        select(Stock.id).where(Stock.user_id == user_id),
+        select(Portfolio.id).where(Portfolio.user_id == user_id),
+    )
+
+
+def recalc_portfolio(portfolio_id: int) -> None:
+    """Recalculate a portfolio along with all of its stocks and lots"""
+    recalc_rows(
+        select(Stock.id).where(Stock.portfolio_id == portfolio_id),
+        [portfolio_id],
+    )
+
+
+def recalc_stock(stock_id: int) -> None:
+    """Recalculate a stock, its lots and the portfolio that holds it"""
+    recalc_rows(
+        [stock_id],
+        select(Stock.portfolio_id).where(Stock.id == stock_id),
+    )
+
+
+def recalc_rows(stock_ids, portfolio_ids) -> None:
+    """Recalculate lots/stocks in stock_ids and portfolios in portfolio_ids
+    :param stock_ids and portfolio_ids are id lists or id select() statements
+    """
+    try:
+        now = datetime.now()
+
+        # current stock_page price/change of the stock row that owns a lot
+        def lot_page_col(column, lot_table):
+            return (
+                select(column)
+                .join(Stock, Stock.stock_page_id == StockPage.id)
+                .where(Stock.id == lot_table.stock_id)
+                .scalar_subquery()
+            )
+
+        # 1. lots bought: value, change
+        price = lot_page_col(StockPage.price, LotBought)
+        daily_change = lot_page_col(StockPage.change, LotBought)
+        execute_update(
+            update(LotBought)
+            .where(LotBought.stock_id.in_(stock_ids))
+            .values(
+                value=LotBought.units * price,
+                # calc_lot_bought gives up on change as soon as value fails
+                change=case((price == None, None), else_=LotBought.units * daily_change),
+            )
         )
-        for lot_bought, _ in sqla_tuples:
-            try:
-                value, change = calc_lot_bought(lot_bought.id)
-                lot_bought.value = value
-                lot_bought.change = change
-                db.session.commit()
-            except Exception as e:
-                db.session.rollback()
-                utils.debug_exception(e, suppress=True)
-                print(f"Error updating calcs for lot_bought with id: {lot_bought.id}")
-    elif type == LotType.SELL:
-        sqla_tuples = db_utils.query_all_with_join(
-            LotSold, [Stock], [LotSold, Stock], **{"stock": stock_id}
+
+        # 2. stocks: avg_price (needed by the remaining stock and sold lot columns)
+        units_bought = func.sum(LotBought.units)
+        execute_update(
+            update(Stock)
+            .where(Stock.id.in_(stock_ids))
+            .values(
+                avg_price=select(
+                    case(
+                        (units_bought == 0, None),
+                        else_=func.sum(LotBought.units * LotBought.unit_price)
+                        / units_bought,
+                    )
+                )
+                .where(LotBought.stock_id == Stock.id)
+                .scalar_subquery()
+            )
         )
-        for lot_sold, _ in sqla_tuples:
-            try:
-                realised = calc_lot_sold(lot_sold.id)
-                lot_sold.realised = realised
-                db.session.commit()
-            except Exception as e:
-                db.session.rollback()
-                utils.debug_exception(e, suppress=True)
-                print(f"Error updating calcs for lot_sold with id: {lot_sold.id}")
 
+        # 3. stocks: value, gain, perc_gain
+        units_held = func.coalesce(
+            select(func.sum(LotBought.units))
+            .where(LotBought.stock_id == Stock.id)
+            .scalar_subquery(),
+            0,
+        ) - func.coalesce(
+            select(func.sum(LotSold.units))
+            .where(LotSold.stock_id == Stock.id)
+            .scalar_subquery(),
+            0,
+        )
+        current_price = (
+            select(StockPage.price)
+            .where(StockPage.id == Stock.stock_page_id)
+            .scalar_subquery()
+        )
+        gain = (current_price - Stock.avg_price) * units_held
+        execute_update(
+            update(Stock)
+            .where(Stock.id.in_(stock_ids))
+            .values(
+                value=case(
+                    (Stock.avg_price == None, None), else_=units_held * current_price
+                ),
+                gain=case((Stock.avg_price == None, None), else_=gain),
+                perc_gain=case(
+                    (units_held * Stock.avg_price == 0, None),
+                    else_=gain / (units_held * Stock.avg_price) * 100,
+                ),
+                last_updated=now,
+            )
+        )
+
+        # 4. lots sold: realised against the fresh avg_price
+        execute_update(
+            update(LotSold)
+            .where(LotSold.stock_id.in_(stock_ids))
+            .values(
+                realised=LotSold.units
+                * (
+                    LotSold.unit_price
+                    - func.coalesce(
+                        select(Stock.avg_price)
+                        .where(Stock.id == LotSold.stock_id)
+                        .scalar_subquery(),
+                        0,
+                    )
+                )
+            )
+        )
 
+        # 5. portfolios: stock_count, value, change, gain
+        def stock_sum(column):
+            return (
+                select(func.sum(column))
+                .where(Stock.portfolio_id == Portfolio.id)
+                .scalar_subquery()
+            )
+
+        execute_update(
+            update(Portfolio)
+            .where(Portfolio.id.in_(portfolio_ids))
+            .values(
+                stock_count=select(func.count(Stock.id))
+                .where(Stock.portfolio_id == Portfolio.id)
+                .scalar_subquery(),
+                value=stock_sum(Stock.value),
+                gain=stock_sum(Stock.gain),
+                change=select(func.sum(LotBought.change))
+                .join(Stock, Stock.id == LotBought.stock_id)
+                .where(Stock.portfolio_id == Portfolio.id)
+                .scalar_subquery(),
+            )
+        )
+
+        # 6. portfolios: perc_change, perc_gain
+        execute_update(
+            update(Portfolio)
+            .where(Portfolio.id.in_(portfolio_ids))
+            .values(
+                perc_change=case(
+                    (Portfolio.value == 0, None),
+                    else_=Portfolio.change / Portfolio.value * 100,
+                ),
+                # calc_portfolio gives up on perc_gain as soon as perc_change fails
+                perc_gain=case(
+                    (or_(Portfolio.value == 0, Portfolio.change == None), None),
+                    else_=Portfolio.gain / Portfolio.value * 100,
+                ),
+                last_updated=now,
+            )
+        )
+
+        # 7. clear dirty flags, portfolios first as their scope can depend on stock flags
+        execute_update(
+            update(Portfolio)
+            .where(Portfolio.id.in_(portfolio_ids))
+            .values(is_dirty=False)
+        )
+        execute_update(
+            update(Stock).where(Stock.id.in_(stock_ids)).values(is_dirty=False)
+        )
+
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        utils.debug_exception(e)
+
+
+def execute_update(stmt) -> None:
+    """Run a bulk UPDATE without syncing the session (rows are expired on commit)"""
+    db.session.execute(stmt.execution_options(synchronize_session=False))
+
+
+# ==============================================================================
+# Calculation Operations
+# ==============================================================================
 def update_lot(type: LotType, lot_id: int = None):
     """Update a single lot on the database"""
     try:
@@ -1,10 +1,13 @@
 import json
 from datetime import datetime, timedelta
-from typing import Dict, Mapping, Sequence, Union
+from functools import lru_cache
+from typing import Dict, List, Mapping, Sequence, Union
 
 import app.utils.calc_utils as calc
+from app import db
 from app.config import (
     CHALLENGE_PERIOD,
+    LEADERBOARD_SIZE,
     N_TOP_PERFORMERS,
     TOP_COMPANIES,
     TOP_STOCKS_INTERVAL,
@@ -12,7 +15,7 @@ from app.config import (
 from app.models.schema import (
     Challenge,
     ChallengeEntry,
-    History,
+    LeaderboardEntry,
     LotBought,
     LotSold,
     Portfolio,
@@ -23,11 +26,24 @@ from app.models.schema import (
 from app.utils.enums import LotType, Status
 from flask_login import current_user
 from predict.ml_utils import ml_predict as pred
-from sqlalchemy import desc, func
+from predict.ml_utils.registry import registry as model_registry
+from sqlalchemy import (
+    and_,
+    bindparam,
+    case,
+    delete,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    update,
+)
 from sqlalchemy.orm import load_only
+from sqlalchemy.orm.exc import NoResultFound
 
 from . import api_utils as api
-from . import db_utils, utils
+from . import cache_utils, db_utils, history_utils, utils
 
 # ==============================================================================
 # Helpers
@@ -40,7 +56,7 @@ def to_dict(object, timestamp=False) -> Union[dict, Status]:
     """
     try:
         tmp_dict = {}
-        for key in object.__mapper__.c.keys():
+        for key in column_keys(type(object)):
             if key != "last_updated" or timestamp:
                 value = getattr(object, key)
                 if type(value) == datetime:
@@ -53,6 +69,12 @@ def to_dict(object, timestamp=False) -> Union[dict, Status]:
         return Status.FAIL
 
 
+@lru_cache(maxsize=None)
+def column_keys(model) -> List[str]:
+    """Column attribute names of a model, read from its mapper once"""
+    return model.__mapper__.c.keys()
+
+
 def parse_date_str(date: datetime) -> str:
     return date.date()
 
@@ -60,12 +82,24 @@ def parse_date_str(date: datetime) -> str:
 def reorder_rows(
     table: db_utils.DatabaseObj, new_orders: Sequence[Mapping[str, int]], **filters
 ):
-    """Update row ordering on the database"""
-    # loop through json dict list and update each row order
-    for item in new_orders:
-        id = item["id"]
-        item = item["order"]
-        db_utils.update_item_columns(table, id, {"order": item}, **filters)
+    """Update row ordering on the database in a single UPDATE, throws exception
+    (and changes nothing) if any row is not found or not owned by the user
+    """
+    orders = {item["id"]: item["order"] for item in new_orders}
+    if not orders:
+        return
+
+    # ownership is checked by the same statement, through the rows it matches
+    result = db.session.execute(
+        update(table)
+        .where(table.id.in_(list(orders)), *db_utils.owner_filters(table, **filters))
+        .values(order=case(orders, value=table.id))
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(orders):
+        db_utils.rollback()
+        raise NoResultFound(f"Not all {table.__tablename__} rows could be reordered")
+    db_utils.commit()
 
 
 # ==============================================================================
@@ -216,6 +250,7 @@ def add_stock(portfolio_id: int, stock_page_id: int) -> Status:
             stock_page_id=stock_page_id,
         )
 
+        calc.mark_dirty(portfolio_id=portfolio_id)  # stock count has changed
         db_utils.insert_item(new_stock)
         return Status.SUCCESS
     except Exception as e:
@@ -241,6 +276,8 @@ def fetch_stock(stock_id: int) -> Union[Stock, Status]:
 def delete_stock(stock_id: int) -> Status:
     """Delete existing stock by id, return success status"""
     try:
+        stock = db_utils.query_item(Stock, stock_id)
+        calc.mark_dirty(portfolio_id=stock.portfolio_id)  # stock count has changed
         db_utils.delete_item(Stock, stock_id)
         return Status.SUCCESS
     except Exception as e:
@@ -266,10 +303,7 @@ def update_stock_page(stock_page_id: int) -> Status:
         if not price:
             raise ValueError("Stock price not found, aborting stock_page update")
         if sym in TOP_COMPANIES:
-            with open("predict/accuracy.json", "r") as myfile:
-                results = myfile.read()
-            conf = json.loads(results)
-            confidence = float(str(conf[sym]))
+            confidence = model_registry.get_accuracy(sym)
             prediction = pred.prediction(sym)
 
         else:
@@ -277,6 +311,7 @@ def update_stock_page(stock_page_id: int) -> Status:
             prediction = None
         info_json = json.dumps(info)  # store info as serialised json string
 
+        calc.mark_dirty(stock_page_id=stock_page_id)  # price change affects holdings
         db_utils.update_item_columns(
             StockPage,
             stock_page_id,
@@ -291,19 +326,116 @@ def update_stock_page(stock_page_id: int) -> Status:
                 "confidence": confidence,
             },
         )
+        cache_utils.invalidate_stock_pages(stock_page_id)
         return Status.SUCCESS
     except Exception as e:
         # still need to update timestamp if fail so that min interval will skip this row
         db_utils.update_item_columns(
             StockPage, stock_page_id, {"last_updated": datetime.now()}
         )
+        cache_utils.invalidate_stock_pages(stock_page_id)
+        cache_utils.mark_failed_fetches(stock_page_id)
+        utils.debug_exception(e, suppress=True)
+        return Status.FAIL
+
+
+def bulk_update_stock_pages(stock_page_ids: Sequence[int]) -> Status:
+    """Update quotes for many stock pages with batched requests and one bulk UPDATE,
+    return success status"""
+    try:
+        tuple_list = (
+            StockPage.query.filter(StockPage.id.in_(stock_page_ids))
+            .with_entities(StockPage.id, StockPage.code)
+            .all()
+        )
+        code_to_id = {code: id for id, code in tuple_list}
+        quotes = api.fetch_bulk_quotes(list(code_to_id))
+
+        # predictions for all top companies run as one batch
+        predictions = pred.batch_prediction(
+            [sym for sym in quotes if sym in TOP_COMPANIES]
+        )
+
+        now = datetime.now()
+        quote_rows = []
+        unpredicted_rows = []  # top companies whose prediction failed keep the last one
+        for sym, (price, change, perc_change, prev_close) in quotes.items():
+            row = {
+                "_id": code_to_id[sym],
+                "_price": price,
+                "_change": change,
+                "_perc_change": perc_change,
+                "_prev_close": prev_close,
+            }
+            if sym in TOP_COMPANIES and sym not in predictions:
+                unpredicted_rows.append(row)
+                continue
+            row["_prediction"] = predictions.get(sym)
+            row["_confidence"] = (
+                model_registry.get_accuracy(sym) if sym in predictions else None
+            )
+            quote_rows.append(row)
+        updated_ids = [row["_id"] for row in quote_rows + unpredicted_rows]
+        failed_ids = [id for sym, id in code_to_id.items() if sym not in quotes]
+
+        stock_pages = StockPage.__table__
+        quote_values = dict(
+            price=bindparam("_price"),
+            change=bindparam("_change"),
+            perc_change=bindparam("_perc_change"),
+            prev_close=bindparam("_prev_close"),
+            last_updated=now,
+        )
+        if quote_rows:
+            db.session.execute(
+                update(stock_pages)
+                .where(stock_pages.c.id == bindparam("_id"))
+                .values(
+                    **quote_values,
+                    prediction=bindparam("_prediction"),
+                    confidence=bindparam("_confidence"),
+                ),
+                quote_rows,
+            )
+        if unpredicted_rows:
+            db.session.execute(
+                update(stock_pages)
+                .where(stock_pages.c.id == bindparam("_id"))
+                .values(**quote_values),
+                unpredicted_rows,
+            )
+        if updated_ids:
+            # price changes affect holdings
+            calc.execute_update(
+                update(Stock)
+                .where(Stock.stock_page_id.in_(updated_ids))
+                .values(is_dirty=True)
+            )
+        db.session.commit()
+        cache_utils.invalidate_stock_pages(*updated_ids)
+
+        # failed rows keep their last_updated, they are skipped for the min interval
+        cache_utils.mark_failed_fetches(*failed_ids)
+
+        if not updated_ids:
+            raise ConnectionError("No quotes could be fetched")
+        return Status.SUCCESS
+    except Exception as e:
+        db.session.rollback()
         utils.debug_exception(e, suppress=True)
         return Status.FAIL
 
 
 def fetch_stock_page(stock_page_id: int) -> Union[Dict, Status]:
-    """Get a stock page from the database, return item dict or fail status"""
+    """Get a stock page from the cache or database, return item dict or fail status"""
     try:
+        cache = cache_utils.get_stock_page_cache()
+        stock_page = cache.get(stock_page_id) if cache is not None else None
+        if stock_page is not None:
+            return dict(stock_page)
+
+        # a refresh committed during the read invalidates the page, it is not cached
+        version = cache.version(stock_page_id) if cache is not None else None
         sqla_item = db_utils.query_item(StockPage, stock_page_id)
         item = to_dict(sqla_item)
 
@@ -311,7 +443,10 @@ def fetch_stock_page(stock_page_id: int) -> Union[Dict, Status]:
         info_json = item.pop("info")
         info = json.loads(info_json)
 
-        return {**item, **info}
+        stock_page = {**item, **info}
+        if cache is not None:
+            cache.set(stock_page_id, stock_page, version)
+        return dict(stock_page)
 
     except Exception as e:
         utils.debug_exception(e, suppress=True)
@@ -323,26 +458,34 @@ def fetch_stock_history(stock_page_id: int, period: str = "1y") -> Union[Dict, S
     try:
         # use stock symbol to query yfinance api
         sym = utils.id_to_code(stock_page_id)
-        history_dicts = api.fetch_historical_data(sym, period)
-
-        # Get data from cache if failed to fetch, otherwise save fresh data and return
-        if history_dicts == Status.FAIL:
-            sqla_items = db_utils.query_all(History, **{"stock_page": stock_page_id})
-            if len(sqla_items) == 0:
-                raise LookupError("No history data found in cache")
-            history_dicts = [json.loads(sqla_item.history) for sqla_item in sqla_items]
-        else:
-            # delete old cache and insert new items
-            db_utils.delete_items(History, **{"stock_page": stock_page_id})
-            for dict in history_dicts:
-                history = History(stock_page_id=stock_page_id, history=json.dumps(dict))
-                db_utils.insert_item(history)
-
-        # add stock_page_id to each dict then return
-        history_dicts = [
-            {"stock_page_id": stock_page_id, **dict} for dict in history_dicts
-        ]
-        return history_dicts
+        cached = history_utils.load_history(stock_page_id)
+        columns = None
+
+        # only fetch bars from the last settled bar onwards if the cache covers the period
+        if cached is not None and history_utils.covers_period(cached, period):
+            start = history_utils.delta_start(cached)
+            delta = api.fetch_historical_data(sym, period, start=start)
+
+            if delta == Status.FAIL:
+                columns = cached
+            elif history_utils.is_consistent(cached, delta):
+                columns = history_utils.append_history(stock_page_id, delta)
+
+        # full reload on a cache miss, gap or price adjustment
+        if columns is None:
+            columns = api.fetch_historical_data(sym, period)
+
+            # Get data from cache if failed to fetch, otherwise replace the cache
+            if columns == Status.FAIL:
+                if cached is None:
+                    raise LookupError("No history data found in cache")
+                columns = cached
+            else:
+                history_utils.save_history(stock_page_id, columns)
+
+        # add stock_page_id to each daily record then return
+        columns = history_utils.slice_period(columns, period)
+        return history_utils.to_records(columns, stock_page_id=stock_page_id)
     except Exception as e:
         utils.debug_exception(e, suppress=True)
         return Status.FAIL
@@ -421,6 +564,7 @@ def add_lot(
         else:
             raise ValueError("Incorrect type provided")
 
+        calc.mark_dirty(stock_id=stock_id)
         db_utils.insert_item(lot)
         return Status.SUCCESS
 
@@ -434,6 +578,8 @@ def delete_lot(type: LotType, lot_id: int) -> Status:
     try:
         table = LotBought if type == LotType.BUY else LotSold
 
+        lot = db_utils.query_item(table, lot_id)
+        calc.mark_dirty(stock_id=lot.stock_id)
         db_utils.delete_item(table, lot_id)
         return Status.SUCCESS
     except Exception as e:
@@ -483,90 +629,139 @@ def get_performance_summary() -> Status:
 # ==============================================================================
 
 
+def leaderboard_select(challenge_id: int, user_id: int = None):
+    """Select statement for a challenge's ranked leaderboard rows
+    (challenge_id, rank, user_id, user_name, perc_change, stock_codes),
+    all users if user_id is None, otherwise only the top ranks and that user's row
+    """
+    # rank users by their avg perc_change, ties are ranked by user id
+    avg_change = func.avg(ChallengeEntry.perc_change)
+    ranked = (
+        select(
+            ChallengeEntry.user_id,
+            avg_change.label("avg_change"),
+            func.row_number()
+            .over(order_by=(avg_change.desc(), ChallengeEntry.user_id))
+            .label("rank"),
+        )
+        .where(ChallengeEntry.challenge_id == challenge_id)
+        .group_by(ChallengeEntry.user_id)
+        .subquery()
+    )
+
+    # each user's stock codes in desc order of perc_change
+    entry_filters = [ChallengeEntry.challenge_id == challenge_id]
+    if user_id is not None:
+        is_selected = or_(ranked.c.rank <= LEADERBOARD_SIZE, ranked.c.user_id == user_id)
+        entry_filters.append(
+            ChallengeEntry.user_id.in_(select(ranked.c.user_id).where(is_selected))
+        )
+    stock_codes = (
+        select(
+            ChallengeEntry.user_id,
+            func.group_concat(ChallengeEntry.code, ",")
+            .over(
+                partition_by=ChallengeEntry.user_id,
+                order_by=(ChallengeEntry.perc_change.desc(), ChallengeEntry.id),
+                rows=(None, None),
+            )
+            .label("stock_codes"),
+            func.row_number()
+            .over(partition_by=ChallengeEntry.user_id, order_by=ChallengeEntry.id)
+            .label("row"),
+        )
+        .where(*entry_filters)
+        .subquery()
+    )
+
+    stmt = (
+        select(
+            literal(challenge_id).label("challenge_id"),
+            ranked.c.rank,
+            ranked.c.user_id,
+            func.coalesce(User.first_name + " " + User.last_name, "").label("user_name"),
+            ranked.c.avg_change.label("perc_change"),
+            stock_codes.c.stock_codes,
+        )
+        .join(User, User.id == ranked.c.user_id)
+        .join(
+            stock_codes,
+            and_(stock_codes.c.user_id == ranked.c.user_id, stock_codes.c.row == 1),
+        )
+        .order_by(ranked.c.rank)
+    )
+    if user_id is not None:
+        stmt = stmt.where(is_selected)
+    return stmt
+
+
+def save_leaderboard_snapshot(challenge_id: int) -> Status:
+    """Persist the ranked leaderboard of a finished challenge, return success status"""
+    try:
+        db.session.execute(
+            delete(LeaderboardEntry).where(LeaderboardEntry.challenge_id == challenge_id)
+        )
+        stmt = leaderboard_select(challenge_id)
+        db.session.execute(
+            insert(LeaderboardEntry).from_select(
+                [column.name for column in stmt.selected_columns], stmt
+            )
+        )
+        db.session.commit()
+        return Status.SUCCESS
+    except Exception as e:
+        db.session.rollback()
+        utils.debug_exception(e, suppress=True)
+        return Status.FAIL
+
+
 def get_leaderboard_results() -> Union[Dict, Status]:
     """Return dict list of best performing user portfolios during last challenge period"""
     try:
-        leaderboard = []
-
-        prev_challenge_id, _ = utils.get_prev_challenge()
+        prev_challenge_id, start_date = utils.get_prev_challenge()
         if not prev_challenge_id:
             return Status.NOT_EXIST
 
-        # Get a ranked list of users and their avg perc_changes
-        result_list = (
-            ChallengeEntry.query.join(Challenge)
-            .join(User)
-            .filter(Challenge.id == prev_challenge_id)
-            .with_entities(
-                ChallengeEntry.user_id,
-                User.first_name,
-                User.last_name,
-                func.avg(ChallengeEntry.perc_change).label("avg_change"),
-            )
-            .group_by(ChallengeEntry.user_id)
-            .order_by(desc("avg_change"))
-            .all()
-        )
-        # add rank to each result and limit to top 10
-        result_list = [(rank + 1, *item) for rank, item in enumerate(result_list)]
-        ranked_list = result_list[:10]  # limit to first 10
-
-        # generator expression to find user's rank and portfolio
-        user_tuple = ()
-        user_i = None
-        try:
-            user_i = next(
-                (i for i, tuple in enumerate(result_list) if tuple[1] == current_user.id),
-                None,
-            )
-            user_tuple = result_list[user_i]
-            ranked_list.append(user_tuple)  # process user row as well
-        except:
-            pass
-
-        # Append each user's stock codes and names to the results
-        for rank, user_id, first_name, last_name, avg_change in ranked_list:
-            # process stock codes/syms
-            stock_codes = (
-                ChallengeEntry.query.join(Challenge)
-                .filter(
-                    Challenge.id == prev_challenge_id, ChallengeEntry.user_id == user_id
-                )
-                .order_by(ChallengeEntry.perc_change.desc())
-                .with_entities(ChallengeEntry.code)
-                .all()
-            )
-            stock_codes = [tuple[0] for tuple in stock_codes]
-
-            # concat names
-            user_name = ""
-            try:
-                user_name = " ".join([first_name, last_name])
-            except:
-                pass
-
-            leaderboard.append(
-                {
-                    "user_id": user_id,
-                    "user_name": user_name,
-                    "rank": rank,
-                    "perc_change": avg_change,
-                    "stock_codes": stock_codes,
-                }
+        # read from the snapshot written when the challenge ended, otherwise rank live
+        columns = [
+            LeaderboardEntry.rank,
+            LeaderboardEntry.user_id,
+            LeaderboardEntry.user_name,
+            LeaderboardEntry.perc_change,
+            LeaderboardEntry.stock_codes,
+        ]
+        result_list = db.session.execute(
+            select(*columns)
+            .where(
+                LeaderboardEntry.challenge_id == prev_challenge_id,
+                or_(
+                    LeaderboardEntry.rank <= LEADERBOARD_SIZE,
+                    LeaderboardEntry.user_id == current_user.id,
+                ),
             )
+            .order_by(LeaderboardEntry.rank)
+        ).all()
+        if not result_list:
+            live = leaderboard_select(prev_challenge_id, current_user.id).subquery()
+            result_list = db.session.execute(
+                select(*[live.c[column.key] for column in columns]).order_by(live.c.rank)
+            ).all()
 
+        leaderboard = []
         user_row = None
-        try:
-            if user_i is not None:
-                # remove user row after processing (if found)
-                user_row = leaderboard.pop()
-        except:
-            raise ValueError("Previous challenge leaderboard is empty")
-
-        # Get challenge start and end dates
-        start_date = (
-            Challenge.query.filter(Challenge.id == prev_challenge_id).one().start_date
-        )
+        for rank, user_id, user_name, perc_change, stock_codes in result_list:
+            row = {
+                "user_id": user_id,
+                "user_name": user_name,
+                "rank": rank,
+                "perc_change": perc_change,
+                "stock_codes": stock_codes.split(",") if stock_codes else [],
+            }
+            if rank <= LEADERBOARD_SIZE:
+                leaderboard.append(row)
+            if user_id == current_user.id:
+                user_row = row  # include User's rank/portfolio
+
         end_date = start_date + CHALLENGE_PERIOD
 
         return {
@@ -632,14 +827,15 @@ def add_challenge_stocks(stocks, challenge_id: int) -> Status:
                 return Status.FAIL
 
             except:
-                for stock_page_id in stocks:
-                    new_stock = ChallengeEntry(
-                        challenge_id=challenge_id,
-                        user_id=current_user.id,
-                        stock_page_id=stock_page_id,
-                        code=utils.id_to_code(stock_page_id),
-                    )
-                    db_utils.insert_item(new_stock)
+                with db_utils.batch():
+                    for stock_page_id in stocks:
+                        new_stock = ChallengeEntry(
+                            challenge_id=challenge_id,
+                            user_id=current_user.id,
+                            stock_page_id=stock_page_id,
+                            code=utils.id_to_code(stock_page_id),
+                        )
+                        db_utils.insert_item(new_stock)
                 return Status.SUCCESS
         else:
             return Status.INVALID
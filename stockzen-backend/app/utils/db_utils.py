@@ -1,14 +1,18 @@
+import threading
+from contextlib import contextmanager
 from typing import Any, List, Mapping, NewType, Optional, Sequence, TypeVar, Union
 
 from app import db
 from app.config import SEARCH_LIMIT
 from app.models.schema import LotBought, LotSold, Portfolio, Stock, StockPage, User
+from flask import current_app
 from flask_login import current_user
 from sqlalchemy import func, or_
 from sqlalchemy.orm import load_only
+from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql.operators import collate
 
-from . import utils
+from . import search_utils, utils
 
 DatabaseObj = TypeVar(
     "DatabaseObj", Portfolio, Stock, User, LotBought, LotSold, StockPage
@@ -17,24 +21,90 @@ ColumnName = NewType("ColumnName", str)
 ColumnVal = TypeVar("ColumnVal", int, str, float)
 
 
+# ==============================================================================
+# Unit of Work
+#   Inside `with batch():` the CRUD helpers below flush instead of committing,
+#   and the block is committed once at the end, or rolled back if any write
+#   failed. Batches are per thread (as is db.session) and nested blocks join
+#   the outermost one.
+# ==============================================================================
+
+_unit_of_work = threading.local()
+
+
+@contextmanager
+def batch():
+    """Run the CRUD helpers in the block as one transaction with one commit"""
+    depth = getattr(_unit_of_work, "depth", 0)
+    if depth == 0:
+        _unit_of_work.failed = False
+
+    _unit_of_work.depth = depth + 1
+    try:
+        yield
+        if depth == 0:
+            if _unit_of_work.failed:
+                raise RuntimeError("A write in the batch failed, batch rolled back")
+            db.session.commit()
+    except Exception:
+        if depth == 0:
+            db.session.rollback()
+        raise
+    finally:
+        _unit_of_work.depth = depth
+
+
+def in_batch() -> bool:
+    return getattr(_unit_of_work, "depth", 0) > 0
+
+
+def commit() -> None:
+    """Commit the session, or only flush it inside a batch"""
+    if in_batch():
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def rollback() -> None:
+    """Roll back the session, or fail the whole batch inside a batch"""
+    if in_batch():
+        _unit_of_work.failed = True
+    else:
+        db.session.rollback()
+
+
 # ==============================================================================
 # Shared DB Utils
 # ==============================================================================
 
 
+def owner_filters(table: DatabaseObj, **filters) -> List[Any]:
+    """Filters selecting the current user's rows (if applicable) of a parent
+    **filters is of form **{col_type: id}; e.g. {"portfolio": 1}
+    """
+    filter_list = []
+    if "user_id" in table.__table__.columns:
+        filter_list.append(table.user_id == current_user.id)
+
+    for col_type, id in filters.items():
+        filter_list.append(getattr(table, f"{col_type}_id") == id)
+    return filter_list
+
+
+def item_filters(table: DatabaseObj, item_id: int, **filters) -> List[Any]:
+    """Filters selecting an item by id, owned by the current user if applicable
+    **filters is of form **{col_type: id}; e.g. {"portfolio": 1}
+    """
+    return [table.id == item_id, *owner_filters(table, **filters)]
+
+
 def query_item(table: DatabaseObj, item_id: int, **filters) -> Optional[DatabaseObj]:
     """Query a database table using item id, returns query item or None
     **filters is of form **{col_type: id}; e.g. {"portfolio": 1}
     """
     try:
-        filter_list = [table.id == item_id]
-        if "user_id" in table.__table__.columns:
-            filter_list.append(table.user_id == current_user.id)
-
-        for col_type, id in filters.items():
-            filter_list.append(getattr(table, f"{col_type}_id") == id)
-
-        item = table.query.filter(*filter_list).one()
+        item = table.query.filter(*item_filters(table, item_id, **filters)).one()
 
         return item
     except Exception as e:
@@ -123,9 +193,9 @@ def insert_item(new_row: DatabaseObj) -> None:
     """Commit a new database DB object (a row), throws exception on fail"""
     try:
         db.session.add(new_row)
-        db.session.commit()
+        commit()
     except Exception as e:
-        db.session.rollback()
+        rollback()
         utils.debug_exception(e)
 
 
@@ -138,12 +208,15 @@ def update_item_columns(
     """Update table columns, throws exception on fail
     :param col_val_pairs is a dict of column names:values to be updated"""
     try:
-        item = query_item(table, item_id, **filters)
-        for target_col, new_value in col_val_pairs.items():
-            setattr(item, target_col, new_value)  # updates target_col
-        db.session.commit()
+        # single UPDATE, without loading the row first
+        rowcount = table.query.filter(*item_filters(table, item_id, **filters)).update(
+            col_val_pairs, synchronize_session="evaluate"
+        )
+        if rowcount != 1:
+            raise NoResultFound(f"No {table.__tablename__} row with id {item_id}")
+        commit()
     except Exception as e:
-        db.session.rollback()
+        rollback()
         utils.debug_exception(e)
 
 
@@ -154,9 +227,9 @@ def delete_item(table: DatabaseObj, item_id: int, **filters) -> None:
     try:
         item = query_item(table, item_id, **filters)
         db.session.delete(item)
-        db.session.commit()
+        commit()
     except Exception as e:
-        db.session.rollback()
+        rollback()
         utils.debug_exception(e)
 
 
@@ -166,10 +239,11 @@ def delete_items(table: DatabaseObj, **filters) -> None:
     """
     try:
         items = query_all(table, **filters)
-        map(db.session.delete, items)
-        db.session.commit()
+        for item in items:
+            db.session.delete(item)
+        commit()
     except Exception as e:
-        db.session.rollback()
+        rollback()
         utils.debug_exception(e)
 
 
@@ -197,6 +271,15 @@ def query_user(email: str) -> Optional[User]:
 def search_query(search_string: str):
     """Query for stocks by name/code, returns list of query results or None."""
     try:
+        # in-memory index returns the same results without a query
+        if current_app.config["SEARCH_BACKEND"] == "index":
+            return search_utils.get_search_index().search(search_string)
+        # FTS5 returns ranked results, queries without terms fall through to sql
+        if current_app.config["SEARCH_BACKEND"] == "fts":
+            results_list = search_utils.fts_search(search_string)
+            if results_list is not None:
+                return results_list
+
         # defer loading of all irrelevant columns
         search_cols = ["id", "code", "stock_name"]
 
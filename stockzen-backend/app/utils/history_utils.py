@@ -0,0 +1,157 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from app import db
+from app.market_data.base import PERIOD_OFFSETS
+from app.models.schema import History
+from pandas.core.frame import DataFrame
+
+# ==============================================================================
+# Columnar OHLCV history store
+#   Each stock page has a single History row holding every column as a packed
+#   numpy array, so a read is one query and no per-day parsing.
+# ==============================================================================
+
+COLUMN_DTYPES = {
+    "dates": "datetime64[s]",
+    "open": np.float64,
+    "high": np.float64,
+    "low": np.float64,
+    "close": np.float64,
+    "volume": np.int64,
+}
+
+Columns = Dict[str, np.ndarray]
+
+PERIOD_SLACK = pd.Timedelta(days=7)  # cached period may start after weekends/holidays
+ADJUSTMENT_TOLERANCE = 1e-4  # relative close price difference treated as an adjustment
+
+
+def from_dataframe(df: DataFrame) -> Columns:
+    """Convert a provider history DataFrame into history columns"""
+    index = pd.DatetimeIndex(df.index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+
+    return {
+        "dates": index.values.astype(COLUMN_DTYPES["dates"]),
+        "open": df["Open"].to_numpy(np.float64),
+        "high": df["High"].to_numpy(np.float64),
+        "low": df["Low"].to_numpy(np.float64),
+        "close": df["Close"].to_numpy(np.float64),
+        "volume": df["Volume"].fillna(0).to_numpy(np.int64),
+    }
+
+
+def load_history(stock_page_id: int) -> Optional[Columns]:
+    """Read the cached history columns of a stock page, or None if not cached"""
+    row = History.query.filter_by(stock_page_id=stock_page_id).one_or_none()
+    if row is None:
+        return None
+
+    return {
+        col: np.frombuffer(getattr(row, col), dtype=dtype)
+        for col, dtype in COLUMN_DTYPES.items()
+    }
+
+
+def save_history(stock_page_id: int, columns: Columns):
+    """Replace the cached history columns of a stock page"""
+    row = History.query.filter_by(stock_page_id=stock_page_id).one_or_none()
+    if row is None:
+        row = History(stock_page_id=stock_page_id)
+        db.session.add(row)
+
+    for col, dtype in COLUMN_DTYPES.items():
+        setattr(row, col, np.ascontiguousarray(columns[col], dtype=dtype).tobytes())
+    row.n_bars = len(columns["dates"])
+    row.last_updated = datetime.now()
+    db.session.commit()
+
+
+def append_history(stock_page_id: int, columns: Columns) -> Columns:
+    """Merge newly fetched bars into the cache, newer bars replace cached bars
+    from the same date onwards, returns the merged columns
+    """
+    cached = load_history(stock_page_id)
+    if cached is not None and len(columns["dates"]) > 0:
+        # keep only the cached bars before the first new bar
+        keep = np.searchsorted(cached["dates"], columns["dates"][0], side="left")
+        columns = {
+            col: np.concatenate([cached[col][:keep], columns[col]])
+            for col in COLUMN_DTYPES
+        }
+
+    save_history(stock_page_id, columns)
+    return columns
+
+
+def covers_period(columns: Columns, period: str) -> bool:
+    """Check that the cached bars reach back a full period from the last bar"""
+    dates = columns["dates"]
+    if len(dates) == 0:
+        return False
+    if period not in PERIOD_OFFSETS:
+        return False  # cache is always reloaded for max/ytd
+
+    cutoff = pd.Timestamp(dates[-1]) - PERIOD_OFFSETS[period] + PERIOD_SLACK
+    return pd.Timestamp(dates[0]) <= cutoff
+
+
+def delta_start(cached: Columns) -> datetime:
+    """Date to fetch a delta from, the last settled bar (the last cached bar may be
+    a partial bar that is still forming, so the bar before it is refetched too)
+    """
+    settled = cached["dates"][-2] if len(cached["dates"]) > 1 else cached["dates"][-1]
+    return pd.Timestamp(settled).to_pydatetime()
+
+
+def is_consistent(cached: Columns, delta: Columns) -> bool:
+    """Check that a delta fetched from delta_start can be merged, False on a gap
+    (the delta starts after the last settled bar) or when the overlapping settled
+    bars changed (e.g. prices were adjusted for a split or dividend). The last
+    cached bar is not compared, it is overwritten by the delta.
+    """
+    if len(delta["dates"]) == 0 or delta["dates"][0] > cached["dates"][-1]:
+        return False
+
+    settled = cached["dates"][:-1]
+    if len(settled) > 0 and delta["dates"][0] > settled[-1]:
+        return False
+
+    overlap = np.isin(delta["dates"], settled)
+    idx = np.searchsorted(settled, delta["dates"][overlap])
+    return np.allclose(
+        delta["close"][overlap], cached["close"][idx], rtol=ADJUSTMENT_TOLERANCE
+    )
+
+
+def slice_period(columns: Columns, period: str) -> Columns:
+    """Return the bars within a yfinance style period of the last bar"""
+    dates = columns["dates"]
+    if len(dates) == 0 or period not in PERIOD_OFFSETS:
+        return columns
+
+    cutoff = (pd.Timestamp(dates[-1]) - PERIOD_OFFSETS[period]).to_datetime64()
+    start = np.searchsorted(dates, cutoff, side="right")
+    return {col: values[start:] for col, values in columns.items()}
+
+
+def to_records(columns: Columns, **extra) -> List[dict]:
+    """Convert history columns to a list of daily record dicts for jsonification
+    **extra are added to every record; e.g. {"stock_page_id": 1}
+    """
+    dates = np.datetime_as_string(columns["dates"], unit="D").tolist()
+    return [
+        {**extra, "date": d, "open": o, "high": h, "low": l, "close": c, "volume": v}
+        for d, o, h, l, c, v in zip(
+            dates,
+            columns["open"].tolist(),
+            columns["high"].tolist(),
+            columns["low"].tolist(),
+            columns["close"].tolist(),
+            columns["volume"].tolist(),
+        )
+    ]
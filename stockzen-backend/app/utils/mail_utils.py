@@ -0,0 +1,215 @@
+import queue
+import threading
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from uuid import uuid4
+
+from app import db, mail
+from app.config import (
+    ALERT_MAIL_ACK_BATCH,
+    ALERT_MAIL_CLAIM_TTL,
+    ALERT_MAIL_MAX_ATTEMPTS,
+    ALERT_MAIL_QUEUE_SIZE,
+    ALERT_MAIL_WORKERS,
+    MAIL_SENDER,
+)
+from app.models.schema import MailOutbox
+from flask_mail import Message
+from sqlalchemy import or_, select, update
+
+from . import utils
+
+# ==============================================================================
+# Mail outbox dispatcher
+#   Mails are written to the mail_outbox table in the transaction that makes
+#   them due, and sent from there by a pool of worker threads that each keep
+#   one SMTP connection open while there is mail to send. A mail is marked as
+#   sent only after the SMTP server accepted it, so a crash in between sends it
+#   again (at-least-once delivery). Dispatchers of several worker processes
+#   claim the mails they queue, so each mail is sent by one dispatcher unless
+#   its claim expires unsent.
+# ==============================================================================
+
+IDLE_TIMEOUT = 5  # seconds without mail before a worker closes its connection
+
+Mail = Tuple[int, str, str, str]  # (mail_outbox.id, recipient, subject, body)
+
+
+class MailDispatcher:
+    """Send the pending outbox mails with a pool of persistent SMTP connections
+
+    :param workers: number of sending threads (and SMTP connections)
+    :param queue_size: max mails queued for the workers at a time
+    """
+
+    def __init__(
+        self,
+        app,
+        workers: int = ALERT_MAIL_WORKERS,
+        queue_size: int = ALERT_MAIL_QUEUE_SIZE,
+    ):
+        self.app = app
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._threads = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(workers)
+        ]
+        self._lock = threading.Lock()
+        self._inflight = set()  # ids of queued mails, not re-queued until done
+        self.owner = uuid4().hex
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Send the queued mails and stop the workers"""
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def join(self):
+        """Wait until every queued mail has been sent or failed"""
+        self.queue.join()
+
+    def enqueue_pending(self) -> int:
+        """Queue the unsent outbox mails for the workers, as many as the queue has
+        room for (the rest are queued by a later call), returns the number queued
+        """
+        free = self.queue.maxsize - self.queue.qsize()
+        if free <= 0:
+            return 0
+
+        with self._lock:
+            inflight = list(self._inflight)
+        now = datetime.now()
+        pending = (
+            MailOutbox.sent_at == None,
+            MailOutbox.attempts < ALERT_MAIL_MAX_ATTEMPTS,
+            MailOutbox.id.notin_(inflight),
+        )
+
+        # claim unclaimed mails, and mails whose dispatcher did not send them in time
+        claimable = (
+            select(MailOutbox.id)
+            .where(
+                *pending,
+                or_(MailOutbox.claimed_until == None, MailOutbox.claimed_until < now),
+            )
+            .order_by(MailOutbox.id)
+            .limit(free)
+        )
+        db.session.execute(
+            update(MailOutbox)
+            .where(MailOutbox.id.in_(claimable))
+            .values(
+                claimed_by=self.owner,
+                claimed_until=now + timedelta(seconds=ALERT_MAIL_CLAIM_TTL),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+        rows = (
+            db.session.query(
+                MailOutbox.id, MailOutbox.recipient, MailOutbox.subject, MailOutbox.body
+            )
+            .filter(*pending, MailOutbox.claimed_by == self.owner)
+            .order_by(MailOutbox.id)
+            .limit(free)
+            .all()
+        )
+
+        count = 0
+        for row in rows:
+            with self._lock:
+                self._inflight.add(row.id)
+            try:
+                self.queue.put_nowait(tuple(row))
+            except queue.Full:
+                with self._lock:
+                    self._inflight.discard(row.id)
+                break
+            count += 1
+        return count
+
+    # --------------------------------------------------------------------------
+    # Workers
+    # --------------------------------------------------------------------------
+
+    def _work(self):
+        with self.app.app_context():
+            item = self.queue.get()
+            while item is not None:
+                try:
+                    item = self._send_all(item)
+                except Exception as e:
+                    # the failed mail is retried by a later enqueue_pending
+                    utils.debug_exception(e, suppress=True)
+                    item = self.queue.get()
+            self.queue.task_done()
+
+    def _send_all(self, item: Mail) -> Optional[Mail]:
+        """Send item and the following queued mails over one SMTP connection until
+        the queue is idle, returns the next item (None to stop)
+        """
+        sent = []
+        mail_id = item[0]  # mail being sent, failed if the connection cannot open
+        try:
+            with mail.connect() as connection:
+                while True:
+                    mail_id, recipient, subject, body = item
+                    connection.send(
+                        Message(
+                            subject, sender=MAIL_SENDER, recipients=[recipient], body=body
+                        )
+                    )
+                    sent.append(mail_id)
+                    mail_id = None
+
+                    # mark as sent in batches, or as soon as the queue runs dry
+                    if len(sent) >= ALERT_MAIL_ACK_BATCH or self.queue.empty():
+                        self._done(sent)
+                        sent = []
+
+                    try:
+                        item = self.queue.get(timeout=IDLE_TIMEOUT)
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        return None
+        except Exception:
+            if mail_id is not None:
+                self._done([mail_id], sent=False)
+            raise
+        finally:
+            self._done(sent)
+
+        # idle, the connection is closed until more mail arrives
+        return self.queue.get()
+
+    def _done(self, mail_ids: List[int], sent: bool = True):
+        """Mark mails as sent, or count a failed attempt"""
+        if not mail_ids:
+            return
+
+        # a failed mail is unclaimed, to be retried by any dispatcher
+        values = (
+            {"sent_at": datetime.now()}
+            if sent
+            else {"attempts": MailOutbox.attempts + 1, "claimed_until": None}
+        )
+        try:
+            db.session.execute(
+                update(MailOutbox).where(MailOutbox.id.in_(mail_ids)).values(**values)
+            )
+            db.session.commit()
+        except Exception as e:
+            # unmarked mails are sent again
+            db.session.rollback()
+            utils.debug_exception(e, suppress=True)
+
+        with self._lock:
+            self._inflight.difference_update(mail_ids)
+        for _ in mail_ids:
+            self.queue.task_done()
@@ -0,0 +1,200 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, Optional
+
+from app import db
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+
+# ==============================================================================
+# SQL instrumentation
+#   Every statement executed on the app's engine is counted and timed against
+#   the QueryStats of the current request (or tracked background job). The
+#   stats live in a context variable, so statements of executor threads are
+#   never added to the request that submitted them.
+# ==============================================================================
+
+STATEMENT_PREVIEW = 200  # characters of the slowest statement kept for logs
+
+_current_stats = ContextVar("query_stats", default=None)
+
+
+class QueryStats:
+    """Statements executed by one request or background job"""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0  # seconds
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement: str, elapsed: float):
+        self.count += 1
+        self.time += elapsed
+        if elapsed >= self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_statement = statement
+
+
+class QueryMetrics:
+    """Statement counts and times aggregated per endpoint or job, thread-safe"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}  # key: {calls, queries, time, max_queries, max_time}
+
+    def record(self, key: str, stats: QueryStats):
+        with self._lock:
+            metrics = self._metrics.setdefault(
+                key,
+                {
+                    "calls": 0,
+                    "queries": 0,
+                    "time": 0.0,
+                    "max_queries": 0,
+                    "max_time": 0.0,
+                },
+            )
+            metrics["calls"] += 1
+            metrics["queries"] += stats.count
+            metrics["time"] += stats.time
+            metrics["max_queries"] = max(metrics["max_queries"], stats.count)
+            metrics["max_time"] = max(metrics["max_time"], stats.time)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Copy of the metrics, with the mean queries and time per call"""
+        with self._lock:
+            return {
+                key: {
+                    **metrics,
+                    "mean_queries": metrics["queries"] / metrics["calls"],
+                    "mean_time": metrics["time"] / metrics["calls"],
+                }
+                for key, metrics in self._metrics.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+
+
+def current_stats() -> Optional[QueryStats]:
+    """Stats of the current request or tracked job, None if not tracked"""
+    return _current_stats.get()
+
+
+def get_query_metrics() -> Optional[QueryMetrics]:
+    """Return the app's query metrics, or None outside the app context"""
+    if has_app_context():
+        return current_app.extensions.get("query_metrics")
+    return None
+
+
+@contextmanager
+def track_queries(key: str):
+    """Count the statements of the block as a job under key, unless the block is
+    already tracked (e.g. a job run synchronously by a request)
+    """
+    if _current_stats.get() is not None:
+        yield _current_stats.get()
+        return
+
+    stats = QueryStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+        metrics = get_query_metrics()
+        if metrics is not None:
+            metrics.record(key, stats)
+
+
+def track_job(fn):
+    """Decorator counting the statements of a background job"""
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with track_queries(f"job {fn.__module__}.{fn.__qualname__}"):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+# ------------------------------------------------------------------------------
+# Engine and request hooks
+# ------------------------------------------------------------------------------
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+
+def _handle_error(exception_context):
+    if exception_context.connection is not None:
+        starts = exception_context.connection.info.get("query_start")
+        if starts:
+            starts.pop()  # the failed statement has no after_cursor_execute
+
+
+def _start_request():
+    g.query_stats = QueryStats()
+    _current_stats.set(g.query_stats)
+
+
+def _finish_request(response):
+    _current_stats.set(None)
+    stats = g.pop("query_stats", None)
+    if stats is None:
+        return response
+
+    rule = request.url_rule.rule if request.url_rule else "<unmatched>"
+    key = f"{request.method} {rule}"
+    current_app.extensions["query_metrics"].record(key, stats)
+
+    if current_app.debug:
+        response.headers["X-DB-Queries"] = str(stats.count)
+        response.headers["X-DB-Time"] = f"{stats.time * 1000:.2f}"  # ms
+        response.headers["X-DB-Slowest"] = f"{stats.slowest_time * 1000:.2f}"  # ms
+
+    if (
+        stats.count > current_app.config["QUERY_COUNT_BUDGET"]
+        or stats.time > current_app.config["QUERY_TIME_BUDGET"]
+    ):
+        current_app.logger.warning(
+            "%s %s over query budget: %d statements in %.1fms, slowest %.1fms: %s",
+            request.method,
+            request.full_path.rstrip("?"),
+            stats.count,
+            stats.time * 1000,
+            stats.slowest_time * 1000,
+            (stats.slowest_statement or "")[:STATEMENT_PREVIEW],
+        )
+    return response
+
+
+def _end_request(exception):
+    # after_request is skipped when the request raised, teardown also runs in
+    # executor threads given a copy of the request context, which share g
+    _current_stats.set(None)
+
+
+def init_app(app):
+    app.extensions["query_metrics"] = QueryMetrics()
+    engine = db.get_engine(app)
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_request)
@@ -0,0 +1,197 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Hashable, Optional
+from uuid import uuid4
+
+from app import db, executor
+from app.config import (
+    REFRESH_LOCK_POLL,
+    REFRESH_LOCK_TIMEOUT,
+    REFRESH_LOCK_TTL,
+    STALENESS_INTERVAL,
+    STOCK_PAGE_MAX_AGE,
+)
+from app.models.schema import RefreshLock, StockPage
+from app.utils.enums import Status
+from sqlalchemy import delete, insert, update
+from sqlalchemy.exc import IntegrityError
+
+from . import api_utils, cache_utils, crud_utils, utils
+
+# ==============================================================================
+# Single-flight refreshes
+#   Concurrent refreshes of the same key share one fetch: threads within a
+#   process wait on the in-flight call, and processes (e.g. gunicorn workers)
+#   serialise on a row in the refresh_locks table.
+# ==============================================================================
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one call,
+    every caller gets the result (or exception) of the in-flight call
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+stock_page_flights = SingleFlight()
+
+
+# ------------------------------------------------------------------------------
+# Refresh lock table
+# ------------------------------------------------------------------------------
+
+
+def acquire_lock(key: str, timeout: float = REFRESH_LOCK_TIMEOUT) -> Optional[str]:
+    """Wait for the refresh lock of a key, returns the owner token or None on timeout
+    Locks held past their expiry (e.g. by a crashed worker) are taken over
+    """
+    owner = uuid4().hex
+    deadline = time.monotonic() + timeout
+
+    while True:
+        now = datetime.now()
+        expires = now + timedelta(seconds=REFRESH_LOCK_TTL)
+        try:
+            db.session.execute(
+                insert(RefreshLock).values(key=key, owner=owner, expires=expires)
+            )
+            db.session.commit()
+            return owner
+        except IntegrityError:
+            db.session.rollback()
+
+        # lock is held, take it over if it has expired
+        result = db.session.execute(
+            update(RefreshLock)
+            .where(RefreshLock.key == key, RefreshLock.expires < now)
+            .values(owner=owner, expires=expires)
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            return owner
+
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(REFRESH_LOCK_POLL)
+
+
+def release_lock(key: str, owner: str):
+    """Release the refresh lock of a key if still held by owner"""
+    db.session.execute(
+        delete(RefreshLock).where(RefreshLock.key == key, RefreshLock.owner == owner)
+    )
+    db.session.commit()
+
+
+# ------------------------------------------------------------------------------
+# Stock page refresh
+# ------------------------------------------------------------------------------
+
+
+def refresh_stock_page(stock_page_id: int, max_age: int = 0) -> Status:
+    """Update a stock page unless it was updated within max_age seconds,
+    concurrent refreshes of the same stock page share one fetch
+    """
+    fresh_after = datetime.now() - timedelta(seconds=max_age)
+    try:
+        return stock_page_flights.do(
+            stock_page_id, _refresh_stock_page, stock_page_id, fresh_after
+        )
+    except Exception as e:
+        utils.debug_exception(e, suppress=True)
+        return Status.FAIL
+
+
+def _refresh_stock_page(stock_page_id: int, fresh_after: datetime) -> Status:
+    key = f"stock_page:{stock_page_id}"
+    owner = acquire_lock(key)
+    if owner is None:
+        raise TimeoutError(f"Timed out waiting for refresh of {key}")
+
+    try:
+        # skip the fetch if another worker refreshed while we waited for the lock
+        page = (
+            db.session.query(StockPage.last_updated, StockPage.info)
+            .filter_by(id=stock_page_id)
+            .one_or_none()
+        )
+        if (
+            page
+            and page.last_updated
+            and page.last_updated >= fresh_after
+            and (has_info(page.info) or cache_utils.recently_failed(stock_page_id))
+        ):
+            return Status.SUCCESS
+
+        return crud_utils.update_stock_page(stock_page_id)
+    finally:
+        release_lock(key, owner)
+
+
+def has_info(info: str) -> bool:
+    """Check that a stock page holds company info, pages only updated with
+    bulk quotes (crud_utils.bulk_update_stock_pages) have none
+    """
+    return bool(info) and info != "{}"
+
+
+def revalidate_stock_page(stock_page_id: int) -> Status:
+    """Stale-while-revalidate refresh for serving a stock page:
+    fresh (within STALENESS_INTERVAL) cache is used as is, stale cache within
+    STOCK_PAGE_MAX_AGE is used while refreshing in the background, and only a
+    missing or expired cache (or one without company info) blocks on the refresh
+    """
+    page = (
+        db.session.query(StockPage.price, StockPage.last_updated, StockPage.info)
+        .filter_by(id=stock_page_id)
+        .one_or_none()
+    )
+    if page is None:
+        return Status.FAIL
+
+    # pages without info are refreshed unless their last fetch just failed
+    is_complete = has_info(page.info) or cache_utils.recently_failed(stock_page_id)
+    if page.price is not None and page.last_updated is not None and is_complete:
+        age = (datetime.now() - page.last_updated).total_seconds()
+        if age <= STALENESS_INTERVAL:
+            return Status.SUCCESS
+        if age <= STOCK_PAGE_MAX_AGE:
+            executor.submit(api_utils.api_stock_request, stock_page_id)
+            return Status.SUCCESS
+
+    return refresh_stock_page(stock_page_id, STALENESS_INTERVAL)
@@ -0,0 +1,238 @@
+import heapq
+import re
+import threading
+from bisect import bisect_left
+from typing import List, Optional
+
+from app import db
+from app.config import SEARCH_LIMIT
+from app.models.schema import StockPage
+from flask import current_app, has_app_context
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+
+from . import utils
+
+# ==============================================================================
+# In-memory stock search index
+#   Matches the SQL search (code prefix OR name substring, ordered by code then
+#   name, case-insensitive) without hitting the database: stocks are ranked once,
+#   codes are kept sorted for prefix bisection, and names are indexed by trigram.
+# ==============================================================================
+
+NGRAM = 3
+
+
+def trigrams(text: str):
+    return {text[i : i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+class _Snapshot:
+    """Immutable index over the stock universe at build time"""
+
+    def __init__(self, rows):
+        # rank stocks in result order, so matches only need sorting by rank
+        rows = sorted(
+            rows, key=lambda row: ((row[1] or "").lower(), (row[2] or "").lower(), row[0])
+        )
+        self.results = [
+            {"id": id, "code": code, "stock_name": name, "exchange": exchange}
+            for id, code, name, exchange in rows
+        ]
+        self.codes = [(row[1] or "").lower() for row in rows]  # sorted, for bisect
+        self.names = [(row[2] or "").lower() for row in rows]
+
+        postings = {}  # trigram: ranks of names containing it, ascending
+        for rank, name in enumerate(self.names):
+            for gram in trigrams(name):
+                postings.setdefault(gram, []).append(rank)
+        self.postings = postings
+
+    def search(self, query: str, limit: int) -> List[dict]:
+        query = query.lower()
+
+        # code prefix matches are a contiguous range of ranks
+        lo = bisect_left(self.codes, query)
+        hi = bisect_left(self.codes, query + "\U0010ffff")
+
+        if len(query) < NGRAM:
+            # short queries match densely, scan names in rank order
+            candidates = range(len(self.names))
+        else:
+            # any name containing the query is in the rarest trigram's postings
+            candidates = min(
+                (self.postings.get(gram, []) for gram in trigrams(query)), key=len
+            )
+
+        # collect name matches in rank order until the limit, then merge with codes
+        name_ranks = []
+        for rank in candidates:
+            if query in self.names[rank]:
+                name_ranks.append(rank)
+                if len(name_ranks) == limit:
+                    break
+        code_ranks = range(lo, min(hi, lo + limit))
+        ranks = heapq.nsmallest(limit, set(name_ranks).union(code_ranks))
+
+        return [self.results[rank] for rank in ranks]
+
+
+class SearchIndex:
+    """Lazily built, thread-safe search index, rebuilt after invalidate()"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT) -> List[dict]:
+        return self._get_snapshot().search(query or "", limit)
+
+    def _get_snapshot(self) -> _Snapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None:
+                    rows = db.session.query(
+                        StockPage.id,
+                        StockPage.code,
+                        StockPage.stock_name,
+                        StockPage.exchange,
+                    ).all()
+                    snapshot = self._snapshot = _Snapshot(rows)
+        return snapshot
+
+
+def get_search_index() -> Optional[SearchIndex]:
+    """Return the app's search index, or None outside the app context"""
+    if has_app_context():
+        return current_app.extensions.get("search_index")
+    return None
+
+
+def invalidate_search_index():
+    """Rebuild the search index on next search, call when stock pages change"""
+    index = get_search_index()
+    if index is not None:
+        index.invalidate()
+
+
+@event.listens_for(StockPage, "after_insert")
+@event.listens_for(StockPage, "after_delete")
+def _on_stock_page_change(mapper, connection, target):
+    invalidate_search_index()
+
+
+# ==============================================================================
+# SQLite FTS5 stock search
+#   stock_pages_fts is an external content FTS5 table over stock_pages.code and
+#   stock_name, kept in sync by triggers, so it persists and scales with the db.
+# ==============================================================================
+
+FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS stock_pages_fts USING fts5(
+        code, stock_name, content='stock_pages', content_rowid='id', prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS stock_pages_fts_ai AFTER INSERT ON stock_pages BEGIN
+        INSERT INTO stock_pages_fts(rowid, code, stock_name)
+        VALUES (new.id, new.code, new.stock_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS stock_pages_fts_ad AFTER DELETE ON stock_pages BEGIN
+        INSERT INTO stock_pages_fts(stock_pages_fts, rowid, code, stock_name)
+        VALUES ('delete', old.id, old.code, old.stock_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS stock_pages_fts_au
+    AFTER UPDATE OF code, stock_name ON stock_pages BEGIN
+        INSERT INTO stock_pages_fts(stock_pages_fts, rowid, code, stock_name)
+        VALUES ('delete', old.id, old.code, old.stock_name);
+        INSERT INTO stock_pages_fts(rowid, code, stock_name)
+        VALUES (new.id, new.code, new.stock_name);
+    END""",
+    # index any rows that existed before the table was created
+    "INSERT INTO stock_pages_fts(stock_pages_fts) VALUES ('rebuild')",
+]
+
+# ranked by exact code, code prefix, word prefix in the name, then other matches
+FTS_QUERY = text(
+    """
+    SELECT s.id, s.code, s.stock_name, s.exchange
+    FROM stock_pages_fts f JOIN stock_pages s ON s.id = f.rowid
+    WHERE stock_pages_fts MATCH :match
+    ORDER BY
+        CASE
+            WHEN lower(s.code) = :query THEN 0
+            WHEN s.code LIKE :prefix ESCAPE '\\' THEN 1
+            WHEN s.stock_name LIKE :prefix ESCAPE '\\'
+                OR s.stock_name LIKE :word_prefix ESCAPE '\\' THEN 2
+            ELSE 3
+        END,
+        bm25(stock_pages_fts),
+        s.code COLLATE NOCASE
+    LIMIT :limit
+    """
+)
+
+
+def create_fts(connection):
+    """Create the FTS5 table and sync triggers, skipped if FTS5 is unavailable"""
+    if connection.dialect.name != "sqlite":
+        return
+    try:
+        for ddl in FTS_DDL:
+            connection.execute(text(ddl))
+    except OperationalError as e:
+        utils.debug_exception(e, suppress=True)
+
+
+@event.listens_for(StockPage.__table__, "after_create")
+def _on_stock_pages_create(target, connection, **kw):
+    create_fts(connection)
+
+
+def to_fts_match(query: str) -> Optional[str]:
+    """Convert a search string to an FTS5 query, the last term (or any term
+    ending in *) matches as a prefix; e.g. "berkshire hath" -> "berkshire" "hath"*
+    Returns None if the search string has no terms
+    """
+    terms = re.findall(r"(\w+)(\*?)", query.lower())
+    if not terms:
+        return None
+
+    last = len(terms) - 1
+    return " ".join(
+        f'"{term}"*' if star or i == last else f'"{term}"'
+        for i, (term, star) in enumerate(terms)
+    )
+
+
+def fts_search(query: str, limit: int = SEARCH_LIMIT) -> Optional[List[dict]]:
+    """Ranked stock search using FTS5, returns None if FTS5 cannot serve the query"""
+    match = to_fts_match(query or "")
+    if match is None:
+        return None
+
+    # escape LIKE wildcards, the search string is matched literally
+    query = query.lower().rstrip("*")
+    pattern = re.sub(r"([\\%_])", r"\\\1", query)
+    params = {
+        "match": match,
+        "query": query,
+        "prefix": f"{pattern}%",
+        "word_prefix": f"% {pattern}%",
+        "limit": limit,
+    }
+    try:
+        rows = db.session.execute(FTS_QUERY, params).all()
+    except OperationalError as e:
+        # e.g. FTS5 table missing from a database created before it was added
+        db.session.rollback()
+        utils.debug_exception(e, suppress=True)
+        return None
+    return [dict(row._mapping) for row in rows]
+
+
+def init_app(app):
+    app.extensions["search_index"] = SearchIndex()
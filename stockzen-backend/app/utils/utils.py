@@ -57,14 +57,13 @@ def bulk_stock_fetch(sym_list: Sequence[str], await_all: bool = False):
     )
     id_list = [tuple[0] for tuple in tuple_list]  # where tuple[0] -> stock_page_id
 
-    # concurrently fetch api data to update each stock page
+    # fetch api data for all stock pages with batched requests
     # pass longer update interval so app does not request bulk from yfinance too often
-    results = executor.map(
-        api_utils.api_stock_request, id_list, repeat(TOP_STOCKS_INTERVAL)
-    )
     if await_all:
-        list(results)  # use the result to force program to wait before continuing
-        print("All concurrent results returned, continuing...")
+        api_utils.api_bulk_stock_request(id_list, TOP_STOCKS_INTERVAL)
+        print("All batched results returned, continuing...")
+    else:
+        executor.submit(api_utils.api_bulk_stock_request, id_list, TOP_STOCKS_INTERVAL)
 
 
 def get_open_challenge():
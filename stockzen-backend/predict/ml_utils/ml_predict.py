@@ -1,6 +1,9 @@
+import os
+
 import numpy as np
 import torch
 from predict.ml_utils import utils
+from predict.ml_utils.registry import registry
 
 """
 Referenced from: https://www.alphavantage.co/academy/#lstm-for-finance
@@ -24,35 +27,80 @@ config = {
         "learning_rate": 0.01,
         "scheduler_step_size": 60,
     },
+    "inference": {
+        "num_threads": min(4, os.cpu_count() or 1),  # intra-op threads for predictions
+    },
 }
 
 
+def init_inference():
+    """Set the intra-op threads used by predictions, once at startup as the
+    setting is process-wide (batch_prediction runs on several executor threads)
+    """
+    torch.set_num_threads(config["inference"]["num_threads"])
+
+
 def prediction(symbols):
-    df = utils.fetch_time_series(symbols, "20d")
-    data_close = np.array(df["Close"])
-    # normalize
-    scaler = utils.Normalizer()
-    normalized_data_close_price = scaler.fit_transform(data_close)
-    data_x, data_x_unseen = utils.prepare_data_x(
-        normalized_data_close_price, window_size=config["data"]["window_size"]
-    )
-
-    new_model = torch.load(f"predict/models/{symbols}.pt")
-    new_model.eval()
-    x = (
-        torch.tensor(data_x_unseen)
-        .float()
-        .to(config["training"]["device"])
-        .unsqueeze(0)
-        .unsqueeze(2)
-    )  # this is the data type and shape required, [batch, sequence, feature]
-    prediction = new_model(x)
-    prediction = prediction.cpu().detach().numpy()
-
-    next_closing_pred = scaler.inverse_transform(prediction)[0]
-    print("predicted price", next_closing_pred)
-    print("closing price", data_close[-1])
-    if next_closing_pred > data_close[-1]:
-        return 1
-    else:
-        return 0
+    """Predict whether the next close is higher (1) or not (0) for one symbol"""
+    return batch_prediction([symbols])[symbols]
+
+
+def batch_prediction(symbols):
+    """Predict whether the next close is higher (1) or not (0) for many symbols,
+    returns dict of sym: prediction, symbols that fail are omitted
+
+    Windows are fetched in one grouped request and models with the same
+    architecture run as one batched forward pass.
+    """
+    frames = utils.fetch_bulk_time_series(symbols, "20d")
+    window_size = config["data"]["window_size"]
+
+    inputs = {}  # sym: (model, window, scaler, last close)
+    for sym in symbols:
+        try:
+            data_close = np.array(frames[sym]["Close"])
+            # normalize
+            scaler = utils.Normalizer()
+            normalized_data_close_price = scaler.fit_transform(data_close)
+            data_x, data_x_unseen = utils.prepare_data_x(
+                normalized_data_close_price, window_size=window_size
+            )
+            inputs[sym] = (
+                registry.get_model(sym),
+                data_x_unseen,
+                scaler,
+                data_close[-1],
+            )
+        except Exception as e:
+            utils.debug_exception(e, suppress=True)
+
+    # group models with the same architecture so they share a forward pass
+    groups = {}
+    for sym, (model, *_) in inputs.items():
+        groups.setdefault(utils.architecture_key(model), []).append(sym)
+
+    outputs = {}
+    with torch.inference_mode():
+        for group in groups.values():
+            models = [inputs[sym][0] for sym in group]
+            x = (
+                torch.tensor(np.stack([inputs[sym][1] for sym in group]))
+                .float()
+                .to(config["training"]["device"])
+                .unsqueeze(2)
+            )  # this is the data type and shape required, [batch, sequence, feature]
+
+            if len(group) > 1 and isinstance(models[0], utils.LSTMModel):
+                predictions = utils.stacked_lstm_forward(models, x)
+            else:
+                predictions = torch.cat(
+                    [model(x[i : i + 1]) for i, model in enumerate(models)]
+                )
+            outputs.update(zip(group, predictions.cpu().numpy()))
+
+    results = {}
+    for sym, prediction in outputs.items():
+        _, _, scaler, last_close = inputs[sym]
+        next_closing_pred = scaler.inverse_transform(prediction.reshape(1))[0]
+        results[sym] = 1 if next_closing_pred > last_close else 0
+    return results
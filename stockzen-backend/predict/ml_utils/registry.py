@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+from typing import Dict, Optional, Sequence
+
+import torch
+
+"""
+Model registry, loads each symbol's LSTM and the accuracy table once per process
+and reloads them only when their file changes
+"""
+
+MODEL_DIR = "predict/models"
+ACCURACY_PATH = "predict/accuracy.json"
+
+
+def load_model(path):
+    # models are saved as whole pickled modules, which newer torch versions
+    # only load with weights_only=False (older versions do not take the argument)
+    try:
+        return torch.load(path, map_location="cpu", weights_only=False)
+    except TypeError:
+        return torch.load(path, map_location="cpu")
+
+
+class ModelRegistry:
+    """Thread-safe cache of LSTM models keyed by symbol"""
+
+    def __init__(self, model_dir: str = MODEL_DIR, accuracy_path: str = ACCURACY_PATH):
+        self.model_dir = model_dir
+        self.accuracy_path = accuracy_path
+        self._lock = threading.Lock()
+        self._models = {}  # sym: (mtime, model)
+        self._accuracy = (None, {})  # (mtime, {sym: accuracy})
+
+    def model_path(self, sym: str) -> str:
+        return os.path.join(self.model_dir, f"{sym}.pt")
+
+    def get_model(self, sym: str) -> torch.nn.Module:
+        """Return the model of a symbol in eval mode, loading it on first use"""
+        path = self.model_path(sym)
+        mtime = os.stat(path).st_mtime
+
+        cached = self._models.get(sym)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with self._lock:
+            # another thread may have loaded it while we waited
+            cached = self._models.get(sym)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+
+            model = load_model(path)
+            model.eval()
+            self._models[sym] = (mtime, model)
+            return model
+
+    def get_accuracy(self, sym: str) -> Optional[float]:
+        """Return the test accuracy of a symbol's model, None if not recorded"""
+        mtime = os.stat(self.accuracy_path).st_mtime
+        if self._accuracy[0] != mtime:
+            with self._lock:
+                if self._accuracy[0] != mtime:
+                    with open(self.accuracy_path, "r") as f:
+                        self._accuracy = (mtime, json.load(f))
+
+        accuracy = self._accuracy[1].get(sym)
+        return float(accuracy) if accuracy is not None else None
+
+    def warmup(self, symbols: Sequence[str]):
+        """Load the models of all symbols up front"""
+        for sym in symbols:
+            self.get_model(sym)
+        usage = self.memory_usage()
+        print(f"Loaded {usage['models']} prediction models ({usage['bytes']} bytes)")
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Number of loaded models and the bytes held by their parameters and buffers"""
+        models = [model for _, model in self._models.values()]
+        tensors = [t for model in models for t in (*model.parameters(), *model.buffers())]
+        return {
+            "models": len(models),
+            "bytes": sum(t.numel() * t.element_size() for t in tensors),
+        }
+
+
+registry = ModelRegistry()
@@ -1,11 +1,12 @@
 import numpy as np
+import torch
 import torch.nn as nn
 from torch.utils.data import Dataset
 from datetime import datetime
 from pandas.core.frame import DataFrame
 import os
 import inspect
-import yfinance as yf
+from app.market_data import get_provider
 
 def debug_exception(error, suppress=False):
     if os.environ.get("FLASK_ENV") == "development":
@@ -25,14 +26,23 @@ def fetch_time_series(
 ) -> DataFrame:
     """Fetch Time Series for symbol asked"""
     try:
-        stock = yf.Ticker(sym)
-        return stock.history(
-            period=period, interval=interval, start=start, end=end, actions=actions
+        return get_provider().history(
+            sym, period=period, interval=interval, start=start, end=end, actions=actions
         )
     except Exception as e:
         debug_exception(e, suppress=True)
 
 
+def fetch_bulk_time_series(sym_list, period: str = "max", interval: str = "1d"):
+    """Fetch Time Series for many symbols in one grouped request,
+    returns dict of sym: DataFrame, symbols without data are omitted"""
+    try:
+        return get_provider().download(sym_list, period=period, interval=interval)
+    except Exception as e:
+        debug_exception(e, suppress=True)
+        return {}
+
+
 """Data preparation Utils""" 
 
 def prepare_data_x(x, window_size):
@@ -129,6 +139,58 @@ class LSTMModel(nn.Module):
         return predictions[:, -1]
 
 
+def architecture_key(model):
+    """Models with the same key have the same layers and weight shapes"""
+    return (
+        type(model),
+        tuple((name, tuple(t.shape)) for name, t in model.state_dict().items()),
+    )
+
+
+def stacked_lstm_forward(models, x):
+    """Eval mode forward pass of many LSTMModels with the same architecture,
+    each with its own weights, as one batched computation
+    x is [n_models, sequence, feature], returns [n_models] predictions
+    """
+    state_dicts = [model.state_dict() for model in models]
+
+    def stack(name):
+        return torch.stack([state_dict[name] for state_dict in state_dicts])
+
+    # layer 1
+    x = torch.relu(
+        torch.einsum("msi,mhi->msh", x, stack("linear_1.weight"))
+        + stack("linear_1.bias").unsqueeze(1)
+    )
+
+    # LSTM layers, gates are ordered input, forget, cell, output
+    h_n = []
+    for layer in range(models[0].lstm.num_layers):
+        w_ih = stack(f"lstm.weight_ih_l{layer}")
+        w_hh = stack(f"lstm.weight_hh_l{layer}")
+        bias = stack(f"lstm.bias_ih_l{layer}") + stack(f"lstm.bias_hh_l{layer}")
+        x_gates = torch.einsum("msh,mgh->msg", x, w_ih) + bias.unsqueeze(1)
+
+        h = x.new_zeros(x.shape[0], w_hh.shape[2])
+        c = x.new_zeros(x.shape[0], w_hh.shape[2])
+        outputs = []
+        for t in range(x.shape[1]):
+            gates = x_gates[:, t] + torch.einsum("mh,mgh->mg", h, w_hh)
+            i, f, g, o = gates.chunk(4, dim=1)
+            c = torch.sigmoid(f) * c + torch.sigmoid(i) * torch.tanh(g)
+            h = torch.sigmoid(o) * torch.tanh(c)
+            outputs.append(h)
+        x = torch.stack(outputs, dim=1)
+        h_n.append(h)
+
+    # layer 2 on the final hidden state of every LSTM layer (dropout is a no-op in eval)
+    x = torch.cat(h_n, dim=1)
+    predictions = torch.einsum("mf,mof->mo", x, stack("linear_2.weight")) + stack(
+        "linear_2.bias"
+    )
+    return predictions[:, -1]
+
+
 """Accuracy Utils"""
 def accuracy_score(y_true, y_pred):
     acc = 0